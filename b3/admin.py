@@ -1,6 +1,11 @@
 from django.contrib import admin
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
 
-from .models import Bucket
+from .jobs import cancel_job
+from .models import Bucket, InventoryState, Job, RequestProfile, UploadSession
 
 class BucketAdmin(admin.ModelAdmin):
     list_display = ('name', 'key_id', 'region', 'service')
@@ -13,4 +18,88 @@ class BucketAdmin(admin.ModelAdmin):
 
 admin.site.register(Bucket, BucketAdmin)
 
+
+class InventoryStateAdmin(admin.ModelAdmin):
+    list_display = ('bucket', 'status', 'generation', 'last_synced')
+    readonly_fields = ('bucket', 'status', 'generation', 'last_synced', 'error')
+
+admin.site.register(InventoryState, InventoryStateAdmin)
+
+
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('key', 'bucket', 'user', 'file_size', 'created')
+    readonly_fields = ('user', 'bucket', 'key', 'key_hash', 'upload_id', 'part_size', 'file_size', 'fingerprint')
+
+admin.site.register(UploadSession, UploadSessionAdmin)
+
+
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created', 'method', 'path', 'view', 'status', 'duration_ms', 'user', 'sampled')
+    list_filter = ('sampled', 'view', 'method')
+    search_fields = ('path',)
+    fields = ('created', 'method', 'path', 'view', 'status', 'duration_ms', 'user', 'sampled', 'downloads', 'report')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description='Duration (ms)', ordering='duration')
+    def duration_ms(self, obj):
+        return f'{obj.duration * 1000:.1f}'
+
+    @admin.display(description='Statistics')
+    def report(self, obj):
+        return format_html('<pre style="white-space: pre; overflow-x: auto;">{}</pre>', obj.stats)
+
+    @admin.display(description='Download')
+    def downloads(self, obj):
+        return format_html(
+            '<a href="{}">pstats (.prof)</a> &middot; <a href="{}">collapsed stacks (.folded)</a>',
+            reverse('admin:b3_requestprofile_download', args=[obj.pk, 'prof']),
+            reverse('admin:b3_requestprofile_download', args=[obj.pk, 'folded']),
+        )
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/<str:kind>/', self.admin_site.admin_view(self.download),
+                 name='b3_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download(self, request, pk, kind):
+        # .prof files open with pstats or snakeviz, .folded files with flamegraph.pl or speedscope
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        if not self.has_view_permission(request, profile):
+            return HttpResponse(status=403)
+        if kind == 'prof':
+            response = HttpResponse(bytes(profile.profile), content_type='application/octet-stream')
+        else:
+            response = HttpResponse(profile.stacks, content_type='text/plain; charset=utf-8')
+            kind = 'folded'
+        response['Content-Disposition'] = f'attachment; filename="b3-profile-{profile.pk}.{kind}"'
+        return response
+
+admin.site.register(RequestProfile, RequestProfileAdmin)
+
 # Register your models here.
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('created', 'kind', 'bucket', 'user', 'status', 'processed', 'total', 'finished')
+    list_filter = ('status', 'kind')
+    fields = ('kind', 'bucket', 'user', 'status', 'processed', 'total', 'params', 'result', 'error',
+              'checkpoint', 'cancel_requested', 'worker', 'heartbeat', 'created', 'started', 'finished')
+    readonly_fields = fields
+    actions = ('cancel_jobs',)
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Cancel selected jobs')
+    def cancel_jobs(self, request, queryset):
+        for job in queryset:
+            cancel_job(job)
+
+admin.site.register(Job, JobAdmin)
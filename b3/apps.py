@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class B3Config(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'b3'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,376 @@
+"""
+Async versions of the S3-bound views, used when the site is served through
+main/asgi.py (B3_SERVER=asgi). The bucket lookup runs through sync_to_async,
+and every blocking S3 call runs on a bounded thread pool so that slow listings
+don't hold up the event loop.
+"""
+import asyncio
+import json
+import logging
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET
+
+from .archive import iter_zip
+from .metrics import ContextThreadPoolExecutor, timed
+from .models import JobOutput
+from .s3 import client_registry
+from .services import get_s3_handle, record_upload, record_policy_uploads, record_delete, get_folder_rollups
+from .views import build_dir_tree, build_dir_contents, get_part_window, add_folder_rollups
+from .views import get_resume_details, forget_stale_sessions
+from .views import expand_dir_tree, get_tree_rollups, get_expand_request, render_dir_tree
+from .views import check_upload_sizes, object_redirect, read_sync_request, get_file_sizes
+from .views import get_zip_selection, get_user_job
+from . import uploads
+
+logger = logging.getLogger(__name__)
+
+
+# Calls made on the pool are charged to the Server-Timing of their request
+executor = ContextThreadPoolExecutor(max_workers=getattr(settings, 'B3_ASYNC_S3_WORKERS', 32),
+                                     thread_name_prefix='b3-s3')
+
+
+async def run_s3(func, *args):
+    """
+    Run a blocking S3 call on the bounded S3 thread pool.
+    :param func: (callable) Function to be called
+    :return: Result of the call
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args))
+
+
+async def aget_s3_handle(bucket_name):
+    # Registered handles don't need the database
+    s3 = client_registry.get_bucket(bucket_name)
+    if s3:
+        return s3
+    return await sync_to_async(get_s3_handle)(bucket_name)
+
+
+async def aiter_upload_plans(user, s3, bucket_name, file_list, part_window, concurrency):
+    # Async version of views.iter_upload_plans, pulling the plans on the S3 thread pool
+    plans = s3.iter_start_upload(file_list, part_window, concurrency)
+    try:
+        while (item := await run_s3(next, plans, None)) is not None:
+            index, plan = item
+            await sync_to_async(uploads.create_sessions)(user, bucket_name, [file_list[index]], [plan])
+            yield json.dumps({'index': index, **plan}) + '\n'
+    except Exception as e:
+        logger.exception('Error streaming a response')
+        yield json.dumps({'error': str(e)}) + '\n'
+    finally:
+        await run_s3(plans.close)
+
+
+async def aiter_signed_urls(s3, folder_list, file_list, method, file_sizes=None):
+    # Async version of views.iter_signed_urls, pulling the entries on the S3 thread pool
+    entries = s3.iter_signed_urls(folder_list, file_list, method, file_sizes=file_sizes)
+    try:
+        while (entry := await run_s3(next, entries, None)) is not None:
+            yield json.dumps(entry) + '\n'
+    except Exception as e:
+        logger.exception('Error streaming a response')
+        yield json.dumps({'error': str(e)}) + '\n'
+    finally:
+        await run_s3(entries.close)
+
+
+async def aiter_zip(s3, folder_list, file_list):
+    # Async version of archive.iter_zip: every archive chunk is built on the S3 thread
+    # pool, so that ASGI sends it right away instead of buffering the whole archive
+    chunks = iter_zip(s3, folder_list, file_list)
+    try:
+        while (chunk := await run_s3(next, chunks, None)) is not None:
+            yield chunk
+    finally:
+        await run_s3(chunks.close)
+
+
+async def aiter_job_output(job):
+    # One query per output chunk, so that large outputs are never held in memory
+    index = 0
+    outputs = JobOutput.objects.filter(job=job).values_list('data', flat=True)
+    while (data := await outputs.filter(index=index).afirst()) is not None:
+        yield data
+        index += 1
+
+
+def json_response(result):
+    return HttpResponse(json.dumps({'result': result}), content_type='application/json')
+
+
+@login_required(login_url='/')
+async def expandDir(request):
+
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        bucket_name = post_data.get('bucket_name')
+        s3 = await aget_s3_handle(bucket_name)
+        if 'prefixes' not in post_data:
+            dir_path = post_data.get('dir_path')
+            rollups = await sync_to_async(get_folder_rollups)(bucket_name, None, dir_path)
+            html_str = await run_s3(build_dir_tree, s3, bucket_name, dir_path, rollups)
+            return json_response(html_str)
+
+        prefixes, depth = get_expand_request(post_data)
+        tree = await run_s3(expand_dir_tree, s3, bucket_name, prefixes, depth)
+        rollups = await sync_to_async(get_tree_rollups)(bucket_name, tree)
+        with timed('render'):
+            result = {prefix: render_dir_tree(bucket_name, prefix, tree, rollups) for prefix in prefixes}
+        return json_response(result)
+    else:
+        return json_response('error')
+
+
+@login_required(login_url='/')
+@gzip_page
+async def listDir(request):
+
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        dir_path = post_data.get('dir_path')
+        bucket_name = post_data.get('bucket_name')
+        cursor = post_data.get('cursor')
+        s3 = await aget_s3_handle(bucket_name)
+        contents = await run_s3(build_dir_contents, s3, bucket_name, dir_path, cursor)
+        await sync_to_async(add_folder_rollups)(bucket_name, contents)
+        with timed('render'):
+            body = json.dumps({'result': contents}, separators=(',', ':'))
+        return HttpResponse(body, content_type='application/json')
+    else:
+        return json_response('error')
+
+
+@login_required(login_url='/')
+async def download(request):
+
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        bucket = post_data.get('bucket')
+        folder_list = json.loads(post_data.get('folder_list'))
+        file_list = json.loads(post_data.get('file_list'))
+        method = post_data.get('method')
+        file_sizes = get_file_sizes(post_data, file_list)
+
+        s3 = await aget_s3_handle(bucket)
+        if not s3:
+            return json_response(f'error {bucket} not found')
+
+        return StreamingHttpResponse(aiter_signed_urls(s3, folder_list, file_list, method, file_sizes),
+                                     content_type='application/x-ndjson')
+    else:
+        return json_response('error')
+
+
+@require_GET
+@login_required(login_url='/')
+async def get_object(request, bucket, key):
+
+    s3 = await aget_s3_handle(bucket)
+    if not s3:
+        raise Http404(f'{bucket} not found')
+
+    return object_redirect(*await run_s3(s3.get_object_url, bucket, key))
+
+
+@login_required(login_url='/')
+async def download_zip(request):
+    # Posted by a form so that the browser saves the streamed archive itself
+
+    if request.method == 'POST':
+        bucket = request.POST.get('bucket')
+        folder_list = json.loads(request.POST.get('folder_list', '[]'))
+        file_list = json.loads(request.POST.get('file_list', '[]'))
+
+        s3 = await aget_s3_handle(bucket)
+        if not s3:
+            return json_response(f'error {bucket} not found')
+
+        folder_list, file_list, archive_name = get_zip_selection(s3, bucket, folder_list, file_list)
+        response = StreamingHttpResponse(aiter_zip(s3, folder_list, file_list), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{archive_name}.zip"'
+        return response
+    else:
+        return json_response('error')
+
+
+@login_required(login_url='/')
+async def start_upload(request):
+
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        bucket = post_data.get('bucket')
+        file_list = json.loads(post_data.get('file_list'))
+        part_window = post_data.get('part_window')
+        concurrency = post_data.get('concurrency')
+
+        s3 = await aget_s3_handle(bucket)
+        if not s3:
+            return json_response(f'error {bucket} not found')
+
+        try:
+            check_upload_sizes(file_list)
+        except ValueError as e:
+            return json_response(f'error {e}')
+
+        return StreamingHttpResponse(aiter_upload_plans(request.user, s3, bucket, file_list, part_window, concurrency),
+                                     content_type='application/x-ndjson')
+    else:
+        return json_response('error')
+
+
+@login_required(login_url='/')
+async def sync_upload(request):
+
+    if request.method == 'POST':
+        try:
+            bucket, prefix, manifest, find_deletes = read_sync_request(request)
+        except ValueError as e:
+            return json_response(f'error {e}')
+
+        s3 = await aget_s3_handle(bucket)
+        if not s3:
+            return json_response(f'error {bucket} not found')
+
+        response = await run_s3(uploads.diff_manifest, s3, bucket, prefix, manifest, find_deletes)
+        return HttpResponse(json.dumps({'result': response}, separators=(',', ':')), content_type='application/json')
+    else:
+        return json_response('error')
+
+
+@login_required(login_url='/')
+async def upload_policy(request):
+
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        operation = post_data.get('operation')
+        bucket = post_data.get('bucket')
+        prefix = post_data.get('prefix', '')
+
+        s3 = await aget_s3_handle(bucket)
+        if not s3:
+            return json_response(f'error {bucket} not found')
+
+        response = None
+        if operation == 'create':
+            response = await run_s3(s3.generate_upload_policy, bucket, prefix)
+
+        elif operation == 'complete':
+            keys = [key for key in json.loads(post_data.get('keys', '[]')) if key.startswith(prefix)]
+            await sync_to_async(record_policy_uploads)(s3, bucket, keys)
+            response = 'ok'
+
+        return json_response(response)
+    else:
+        return json_response('error')
+
+
+@login_required(login_url='/')
+async def resume_upload(request):
+
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        bucket = post_data.get('bucket')
+        file_list = json.loads(post_data.get('file_list'))
+
+        s3 = await aget_s3_handle(bucket)
+        if not s3:
+            return json_response(f'error {bucket} not found')
+
+        sessions = await sync_to_async(uploads.find_sessions)(request.user, bucket, file_list)
+        response = await run_s3(get_resume_details, s3, bucket, sessions)
+        await sync_to_async(forget_stale_sessions)(sessions, response)
+        return json_response(response)
+    else:
+        return json_response('error')
+
+
+@login_required(login_url='/')
+async def upload_parts(request):
+
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        bucket = post_data.get('bucket')
+        key = post_data.get('object_path')
+        upload_id = post_data.get('upload_id')
+        try:
+            first_part, count = get_part_window(post_data)
+        except ValueError as e:
+            return json_response(f'error {e}')
+
+        s3 = await aget_s3_handle(bucket)
+        if not s3:
+            return json_response(f'error {bucket} not found')
+
+        response = await run_s3(s3.get_part_urls, bucket, key, upload_id, first_part, count)
+        return json_response(response)
+    else:
+        return json_response('error')
+
+
+@login_required(login_url='/')
+async def finish_upload(request):
+
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        bucket = post_data.get('bucket')
+        key = post_data.get('object_path')
+        upload_id = post_data.get('upload_id')
+        upload_parts = json.loads(post_data.get('parts'))
+
+        s3 = await aget_s3_handle(bucket)
+        if not s3:
+            return json_response(f'error {bucket} not found')
+
+        if await run_s3(s3.complete_upload, bucket, key, upload_id, upload_parts):
+            await sync_to_async(record_upload)(s3, bucket, key)
+        await sync_to_async(uploads.drop_sessions)([upload_id])
+        return json_response('ok')
+    else:
+        return json_response('error')
+
+
+@login_required(login_url='/')
+async def delete(request):
+
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        operation = post_data.get('operation')
+        bucket = post_data.get('bucket')
+
+        s3 = await aget_s3_handle(bucket)
+        if not s3:
+            return json_response(f'error {bucket} not found')
+
+        response = None
+        if operation == 'prepare':
+            folder_list = json.loads(post_data.get('folder_list'))
+            file_list = json.loads(post_data.get('file_list'))
+            response = await run_s3(s3.prepare_delete, folder_list, file_list)
+
+        elif operation == 'initiate':
+            delete_list = json.loads(post_data.get('delete_list', '[]'))
+            folder_list = json.loads(post_data.get('folder_list', '[]'))
+            response = await run_s3(s3.initiate_delete, delete_list, folder_list)
+            await sync_to_async(record_delete)(s3, bucket, folder_list, delete_list, response)
+
+        return json_response(response)
+    else:
+        return json_response('error')
+
+
+@require_GET
+@login_required(login_url='/')
+async def job_output(request, job_id):
+
+    job = await sync_to_async(get_user_job)(request, job_id)
+    if job.status != 'done':
+        return json_response(f'error job {job_id} is {job.status}')
+    return StreamingHttpResponse(aiter_job_output(job), content_type='application/x-ndjson')
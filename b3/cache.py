@@ -0,0 +1,313 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+LISTING_CACHE_DEFAULTS = {
+    'BACKEND': 'local',     # 'local' (per process) or 'django' (shared through CACHES)
+    'ALIAS': 'default',     # Django cache alias used by the 'django' backend
+    'TTL': 60,              # Seconds a listing page stays valid
+    'MAX_ENTRIES': 2048,    # Size bound of the 'local' backend
+}
+
+# Version tokens outlive the pages cached under them, but still expire so that
+# the shared cache doesn't keep one token per folder ever listed or written
+VERSION_TTL_FACTOR = 10
+
+PRESIGNED_URL_DEFAULTS = {
+    'EXPIRY': 3600,         # Seconds a presigned URL stays valid
+    'REFRESH_MARGIN': 600,  # Cached URLs are re-signed when they have less validity left
+    'MAX_ENTRIES': 4096,    # Size bound of the per-process URL cache
+}
+
+
+def get_parent_prefixes(key):
+    """
+    Get every folder prefix whose listing contains the given key.
+    e.g. 'a/b/c.txt' -> ['', 'a/', 'a/b/']
+    :param key: (str) S3 object key
+    :return: (list) Folder prefixes including the bucket root ('')
+    """
+    return [''] + [key[:i + 1] for i, c in enumerate(key) if c == '/']
+
+
+class LocalStore:
+    """
+    In-process cache store with TTL expiry and LRU eviction.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires_at = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if key in self._data:
+                return False
+        self.set(key, value, timeout)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DjangoStore:
+    """
+    Cache store backed by one of the caches configured in settings.CACHES,
+    so that every worker process shares the same entries.
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.evictions = None
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.cache.set(key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        return self.cache.add(key, value, timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+    def __len__(self):
+        return 0
+
+
+class ListingCache:
+    """
+    Cache of listing pages keyed by (bucket, prefix, delimiter).
+
+    Each (bucket, prefix, delimiter) has a version token which is part of
+    the key of its cached pages. Invalidation replaces the version token, so
+    it works the same way for the in-process and the shared store, without
+    having to enumerate the cached pages.
+    """
+
+    def __init__(self, config=None):
+        self._config = config
+        self._store = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = {**LISTING_CACHE_DEFAULTS, **getattr(settings, 'B3_LISTING_CACHE', {})}
+        return self._config
+
+    @property
+    def store(self):
+        if self._store is None:
+            if self.config['BACKEND'] == 'django':
+                self._store = DjangoStore(self.config['ALIAS'])
+            else:
+                self._store = LocalStore(self.config['MAX_ENTRIES'])
+        return self._store
+
+    @property
+    def version_ttl(self):
+        return max(self.config['TTL'], 1) * VERSION_TTL_FACTOR
+
+    @staticmethod
+    def _make_key(*parts):
+        # Object keys can be long and contain any character, which Django
+        # cache backends (memcached in particular) do not accept as keys
+        digest = hashlib.sha1('\0'.join(str(p) for p in parts).encode()).hexdigest()
+        return f'b3:{parts[0]}:{digest}'
+
+    def _get_version(self, bucket_name, prefix, delimiter):
+        version_key = self._make_key('version', bucket_name, prefix, delimiter)
+        version = self.store.get(version_key)
+        if version is None:
+            # Never fall back to a fixed version: pages cached under an
+            # evicted version could otherwise become visible again
+            self.store.add(version_key, uuid.uuid4().hex, self.version_ttl)
+            version = self.store.get(version_key)
+        return version
+
+    def get_page(self, bucket_name, prefix, delimiter, cursor, page_size, loader):
+        """
+        Get a listing page from the cache or load and cache it.
+        :param bucket_name: (str) S3 bucket name
+        :param prefix: (str) Listing prefix
+        :param delimiter: (str) Listing delimiter
+        :param cursor: (str) Continuation token of the page (None for the first page)
+        :param page_size: (int) Maximum number of entries in the page
+        :param loader: (callable) Returns the page when it is not cached
+        :return: The cached or loaded page
+        """
+        if self.config['TTL'] <= 0:
+            return loader()
+
+        version = self._get_version(bucket_name, prefix, delimiter)
+        page_key = self._make_key('page', bucket_name, prefix, delimiter, version, cursor, page_size)
+
+        page = self.store.get(page_key)
+        if page is not None:
+            with self._lock:
+                self.hits += 1
+            return page
+
+        with self._lock:
+            self.misses += 1
+        page = loader()
+        self.store.set(page_key, page, self.config['TTL'])
+        return page
+
+    def invalidate(self, bucket_name, keys):
+        """
+        Invalidate the cached listings which contain any of the given keys,
+        i.e. the flat and the delimited listings of every parent folder.
+        :param bucket_name: (str) S3 bucket name
+        :param keys: (iterable) Keys of the objects that were written or deleted
+        """
+        prefixes = set()
+        for key in keys:
+            prefixes.update(get_parent_prefixes(key))
+
+        for prefix in prefixes:
+            for delimiter in ('/', ''):
+                version_key = self._make_key('version', bucket_name, prefix, delimiter)
+                self.store.set(version_key, uuid.uuid4().hex, self.version_ttl)
+
+        with self._lock:
+            self.invalidations += len(prefixes)
+
+    def clear(self):
+        self.store.clear()
+
+    def stats(self):
+        """
+        Get the hit/miss counters of this process.
+        :return: (dict) Cache statistics
+        """
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.config['BACKEND'],
+            'ttl': self.config['TTL'],
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'invalidations': self.invalidations,
+            'evictions': self.store.evictions,
+            'entries': len(self.store) if self.config['BACKEND'] == 'local' else None,
+        }
+
+
+listing_cache = ListingCache()
+
+
+class PresignedUrlCache:
+    """
+    Per-process cache of presigned GET URLs keyed by (access key, bucket, key).
+
+    A cached URL is handed out until REFRESH_MARGIN seconds before it expires,
+    so that every URL returned stays usable for at least that long. Signing is
+    local to the process, so the URLs are not shared between workers.
+    """
+
+    def __init__(self, config=None):
+        self._config = config
+        self._store = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = {**PRESIGNED_URL_DEFAULTS, **getattr(settings, 'B3_PRESIGNED_URLS', {})}
+        return self._config
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = LocalStore(self.config['MAX_ENTRIES'])
+        return self._store
+
+    def get_url(self, key_id, bucket_name, key, signer):
+        """
+        Get a presigned URL from the cache or sign and cache it.
+        :param key_id: (str) Access key ID the URL is signed with
+        :param bucket_name: (str) S3 bucket name
+        :param key: (str) S3 object key
+        :param signer: (callable) Signs the URL for the given number of seconds
+        :return: (tuple) Presigned URL and the number of seconds it stays valid
+        """
+        cache_key = (key_id, bucket_name, key)
+        item = self.store.get(cache_key)
+        if item is not None:
+            with self._lock:
+                self.hits += 1
+            url, expires_at = item
+            return url, int(expires_at - time.time())
+
+        with self._lock:
+            self.misses += 1
+        expiry = self.config['EXPIRY']
+        url = signer(expiry)
+        self.store.set(cache_key, (url, time.time() + expiry), max(expiry - self.config['REFRESH_MARGIN'], 0))
+        return url, expiry
+
+    def clear(self):
+        self.store.clear()
+
+    def stats(self):
+        """
+        Get the hit/miss counters of this process.
+        :return: (dict) Cache statistics
+        """
+        lookups = self.hits + self.misses
+        return {
+            'expiry': self.config['EXPIRY'],
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.store.evictions,
+            'entries': len(self.store),
+        }
+
+
+url_cache = PresignedUrlCache()
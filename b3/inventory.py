@@ -0,0 +1,502 @@
+"""
+Local, database-backed inventory of the objects of every bucket.
+
+The inventory is filled by a bulk crawl of the bucket (sync_inventory), kept
+up to date by incremental syncs of the whole bucket or of a single folder, and
+updated right away by the uploads and deletes done through b3. Folder listings,
+searches and size totals can then be answered with indexed queries.
+"""
+from datetime import datetime, timezone
+from collections import defaultdict
+from itertools import islice
+import hashlib
+import re
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, Left, Reverse, Substr
+
+from .models import Bucket, FolderRollup, InventoryState, ObjectEntry
+from .s3 import ObjectRecord
+
+
+SYNC_BATCH_SIZE = 1000
+
+# Length of the indexed copies of the key and of the object name (see ObjectEntry)
+INDEX_LENGTH = 191
+
+
+def hash_str(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def get_parent(key):
+    """
+    Get the folder prefix of a key, e.g. 'a/b/c.txt' -> 'a/b/' and 'a/b/' -> 'a/'
+    :param key: (str) S3 object key
+    :return: (str) Parent folder prefix ('' for the bucket root)
+    """
+    return key[:key.rstrip('/').rfind('/') + 1]
+
+
+def get_folders(key):
+    """
+    Get the folders an object counts towards, e.g. 'a/b/c.txt' -> ['a/b/', 'a/', '']
+    :param key: (str) S3 object key
+    :return: (list) Folder prefixes from the parent up to the bucket root ('')
+    """
+    folders = [get_parent(key)]
+    while folders[-1]:
+        folders.append(get_parent(folders[-1]))
+    return folders
+
+
+def prefix_filter(prefix, field='key'):
+    """
+    Build a filter matching every entry whose key starts with the prefix,
+    using the indexed key_prefix column.
+    :param prefix: (str) Key prefix
+    :param field: (str) Full-length column the key_prefix column is a copy of
+    :return: (Q) Query filter
+    """
+    if len(prefix) <= INDEX_LENGTH:
+        return Q(key_prefix__startswith=prefix)
+    return Q(key_prefix=prefix[:INDEX_LENGTH], **{f'{field}__startswith': prefix})
+
+
+def make_entry(bucket, record, generation):
+    """
+    Build the inventory entry of a listed object.
+    :param bucket: (Bucket) Bucket of the object
+    :param record: (ObjectRecord) Listing record of the object
+    :param generation: (int) Sync generation the entry was seen in
+    :return: (ObjectEntry) Unsaved inventory entry
+    """
+    parent = get_parent(record.key)
+    return ObjectEntry(
+        bucket=bucket,
+        key=record.key,
+        parent=parent,
+        size=record.size,
+        etag=record.etag,
+        last_modified=datetime.fromtimestamp(record.mtime, timezone.utc),
+        generation=generation,
+        key_hash=hash_str(record.key),
+        key_prefix=record.key[:INDEX_LENGTH],
+        parent_hash=hash_str(parent),
+        name=record.key[len(parent):][:INDEX_LENGTH],
+        key_reversed=record.key[::-1][:INDEX_LENGTH],
+    )
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def get_state(bucket):
+    state, _ = InventoryState.objects.get_or_create(bucket=bucket)
+    return state
+
+
+def has_inventory(bucket_name):
+    """
+    Check whether a bucket has an inventory to be kept up to date.
+    :param bucket_name: (str) S3 bucket name
+    :return: (bool) True when the bucket has been synced at least once
+    """
+    return InventoryState.objects.filter(bucket__name=bucket_name, last_synced__isnull=False).exists()
+
+
+def sync_inventory(bucket, s3, prefix=''):
+    """
+    Bring the inventory of a bucket, or of a folder of it, in line with S3.
+    The first sync bulk inserts the whole listing. Later syncs only write the
+    entries that changed, stamp the unchanged ones with the new generation in
+    one query per batch, and remove the entries that are no longer listed.
+    :param bucket: (Bucket) Bucket to be synced
+    :param s3: (S3) S3 handle of the bucket
+    :param prefix: (str) Folder prefix to sync ('' for the whole bucket)
+    :return: (dict) Number of created, updated and removed entries
+    """
+    state = get_state(bucket)
+    InventoryState.objects.filter(pk=state.pk).update(generation=F('generation') + 1, status='syncing')
+    state.refresh_from_db()
+    generation = state.generation
+
+    initial = not ObjectEntry.objects.filter(bucket=bucket).filter(prefix_filter(prefix)).exists()
+    result = {'created': 0, 'updated': 0, 'removed': 0}
+
+    try:
+        for batch in batched(s3.walk(bucket.name, prefix), SYNC_BATCH_SIZE):
+            entries = {entry.key_hash: entry for entry in (make_entry(bucket, r, generation) for r in batch)}
+
+            if initial:
+                ObjectEntry.objects.bulk_create(entries.values(), ignore_conflicts=True)
+                result['created'] += len(entries)
+                continue
+
+            stored = ObjectEntry.objects.filter(bucket=bucket, key_hash__in=entries.keys()) \
+                .values_list('key_hash', 'pk', 'size', 'etag', 'last_modified')
+
+            to_update = []
+            unchanged = []
+            for key_hash, pk, size, etag, last_modified in stored:
+                entry = entries.pop(key_hash)
+                if (size, etag, last_modified) == (entry.size, entry.etag, entry.last_modified):
+                    unchanged.append(pk)
+                else:
+                    entry.pk = pk
+                    to_update.append(entry)
+
+            with transaction.atomic():
+                ObjectEntry.objects.bulk_create(entries.values(), ignore_conflicts=True)
+                ObjectEntry.objects.bulk_update(to_update, ['size', 'etag', 'last_modified', 'generation'])
+                ObjectEntry.objects.filter(pk__in=unchanged).update(generation=generation)
+
+            result['created'] += len(entries)
+            result['updated'] += len(to_update)
+
+        result['removed'], _ = ObjectEntry.objects.filter(bucket=bucket, generation__lt=generation) \
+            .filter(prefix_filter(prefix)).delete()
+
+        rebuild_rollups(bucket, prefix)
+
+        # Entries recorded before the reversed keys were added
+        ObjectEntry.objects.filter(bucket=bucket, key_reversed='') \
+            .update(key_reversed=Left(Reverse('key'), INDEX_LENGTH))
+
+    except Exception as e:
+        InventoryState.objects.filter(pk=state.pk).update(status='failed', error=str(e))
+        raise
+
+    InventoryState.objects.filter(pk=state.pk).update(status='ready', error='', last_synced=datetime.now(timezone.utc))
+    return result
+
+
+def record_objects(bucket_name, records):
+    """
+    Add or refresh the inventory entries of objects written through b3.
+    :param bucket_name: (str) S3 bucket name
+    :param records: (list) ObjectRecords of the written objects
+    """
+    bucket = Bucket.objects.filter(name=bucket_name).first()
+    if not bucket:
+        return
+    generation = get_state(bucket).generation
+    entries = [make_entry(bucket, record, generation) for record in records]
+
+    # MySQL upserts on any unique key and does not accept unique_fields
+    unique_fields = ['bucket', 'key_hash'] if connection.features.supports_update_conflicts_with_target else None
+    ObjectEntry.objects.bulk_create(
+        entries, update_conflicts=True, unique_fields=unique_fields,
+        update_fields=['size', 'etag', 'last_modified', 'generation'],
+    )
+    mark_dirty(bucket, {folder for record in records for folder in get_folders(record.key)})
+
+
+def remove_objects(bucket_name, folders=(), keys=(), kept_keys=()):
+    """
+    Remove the inventory entries of objects deleted through b3.
+    :param bucket_name: (str) S3 bucket name
+    :param folders: (list) Folder prefixes deleted recursively
+    :param keys: (list) Keys of deleted objects
+    :param kept_keys: (list) Keys that could not be deleted
+    """
+    bucket = Bucket.objects.filter(name=bucket_name).first()
+    if not bucket:
+        return
+    query = Q(key_hash__in=[hash_str(key) for key in keys])
+    for folder in folders:
+        query |= prefix_filter(folder)
+
+    ObjectEntry.objects.filter(bucket=bucket).filter(query) \
+        .exclude(key_hash__in=[hash_str(key) for key in kept_keys]).delete()
+
+    # The rollups of deleted folders are recomputed (and dropped once empty) when read
+    subfolders = Q(pk__in=[])
+    for folder in folders:
+        subfolders |= prefix_filter(folder, 'prefix')
+    FolderRollup.objects.filter(bucket=bucket).filter(subfolders).update(dirty=True, version=F('version') + 1)
+    mark_dirty(bucket, {folder for key in [*keys, *folders] for folder in get_folders(key)})
+
+
+def make_rollup(bucket, prefix, size=0, count=0, dirty=True):
+    return FolderRollup(
+        bucket=bucket,
+        prefix=prefix,
+        size=size,
+        count=count,
+        dirty=dirty,
+        prefix_hash=hash_str(prefix),
+        key_prefix=prefix[:INDEX_LENGTH],
+        parent_hash=hash_str(get_parent(prefix)) if prefix else '',
+    )
+
+
+def rebuild_rollups(bucket, prefix=''):
+    """
+    Recompute the folder rollups below a prefix from the inventory, with a
+    single grouped query. The folders above the prefix are marked dirty.
+    :param bucket: (Bucket) Bucket of the folders
+    :param prefix: (str) Folder prefix ('' for the whole bucket)
+    """
+    totals = defaultdict(lambda: [0, 0])
+    direct = ObjectEntry.objects.filter(bucket=bucket).filter(prefix_filter(prefix)) \
+        .values_list('parent').annotate(size=Sum('size'), count=Count('pk')).order_by()
+    for parent, size, count in direct:
+        for folder in [parent, *get_folders(parent)] if parent else ['']:
+            if not folder.startswith(prefix):
+                break
+            totals[folder][0] += size
+            totals[folder][1] += count
+
+    with transaction.atomic():
+        FolderRollup.objects.filter(bucket=bucket).filter(prefix_filter(prefix, 'prefix')).delete()
+        for batch in batched(totals.items(), SYNC_BATCH_SIZE):
+            FolderRollup.objects.bulk_create(
+                [make_rollup(bucket, folder, size, count, dirty=False) for folder, (size, count) in batch])
+
+    if prefix:
+        mark_dirty(bucket, get_folders(prefix))
+
+
+def mark_dirty(bucket, folders):
+    """
+    Mark the rollups of folders whose contents changed, so that only these
+    subtrees are recomputed when read. Missing folders are created dirty.
+    :param bucket: (Bucket) Bucket of the folders
+    :param folders: (iterable) Folder prefixes, including all their parents
+    """
+    folders = set(folders)
+    if not folders:
+        return
+    FolderRollup.objects.filter(bucket=bucket, prefix_hash__in=[hash_str(folder) for folder in folders]) \
+        .update(dirty=True, version=F('version') + 1)
+    FolderRollup.objects.bulk_create([make_rollup(bucket, folder) for folder in folders], ignore_conflicts=True)
+
+
+def refresh_rollup(rollup):
+    """
+    Recompute a dirty rollup from its direct objects and its subfolders,
+    recomputing the dirty subfolders first. Empty folders are removed.
+    :param rollup: (FolderRollup) Dirty rollup
+    """
+    version = rollup.version
+    size = count = 0
+    for child in FolderRollup.objects.filter(bucket_id=rollup.bucket_id, parent_hash=rollup.prefix_hash):
+        if child.dirty:
+            refresh_rollup(child)
+        size += child.size
+        count += child.count
+
+    direct = ObjectEntry.objects.filter(bucket_id=rollup.bucket_id, parent_hash=rollup.prefix_hash) \
+        .aggregate(size=Coalesce(Sum('size'), 0), count=Count('pk'))
+    rollup.size = size + direct['size']
+    rollup.count = count + direct['count']
+
+    if rollup.count == 0 and rollup.prefix:
+        FolderRollup.objects.filter(pk=rollup.pk, version=version).delete()
+        return
+    # Keep the rollup dirty if it changed again meanwhile
+    if FolderRollup.objects.filter(pk=rollup.pk, version=version) \
+            .update(size=rollup.size, count=rollup.count, dirty=False):
+        rollup.dirty = False
+
+
+def count_entries(bucket_name, keys):
+    """
+    Count the inventory entries of a list of keys, e.g. to know which folder markers exist.
+    :param bucket_name: (str) S3 bucket name
+    :param keys: (list) Object keys
+    :return: (int) Number of keys found in the inventory
+    """
+    return ObjectEntry.objects.filter(bucket__name=bucket_name, key_hash__in=[hash_str(key) for key in keys]).count()
+
+
+def get_rollups(bucket_name, prefixes=None, parent=None):
+    """
+    Get the recursive size and object count of folders, recomputing only the
+    folders that changed since they were last read.
+    :param bucket_name: (str) S3 bucket name
+    :param prefixes: (list) Folder prefixes to get
+    :param parent: (str) Get every subfolder of this folder instead
+    :return: (dict) Size and count of each known folder, by prefix
+    """
+    rollups = FolderRollup.objects.filter(bucket__name=bucket_name)
+    if parent is not None:
+        rollups = rollups.filter(parent_hash=hash_str(parent))
+    else:
+        rollups = rollups.filter(prefix_hash__in=[hash_str(prefix) for prefix in prefixes])
+
+    result = {}
+    for rollup in rollups:
+        if rollup.dirty:
+            refresh_rollup(rollup)
+        if rollup.count or not rollup.prefix:
+            result[rollup.prefix] = {'size': rollup.size, 'count': rollup.count}
+    return result
+
+
+SEARCH_MODES = ('prefix', 'substring', 'glob', 'regex')
+MAX_SEARCH_PAGE_SIZE = 500
+
+# Matches ranked by relevance, later matches come in key order
+SEARCH_RANK_CANDIDATES = 1000
+
+# Largest folder searched with a query that no index serves (substring, regex and
+# globs with no text at their start or end), which reads every entry of the folder
+SEARCH_SCAN_LIMIT = 1000000
+
+
+def glob_to_regex(pattern):
+    """
+    Translate a glob pattern ('*', '?' and '[...]') into a regular expression
+    understood by the database backends.
+    :param pattern: (str) Glob pattern
+    :return: (str) Anchored regular expression
+    """
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '*':
+            regex += '.*'
+        elif c == '?':
+            regex += '.'
+        elif c == '[' and ']' in pattern[i + 1:]:
+            end = pattern.index(']', i + 1)
+            regex += '[' + pattern[i + 1:end].replace('!', '^', 1) + ']'
+            i = end
+        elif c.isalnum() or c in ' _-/':
+            regex += c
+        else:
+            regex += '\\' + c
+        i += 1
+    return '^' + regex + '$'
+
+
+def search(bucket_name, query, mode='substring', prefix='', min_size=None, max_size=None,
+           modified_after=None, modified_before=None, cursor=None, page_size=100):
+    """
+    Search the inventory of a bucket by object name.
+    Queries are narrowed to the folder prefix first (indexed key_prefix). Prefix
+    queries and globs starting with text use the name index, globs ending with
+    text (e.g. '*.pdf') the reversed key index. The other queries read every entry
+    of the folder, so they are refused on folders of more than SEARCH_SCAN_LIMIT
+    objects. Names are matched unless the query contains '/', which matches the
+    key relative to the folder prefix instead. Matches are read in key order
+    through the key_prefix index, so no query sorts all its matches: the first
+    SEARCH_RANK_CANDIDATES matches are ranked (exact name matches, then names
+    starting with the query, then the others, shorter keys first), and the
+    following matches come in key order.
+    :param bucket_name: (str) S3 bucket name
+    :param query: (str) Search query
+    :param mode: (str) 'prefix', 'substring', 'glob' or 'regex'
+    :param prefix: (str) Folder prefix to search in ('' for the whole bucket)
+    :param min_size: (int) Minimum object size in bytes (optional)
+    :param max_size: (int) Maximum object size in bytes (optional)
+    :param modified_after: (datetime) Only objects modified after this time (optional)
+    :param modified_before: (datetime) Only objects modified before this time (optional)
+    :param cursor: (dict) Cursor returned with the previous page (None for the first page)
+    :param page_size: (int) Number of results per page
+    :return: (dict) Matching ObjectRecords and the cursor of the next page (None on the last page)
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unsupported search mode. Use one of {', '.join(SEARCH_MODES)}.")
+
+    entries = ObjectEntry.objects.filter(bucket__name=bucket_name).filter(prefix_filter(prefix))
+
+    # Match the key relative to the prefix when the query has a path in it
+    by_key = '/' in query
+    if by_key:
+        entries = entries.annotate(path=Substr('key', len(prefix) + 1))
+    field = 'path' if by_key else 'name'
+
+    if query:
+        indexed = mode == 'prefix'
+        if mode == 'prefix':
+            entries = entries.filter(prefix_filter(prefix + query)) if by_key else entries.filter(name__istartswith=query)
+        elif mode == 'substring':
+            entries = entries.filter(**{f'{field}__icontains': query})
+        elif mode == 'glob':
+            parts = re.split(r'[*?\[\]]', query)
+            if parts[0] and not by_key:
+                entries = entries.filter(name__istartswith=parts[0])
+                indexed = True
+            elif len(parts) > 1 and parts[-1]:
+                entries = entries.filter(key_reversed__istartswith=parts[-1][::-1][:INDEX_LENGTH])
+                indexed = True
+            regex = glob_to_regex(query)
+            entries = entries.filter(key__iregex=regex.replace('^', '^' + re.escape(prefix), 1)) if by_key \
+                else entries.filter(name__iregex=regex)
+        else:
+            try:
+                re.compile(query)
+            except re.error as e:
+                raise ValueError(f'Invalid regular expression: {e}')
+            entries = entries.filter(**{f'{field}__iregex': query})
+
+        if not indexed:
+            check_scan_size(bucket_name, prefix)
+
+    if min_size is not None:
+        entries = entries.filter(size__gte=min_size)
+    if max_size is not None:
+        entries = entries.filter(size__lte=max_size)
+    if modified_after is not None:
+        entries = entries.filter(last_modified__gte=modified_after)
+    if modified_before is not None:
+        entries = entries.filter(last_modified__lte=modified_before)
+
+    page_size = max(1, min(page_size, MAX_SEARCH_PAGE_SIZE))
+    columns = ('key', 'size', 'last_modified', 'etag')
+    entries = entries.order_by('key_prefix', 'key')
+    cursor = cursor or {'offset': 0}
+
+    def get_records(rows):
+        return [ObjectRecord(key, size, last_modified.timestamp(), etag) for key, size, last_modified, etag in rows]
+
+    if 'after' not in cursor:
+        # Pages of the ranked window: the first matches in key order, one more telling
+        # whether matches follow the window
+        candidates = list(entries.values_list(*columns)[:SEARCH_RANK_CANDIDATES + 1])
+        window = candidates[:SEARCH_RANK_CANDIDATES]
+        offset = max(int(cursor.get('offset', 0)), 0)
+        if query and not by_key:
+            window.sort(key=lambda row: (get_rank(row[0], query), len(row[0]), row[0]))
+        rows = window[offset:offset + page_size]
+
+        if offset + page_size < len(window):
+            next_cursor = {'offset': offset + page_size}
+        elif len(candidates) > SEARCH_RANK_CANDIDATES:
+            # The last candidate in database order, since the next pages compare keys with its collation
+            next_cursor = {'after': candidates[SEARCH_RANK_CANDIDATES - 1][0]}
+        else:
+            next_cursor = None
+        return {'items': get_records(rows), 'cursor': next_cursor}
+
+    # Past the window, keyset pages in key order
+    after = cursor['after']
+    after_prefix = after[:INDEX_LENGTH]
+    entries = entries.filter(Q(key_prefix__gt=after_prefix) | Q(key_prefix=after_prefix, key__gt=after))
+    rows = list(entries.values_list(*columns)[:page_size + 1])
+    next_cursor = {'after': rows[page_size - 1][0]} if len(rows) > page_size else None
+    return {'items': get_records(rows[:page_size]), 'cursor': next_cursor}
+
+
+def check_scan_size(bucket_name, prefix):
+    # Refuse the queries that would read every entry of a large folder
+    count = get_rollups(bucket_name, [prefix]).get(prefix, {}).get('count', 0)
+    if count > SEARCH_SCAN_LIMIT:
+        raise ValueError(f'{prefix or "the bucket"} holds {count} objects, too many for this query. Search a folder of '
+                         f'at most {SEARCH_SCAN_LIMIT} objects, or use a "starts with" query or a glob starting '
+                         f'or ending with text (e.g. *.pdf).')
+
+
+def get_rank(key, query):
+    # 0 for an exact name match, 1 for a name starting with the query, else 2
+    name = key.rstrip('/').rpartition('/')[2].lower()
+    query = query.lower()
+    return 0 if name == query else 1 if name.startswith(query) else 2
@@ -0,0 +1,371 @@
+"""
+Background jobs for long-running bucket operations.
+
+A job is a row of the Job table, run by a JobRunner: a small thread pool
+started in every web process (B3_JOBS['RUNNER'] = 'thread') or in the
+"manage.py b3jobs" worker ('process'). Runners claim queued jobs with a
+conditional update, so every job runs once however many runners there are,
+and refresh the heartbeat of their running jobs at every poll. Handlers report
+their progress and a checkpoint as they go and stop between two batches when
+the job is cancelled. Jobs left running by a runner that went away (restart,
+crash) are queued again once their heartbeat is older than STALE_AFTER
+seconds, and resume from their checkpoint. The browser polls the job status.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import inventory
+from .models import Job, JobOutput
+from .services import get_folder_rollups, get_s3_handle, record_delete
+
+
+logger = logging.getLogger(__name__)
+
+
+JOBS_DEFAULTS = {
+    'RUNNER': 'thread',         # 'thread' (in the web processes) or 'process' (manage.py b3jobs)
+    'WORKERS': 2,               # Jobs run at once per runner
+    'POLL_INTERVAL': 2,         # Seconds between two polls for queued jobs
+    'STALE_AFTER': 60,          # Seconds without heartbeat before a running job is queued again
+    'KEEP_DAYS': 7,             # Finished jobs are deleted after this many days
+}
+
+# Progress is saved at most every SAVE_INTERVAL seconds, checkpoints right away
+SAVE_INTERVAL = 1.0
+
+# Errors kept in the result of a delete job, the others are only counted
+MAX_ERRORS = 1000
+
+# Files deleted between two checkpoints, and URLs per output chunk
+FILE_BATCH_SIZE = 10000
+OUTPUT_CHUNK_SIZE = 1000
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def get_jobs_settings():
+    return {**JOBS_DEFAULTS, **getattr(settings, 'B3_JOBS', {})}
+
+
+class JobCancelled(Exception):
+    """Raised in a handler when its job was cancelled (or taken over by another runner)."""
+
+
+handlers = {}
+
+
+def job_handler(kind):
+    # Register the function running the jobs of a kind
+    def register(func):
+        handlers[kind] = func
+        return func
+    return register
+
+
+class JobContext:
+    """
+    Progress reporting of a running job, given to its handler.
+    """
+
+    def __init__(self, job, worker):
+        self.job = job
+        self.worker = worker
+        self._saved = 0.0
+
+    @property
+    def checkpoint(self):
+        return self.job.checkpoint
+
+    def update(self, processed=None, total=None, result=None, checkpoint=None):
+        """
+        Record the progress of the job; it is saved at most every SAVE_INTERVAL
+        seconds, or right away with a new checkpoint.
+        :param processed: (int) Objects processed so far (optional)
+        :param total: (int) Objects to be processed (optional)
+        :param result: (dict) Result so far (optional)
+        :param checkpoint: (dict) Where the job resumes if interrupted (optional)
+        :raises JobCancelled: When the job was cancelled
+        """
+        job = self.job
+        if processed is not None:
+            job.processed = processed
+        if total is not None:
+            job.total = total
+        if result is not None:
+            job.result = result
+        if checkpoint is not None:
+            job.checkpoint = checkpoint
+        elif time.monotonic() - self._saved < SAVE_INTERVAL:
+            return
+        self.save()
+
+    def save(self):
+        self._saved = time.monotonic()
+        job = self.job
+        updated = Job.objects.filter(pk=job.pk, worker=self.worker, status='running').update(
+            processed=job.processed, total=job.total, result=job.result, checkpoint=job.checkpoint)
+        if not updated or Job.objects.filter(pk=job.pk, cancel_requested=True).exists():
+            raise JobCancelled()
+
+
+def submit_job(user, bucket, kind, params):
+    """
+    Queue a job and wake the runner of this process (if jobs run in the web processes).
+    :param user: (User) Owner of the job
+    :param bucket: (Bucket) Bucket the job works on
+    :param kind: (str) Job kind, one of Job.KINDS
+    :param params: (dict) Parameters of the job handler
+    :return: (Job) Queued job
+    """
+    if kind not in handlers:
+        raise ValueError(f'Unknown job kind {kind}')
+    job = Job.objects.create(user=user, bucket=bucket, kind=kind, params=params)
+    runner = start_runner()
+    if runner:
+        runner.wake()
+    return job
+
+
+def cancel_job(job):
+    """
+    Cancel a job: queued jobs are cancelled right away, running jobs when
+    their handler next reports progress.
+    :param job: (Job) Job to be cancelled
+    """
+    Job.objects.filter(pk=job.pk, status='queued').update(status='cancelled', finished=timezone.now())
+    Job.objects.filter(pk=job.pk, status__in=ACTIVE_STATUSES).update(cancel_requested=True)
+
+
+def get_job_dict(job):
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'bucket': job.bucket.name,
+        'status': job.status,
+        'processed': job.processed,
+        'total': job.total,
+        'result': job.result,
+        'error': job.error,
+        'cancel_requested': job.cancel_requested,
+        'created': job.created.isoformat(),
+        'finished': job.finished.isoformat() if job.finished else None,
+    }
+
+
+class JobRunner:
+    """
+    Run queued jobs on a pool of threads.
+    """
+
+    def __init__(self, workers=None, poll_interval=None):
+        self.config = get_jobs_settings()
+        self.workers = workers or self.config['WORKERS']
+        self.poll_interval = poll_interval or self.config['POLL_INTERVAL']
+        self.name = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='b3-job')
+        self.running = {}
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        """
+        Refresh the heartbeat of the running jobs, queue the stale jobs again
+        and start queued jobs, oldest first, up to the number of workers.
+        :return: (int) Number of jobs started
+        """
+        now = timezone.now()
+        self.running = {pk: future for pk, future in self.running.items() if not future.done()}
+        if self.running:
+            Job.objects.filter(pk__in=list(self.running), worker=self.name).update(heartbeat=now)
+
+        stale = Job.objects.filter(status='running', heartbeat__lt=now - timedelta(seconds=self.config['STALE_AFTER']))
+        for pk in stale.values_list('pk', flat=True):
+            logger.info('Resuming job %d, its runner stopped', pk)
+        stale.update(status='queued', worker='')
+        Job.objects.filter(status__in=('done', 'failed', 'cancelled'),
+                           finished__lt=now - timedelta(days=self.config['KEEP_DAYS'])).delete()
+
+        started = 0
+        free = self.workers - len(self.running)
+        if free > 0:
+            for pk in Job.objects.filter(status='queued').order_by('created').values_list('pk', flat=True)[:free]:
+                claimed = Job.objects.filter(pk=pk, status='queued').update(
+                    status='running', worker=self.name, heartbeat=now, started=Coalesce(F('started'), Value(now)))
+                if claimed:
+                    self.running[pk] = self.executor.submit(self.run_job, pk)
+                    started += 1
+        return started
+
+    def run_job(self, pk):
+        job = Job.objects.select_related('bucket').get(pk=pk)
+        context = JobContext(job, self.name)
+        status, error = 'done', ''
+        try:
+            if job.cancel_requested:
+                raise JobCancelled()
+            handlers[job.kind](job, context)
+        except JobCancelled:
+            status = 'cancelled'
+        except Exception as e:
+            logger.exception('Job %d (%s) failed', pk, job.kind)
+            status, error = 'failed', str(e)
+        finally:
+            try:
+                Job.objects.filter(pk=pk, worker=self.name, status='running').update(
+                    status=status, error=error, processed=job.processed, total=job.total, result=job.result,
+                    checkpoint=job.checkpoint, finished=timezone.now())
+            finally:
+                close_old_connections()
+        self.wake()
+
+    def wake(self):
+        self._wake.set()
+
+    def run_pending(self):
+        # Run the queued jobs until none are left, without waiting for new ones
+        while self.poll() or self.running:
+            wait(list(self.running.values()))
+
+    def run_forever(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Error polling for jobs')
+            finally:
+                close_old_connections()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run_forever, name='b3-job-runner', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        # Running jobs finish unless the process exits, then they resume elsewhere
+        self._stopped.set()
+        self.wake()
+        if self._thread:
+            self._thread.join()
+        self.executor.shutdown(wait=wait)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def start_runner():
+    """
+    Start the job runner of this web process, if jobs run in the web processes.
+    :return: (JobRunner) Runner of the process (None with the 'process' runner)
+    """
+    global _runner
+    if get_jobs_settings()['RUNNER'] != 'thread':
+        return None
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+            _runner.start()
+    return _runner
+
+
+def estimate_total(bucket_name, folders, files):
+    # Known when the folders have rollups (buckets with an inventory). A folder
+    # rollup doesn't count the folder marker, which is deleted with the folder
+    prefixes = [folder.partition('/')[2].rstrip('/') + '/' for folder in folders]
+    rollups = get_folder_rollups(bucket_name, prefixes) if prefixes else {}
+    if any(prefix not in rollups for prefix in prefixes):
+        return None
+    markers = inventory.count_entries(bucket_name, prefixes) if prefixes else 0
+    return len(files) + markers + sum(rollups[prefix]['count'] for prefix in prefixes)
+
+
+def get_job_s3(job):
+    s3 = get_s3_handle(job.bucket.name)
+    if not s3:
+        raise ValueError(f'Bucket {job.bucket.name} not found')
+    return s3
+
+
+@job_handler('delete')
+def run_delete(job, context):
+    """
+    Delete files and folders. Folders are deleted one after the other and files
+    in batches of FILE_BATCH_SIZE, with a checkpoint after each of them; a folder
+    interrupted half-way is listed again and only its remaining keys are deleted.
+    :param job: (Job) Job with the folder_list and file_list parameters
+    :param context: (JobContext) Progress reporting
+    """
+    s3 = get_job_s3(job)
+    bucket_name = job.bucket.name
+    folders = job.params.get('folder_list', [])
+    files = job.params.get('file_list', [])
+    result = {'deleted': 0, 'error_count': 0, 'errors': [], **job.result}
+    if job.total is None:
+        context.update(total=estimate_total(bucket_name, folders, files))
+
+    def progress(deleted, errors):
+        result['deleted'] += deleted
+        result['error_count'] += len(errors)
+        result['errors'] += errors[:MAX_ERRORS - len(result['errors'])]
+        context.update(processed=result['deleted'] + result['error_count'], result=result)
+
+    checkpoint = {'folders': 0, 'files': 0, **context.checkpoint}
+    for index in range(checkpoint['folders'], len(folders)):
+        deleted = s3.initiate_delete([], [folders[index]], progress=progress)
+        record_delete(s3, bucket_name, [folders[index]], [], deleted)
+        context.update(result=result, checkpoint={'folders': index + 1, 'files': 0})
+
+    for start in range(checkpoint['files'], len(files), FILE_BATCH_SIZE):
+        batch = files[start:start + FILE_BATCH_SIZE]
+        deleted = s3.initiate_delete(batch, progress=progress)
+        record_delete(s3, bucket_name, [], batch, deleted)
+        context.update(result=result, checkpoint={'folders': len(folders), 'files': start + len(batch)})
+
+    context.update(total=result['deleted'] + result['error_count'], result=result)
+
+
+@job_handler('sign')
+def run_sign(job, context):
+    """
+    Sign the URLs of files and folders, written as NDJSON chunks to JobOutput
+    (the same entries as the download/ stream). URLs expire, so an interrupted
+    signing starts over instead of resuming.
+    :param job: (Job) Job with the folder_list, file_list and method parameters
+    :param context: (JobContext) Progress reporting
+    """
+    s3 = get_job_s3(job)
+    folders = job.params.get('folder_list', [])
+    files = job.params.get('file_list', [])
+    JobOutput.objects.filter(job=job).delete()
+    context.update(processed=0, total=estimate_total(job.bucket.name, folders, files), checkpoint={})
+
+    count = 0
+    lines = []
+    index = 0
+    for entry in s3.iter_signed_urls(folders, files, job.params.get('method') or 'get_object'):
+        lines.append(json.dumps(entry))
+        count += 1
+        if len(lines) >= OUTPUT_CHUNK_SIZE:
+            JobOutput.objects.create(job=job, index=index, data='\n'.join(lines) + '\n')
+            index += 1
+            lines = []
+            context.update(processed=count)
+    if lines:
+        JobOutput.objects.create(job=job, index=index, data='\n'.join(lines) + '\n')
+
+    context.update(processed=count, total=count, result={'signed': count}, checkpoint={'chunks': index + bool(lines)})
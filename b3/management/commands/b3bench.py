@@ -0,0 +1,270 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import importlib.util
+import json
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from b3 import views
+from b3.cache import listing_cache, url_cache
+from b3.s3 import S3, client_registry
+
+
+BENCH_REGION = 'us-east-1'
+KEYS_PER_FOLDER = 1000
+UPLOAD_FILES = 200
+UPLOAD_PART_WINDOW = 64  # Part URLs requested per upload by transfer.js
+UPLOAD_SIZES = (1024 * 1024, 64 * 1024 * 1024, 4 * 1024 ** 3)
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_moto_server(timeout=30):
+    """
+    Start a moto server in its own process, so that it neither competes for the
+    GIL nor shows in the memory measurements.
+    :return: (tuple) Endpoint URL and server process
+    """
+    if importlib.util.find_spec('moto') is None:
+        raise CommandError('moto[server] is not installed, install it or pass --endpoint-url')
+
+    port = get_free_port()
+    server = subprocess.Popen([sys.executable, '-m', 'moto.server', '-H', '127.0.0.1', '-p', str(port)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return f'http://127.0.0.1:{port}', server
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.2)
+    server.terminate()
+    raise CommandError('The moto server did not start')
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarize(name, key_count, items, timings, peak_memory):
+    """
+    Summarize the runs of a benchmark.
+    :param name: (str) Benchmark name
+    :param key_count: (int) Number of keys in the bucket
+    :param items: (int) Items (keys, URLs, uploads...) processed by every run
+    :param timings: (list) Duration of every run in seconds
+    :param peak_memory: (int) Peak Python memory allocated by a run, in bytes
+    :return: (dict) Benchmark result
+    """
+    mean = statistics.mean(timings)
+    return {
+        'benchmark': name,
+        'keys': key_count,
+        'items': items,
+        'runs': len(timings),
+        'latency': {
+            'min': min(timings),
+            'mean': mean,
+            'p50': percentile(timings, 0.5),
+            'p90': percentile(timings, 0.9),
+            'p99': percentile(timings, 0.99),
+            'max': max(timings),
+        },
+        'throughput': items / mean if mean else None,
+        'peak_memory': peak_memory,
+    }
+
+
+class Command(BaseCommand):
+    help = ('Benchmark listing, signing, upload start, delete and listdir/ against a local '
+            'S3-compatible server (a local moto server by default) and save the results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keys', type=int, nargs='+', default=[1000, 10000],
+                            help='Sizes of the synthetic buckets (e.g. 1000 10000 100000 1000000)')
+        parser.add_argument('--runs', type=int, default=5, help='Timed runs of every benchmark')
+        parser.add_argument('--endpoint-url', help='S3-compatible server to use, e.g. http://127.0.0.1:5000 '
+                                                   'for "moto_server -p 5000" (default: start a moto server)')
+        parser.add_argument('--output', help='Results file (default: b3bench-<commit>.json)')
+        parser.add_argument('--compare', help='Results file of an earlier run to compare with')
+        parser.add_argument('--keep', action='store_true', help="Don't delete the synthetic buckets")
+
+    def handle(self, *args, **options):
+        server = None
+        endpoint_url = options['endpoint_url']
+        if not endpoint_url:
+            endpoint_url, server = start_moto_server()
+
+        try:
+            s3 = S3(('b3bench', 'b3bench'), 'aws', BENCH_REGION, endpoint_url=endpoint_url)
+            results = []
+            for key_count in options['keys']:
+                bucket_name = f'b3bench-{key_count}'
+                self.stdout.write(f'Filling {bucket_name} with {key_count} keys ...')
+                s3.client.create_bucket(Bucket=bucket_name)
+                self.fill_bucket(s3, bucket_name, key_count)
+                try:
+                    results += self.run_benchmarks(s3, bucket_name, key_count, options['runs'])
+                finally:
+                    if not options['keep']:
+                        self.drop_bucket(s3, bucket_name)
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+        report = {
+            'commit': get_commit(),
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'endpoint': 'moto_server' if server else endpoint_url,
+            'results': results,
+        }
+        output = options['output'] or f'b3bench-{report["commit"] or "local"}.json'
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.print_results(results, options['compare'])
+        self.stdout.write(self.style.SUCCESS(f'Results saved to {output}'))
+
+    @staticmethod
+    def fill_bucket(s3, bucket_name, key_count):
+        # KEYS_PER_FOLDER files per folder below data/
+        def put(index):
+            s3.client.put_object(Bucket=bucket_name, Key=f'data/{index // KEYS_PER_FOLDER:04d}/file{index:07d}.bin',
+                                 Body=b'b3')
+
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            for _ in executor.map(put, range(key_count), chunksize=256):
+                pass
+
+    @staticmethod
+    def drop_bucket(s3, bucket_name):
+        for _, records, _ in s3.iter_object_pages(bucket_name, ''):
+            if records:
+                s3.delete_batch(bucket_name, [record.key for record in records])
+        s3.client.delete_bucket(Bucket=bucket_name)
+
+    def measure(self, name, key_count, runs, func, setup=None):
+        """
+        Time a benchmark, then run it once more under tracemalloc for its peak memory.
+        Caches are cleared before every run so that every run does the full work.
+        :param func: (callable) Runs the benchmark, returns the number of items processed
+        :param setup: (callable) Prepares every run, outside of the timings (optional)
+        :return: (dict) Benchmark result
+        """
+        timings = []
+        items = 0
+        for _ in range(runs):
+            listing_cache.clear()
+            url_cache.clear()
+            args = setup() if setup else ()
+            start = time.perf_counter()
+            items = func(*args)
+            timings.append(time.perf_counter() - start)
+
+        listing_cache.clear()
+        url_cache.clear()
+        args = setup() if setup else ()
+        tracemalloc.start()
+        try:
+            func(*args)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        result = summarize(name, key_count, items, timings, peak_memory)
+        self.stdout.write(f'  {name:<16} {result["latency"]["p50"] * 1000:10.1f} ms p50 '
+                          f'{result["throughput"] or 0:12.0f} items/s {peak_memory / 1024 ** 2:8.1f} MiB peak')
+        return result
+
+    def run_benchmarks(self, s3, bucket_name, key_count, runs):
+        folder = f'{bucket_name}/data/'
+        upload_files = [[f'{bucket_name}/uploads/file{i:04d}.bin', UPLOAD_SIZES[i % len(UPLOAD_SIZES)], '']
+                        for i in range(UPLOAD_FILES)]
+
+        # The listdir/ view is served from the registered handle, with an unsaved user
+        client_registry.set_bucket(bucket_name, None, s3)
+        factory = RequestFactory()
+        user = User(username='b3bench', is_active=True)
+
+        def listdir():
+            request = factory.post('/b3/listdir/', json.dumps({'bucket_name': bucket_name, 'dir_path': 'data/0000/'}),
+                                   content_type='application/json')
+            request.user = user
+            response = views.listDir(request)
+            return len(json.loads(response.content)['result']['names'])
+
+        def start_upload():
+            uploads = s3.start_upload(upload_files, UPLOAD_PART_WINDOW)
+            for _file, upload in zip(upload_files, uploads):
+                if upload['upload_id']:
+                    s3.client.abort_multipart_upload(Bucket=bucket_name, Key=_file[0][len(bucket_name) + 1:],
+                                                     UploadId=upload['upload_id'])
+            return len(uploads)
+
+        def initiate_delete(delete_list):
+            s3.initiate_delete(delete_list)
+            return len(delete_list)
+
+        def refill():
+            # Every delete run needs the keys back
+            existing = sum(1 for _ in s3.iter_objects(bucket_name, 'data/'))
+            if existing < key_count:
+                self.fill_bucket(s3, bucket_name, key_count)
+            return (s3.prepare_delete([folder], []),)
+
+        try:
+            return [
+                self.measure('get_object_list', key_count, runs,
+                             lambda: len(s3.get_object_list(bucket_name, 'data/', raw_list=True))),
+                self.measure('get_signed_url', key_count, runs, lambda: len(s3.get_signed_url([folder], []))),
+                self.measure('start_upload', key_count, runs, start_upload),
+                self.measure('listdir', key_count, runs, listdir),
+                self.measure('prepare_delete', key_count, runs, lambda: len(s3.prepare_delete([folder], []))),
+                self.measure('initiate_delete', key_count, runs, initiate_delete, setup=refill),
+            ]
+        finally:
+            client_registry.invalidate(bucket_name)
+
+    def print_results(self, results, compare):
+        if not compare:
+            return
+        with open(compare) as f:
+            baseline = {(r['benchmark'], r['keys']): r for r in json.load(f)['results']}
+
+        self.stdout.write(f'Compared with {compare} (p50 latency, peak memory):')
+        for result in results:
+            before = baseline.get((result['benchmark'], result['keys']))
+            if not before:
+                continue
+            latency = result['latency']['p50'] / before['latency']['p50'] if before['latency']['p50'] else None
+            memory = result['peak_memory'] / before['peak_memory'] if before['peak_memory'] else None
+            self.stdout.write(f'  {result["benchmark"]:<16} {result["keys"]:>8} keys '
+                              f'x{latency or 0:.2f} latency x{memory or 0:.2f} memory')
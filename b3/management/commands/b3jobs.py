@@ -0,0 +1,34 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from b3.jobs import JobRunner
+
+
+class Command(BaseCommand):
+    help = ('Run the background jobs (deletes, signings) queued by the web processes, '
+            'for deployments with B3_JOBS_RUNNER=process')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help="Jobs run at once (default: B3_JOBS['WORKERS'])")
+        parser.add_argument('--once', action='store_true',
+                            help='Run the queued jobs, then exit instead of waiting for new jobs')
+
+    def handle(self, *args, **options):
+        runner = JobRunner(workers=options['workers'])
+        self.stdout.write(f'Job runner {runner.name} started with {runner.workers} workers')
+
+        if options['once']:
+            runner.run_pending()
+            runner.executor.shutdown()
+            return
+
+        # Interrupted jobs are resumed by the next runner once their heartbeat is stale
+        stopped = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopped.set())
+        runner.start()
+        stopped.wait()
+        self.stdout.write('Stopping, waiting for the running jobs to finish ...')
+        runner.stop()
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from b3.inventory import sync_inventory
+from b3.models import Bucket
+from b3.services import get_s3_handle
+
+
+class Command(BaseCommand):
+    help = 'Sync the local object inventory of buckets with S3 (run it periodically, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('buckets', nargs='*', help='Buckets to be synced (default: all buckets)')
+        parser.add_argument('--prefix', default='', help='Only sync the objects below this folder prefix')
+
+    def handle(self, *args, **options):
+        buckets = Bucket.objects.all()
+        if options['buckets']:
+            buckets = buckets.filter(name__in=options['buckets'])
+            missing = set(options['buckets']) - {bucket.name for bucket in buckets}
+            if missing:
+                raise CommandError(f'Unknown buckets: {", ".join(sorted(missing))}')
+
+        for bucket in buckets:
+            self.stdout.write(f'Syncing {bucket.name}/{options["prefix"]} ...')
+            result = sync_inventory(bucket, get_s3_handle(bucket.name), options['prefix'])
+            self.stdout.write(self.style.SUCCESS(
+                f'{bucket.name}: {result["created"]} created, {result["updated"]} updated, '
+                f'{result["removed"]} removed'
+            ))
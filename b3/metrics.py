@@ -0,0 +1,263 @@
+"""
+Request and S3 metrics.
+
+S3 calls are timed through botocore event hooks registered on every S3 client,
+database queries through a connection execute wrapper, and requests by
+ServerTimingMiddleware. Metrics are kept per process and exposed in the
+Prometheus text format at /metrics, and the time every request spent in the
+database, decrypting bucket keys, in S3 and rendering is reported in its
+Server-Timing header.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import bisect
+import contextvars
+import threading
+import time
+
+
+# Seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+SERVER_TIMING_PHASES = ('db', 'decrypt', 's3', 'render')
+
+
+def format_labels(names, values, extra=''):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """
+    Monotonic counter with labels.
+    """
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    """
+    Histogram with labels and fixed buckets.
+    """
+
+    def __init__(self, name, documentation, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[labels] = (counts, total + value)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    bucket_labels = format_labels(self.labels, labels, f'le="{bound}"')
+                    lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+                lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {total}')
+                lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, labels):
+        metric = Counter(name, documentation, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labels, buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+        :return: (str) Metrics
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+S3_DURATION = registry.histogram('b3_s3_request_duration_seconds', 'Duration of S3 API calls, retries included.',
+                                 ('operation', 'bucket', 'prefix'))
+S3_REQUESTS = registry.counter('b3_s3_requests_total', 'S3 API calls by HTTP status (or "error").',
+                               ('operation', 'bucket', 'status'))
+S3_RETRIES = registry.counter('b3_s3_retries_total', 'Retried S3 API requests.', ('operation', 'bucket'))
+S3_BYTES = registry.counter('b3_s3_bytes_total', 'Bytes sent to and received from S3.',
+                            ('operation', 'bucket', 'direction'))
+REQUEST_DURATION = registry.histogram('b3_request_duration_seconds', 'Duration of requests until the response '
+                                      'headers are ready.', ('view', 'method'))
+REQUEST_PHASES = registry.histogram('b3_request_phase_seconds', 'Time spent by requests in each phase.',
+                                    ('view', 'phase'))
+REQUESTS = registry.counter('b3_requests_total', 'Requests by response status.', ('view', 'status'))
+
+
+class RequestTimer:
+    """
+    Time spent by one request in each phase. Work done on other threads on
+    behalf of the request is added as well, so phases can exceed the request time.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {phase: 0.0 for phase in SERVER_TIMING_PHASES}
+        self.counts = {phase: 0 for phase in SERVER_TIMING_PHASES}
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+            self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def server_timing(self, total):
+        """
+        Build the Server-Timing header value.
+        :param total: (float) Request time in seconds
+        :return: (str) Header value
+        """
+        with self._lock:
+            entries = [f'{phase};dur={seconds * 1000:.1f};desc="{self.counts[phase]} calls"'
+                       for phase, seconds in self.phases.items()]
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+current_timer = contextvars.ContextVar('b3_request_timer', default=None)
+
+
+def add_time(phase, seconds):
+    # Charge time to the request being served, if any
+    timer = current_timer.get()
+    if timer is not None:
+        timer.add(phase, seconds)
+
+
+@contextmanager
+def timed(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(phase, time.perf_counter() - start)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    Thread pool running every task in a copy of the submitter's context, so
+    that S3 calls made on the pool are charged to the request that started them.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def get_prefix(params):
+    # First folder of the key or prefix ('' at the bucket root), which keeps the label values bounded
+    path = params.get('Key') or params.get('Prefix') or ''
+    folder, sep, _ = path.partition('/')
+    return folder + sep if sep else ''
+
+
+def _before_parameter_build(params, model, context, **kwargs):
+    context['b3_labels'] = (model.name, params.get('Bucket', ''), get_prefix(params))
+
+
+def _before_call(model, params, context, **kwargs):
+    body = params.get('body')
+    if isinstance(body, (bytes, str)):
+        context['b3_sent'] = len(body)
+    else:
+        context['b3_sent'] = int(params.get('headers', {}).get('Content-Length', 0) or 0)
+    context['b3_start'] = time.perf_counter()
+
+
+def _record_call(context, status, retries, received):
+    start = context.get('b3_start')
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    operation, bucket, prefix = context.get('b3_labels', ('', '', ''))
+
+    S3_DURATION.observe((operation, bucket, prefix), elapsed)
+    S3_REQUESTS.inc((operation, bucket, str(status)))
+    if retries:
+        S3_RETRIES.inc((operation, bucket), retries)
+    if context.get('b3_sent'):
+        S3_BYTES.inc((operation, bucket, 'sent'), context['b3_sent'])
+    if received:
+        S3_BYTES.inc((operation, bucket, 'received'), received)
+    add_time('s3', elapsed)
+
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    received = http_response.headers.get('Content-Length')
+    if received is None and not model.has_streaming_output:
+        # Already read, unlike streamed bodies
+        received = len(http_response.content)
+    _record_call(context, http_response.status_code, parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                 int(received or 0))
+
+
+def _after_call_error(context, **kwargs):
+    # Connection errors and timeouts, once the retries are exhausted
+    _record_call(context, 'error', 0, 0)
+
+
+def register_client(client):
+    """
+    Record the calls of an S3 client.
+    :param client: boto3 S3 client
+    """
+    events = client.meta.events
+    events.register('before-parameter-build.s3', _before_parameter_build)
+    events.register('before-call.s3', _before_call)
+    events.register('after-call.s3', _after_call)
+    events.register('after-call-error.s3', _after_call_error)
+
+
+def time_queries(execute, sql, params, many, context):
+    # Database connection execute wrapper (see signals)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        add_time('db', time.perf_counter() - start)
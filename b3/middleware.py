@@ -0,0 +1,113 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from .metrics import current_timer, RequestTimer, REQUEST_DURATION, REQUEST_PHASES, REQUESTS
+from .profiling import is_requested, is_sampled, profiling_lock, RequestProfiler
+
+
+class ServerTimingMiddleware:
+    """
+    Time every request, add its Server-Timing header (database, key decryption,
+    S3 and rendering time) and record it in the request metrics. Streamed
+    responses are timed until their headers are ready.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timer = RequestTimer()
+        token = current_timer.set(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.finish(request, response, timer)
+
+    async def __acall__(self, request):
+        timer = RequestTimer()
+        token = current_timer.set(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.finish(request, response, timer)
+
+    @staticmethod
+    def finish(request, response, timer):
+        total = time.perf_counter() - timer.start
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+
+        REQUEST_DURATION.observe((view, request.method), total)
+        REQUESTS.inc((view, str(response.status_code)))
+        for phase, seconds in timer.phases.items():
+            REQUEST_PHASES.observe((view, phase), seconds)
+
+        response['Server-Timing'] = timer.server_timing(total)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests of staff users who ask for it (see profiling.py) and a
+    sample of all requests. The ID of the saved profile is returned in the
+    X-B3-Profile-Id header. Streamed responses are profiled until their headers are ready.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        requested = is_requested(request) and request.user.is_staff
+        if not (requested or is_sampled()) or not profiling_lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            profiler = RequestProfiler()
+            profiler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.stop()
+            profile = profiler.save(request, request.user, response, not requested)
+        finally:
+            profiling_lock.release()
+
+        response['X-B3-Profile-Id'] = str(profile.pk)
+        return response
+
+    async def __acall__(self, request):
+        # Coroutines of other requests running on the event loop meanwhile are profiled as well
+        requested = is_requested(request) and (await request.auser()).is_staff
+        if not (requested or is_sampled()) or not profiling_lock.acquire(blocking=False):
+            return await self.get_response(request)
+
+        try:
+            profiler = RequestProfiler()
+            profiler.start()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.stop()
+            profile = await sync_to_async(profiler.save)(request, await request.auser(), response, not requested)
+        finally:
+            profiling_lock.release()
+
+        response['X-B3-Profile-Id'] = str(profile.pk)
+        return response
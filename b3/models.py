@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 import base64
 import hashlib
@@ -5,8 +6,6 @@ from cryptography.fernet import Fernet
 
 from main.settings import SECRET_KEY
 
-from .s3 import S3
-
 
 fernet_key = base64.urlsafe_b64encode(hashlib.sha256(SECRET_KEY.encode()).digest())
 fernet = Fernet(fernet_key)
@@ -47,11 +46,6 @@ class Bucket(models.Model):
             self.secret_key = encrypt_secret_key(self.secret_key)
             super().save(*args, **kwargs)
 
-    def delete(self, using = None, keep_parents = False):
-        # Delete the S3 handle associated with this bucket
-        S3.delete_handle(self.name)
-        return super().delete(using=using, keep_parents=keep_parents)
-    
 
     def get_decrypted_secret_key(self):
         """Decrypt the secret key using Fernet symmetric encryption."""
@@ -62,5 +56,202 @@ class Bucket(models.Model):
 
     def __str__(self):
         return self.name
-    
 
+
+
+class InventoryState(models.Model):
+    """Sync state of the local object inventory of a bucket (see inventory.py)."""
+    bucket = models.OneToOneField(Bucket, on_delete=models.CASCADE, related_name='inventory')
+
+    STATUSES = (
+        ('empty', 'Not synced'),
+        ('syncing', 'Syncing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    )
+    status = models.CharField(max_length=16, choices=STATUSES, default='empty')
+
+    # Incremented by every sync; entries not seen by a sync keep an older generation
+    generation = models.PositiveIntegerField(default=0)
+    last_synced = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'{self.bucket.name} ({self.status})'
+
+
+class ObjectEntry(models.Model):
+    """An object of a bucket, as recorded by the local inventory."""
+    bucket = models.ForeignKey(Bucket, on_delete=models.CASCADE, related_name='object_entries')
+    key = models.CharField(max_length=1024)
+    parent = models.CharField(max_length=1024)
+    size = models.BigIntegerField()
+    etag = models.CharField(max_length=64)
+    last_modified = models.DateTimeField()
+    generation = models.PositiveIntegerField(default=0)
+
+    # Object keys are too long to be indexed by MySQL, so lookups go through
+    # hashes and truncated copies of the key and of the object name
+    key_hash = models.CharField(max_length=40)
+    key_prefix = models.CharField(max_length=191)
+    parent_hash = models.CharField(max_length=40)
+    name = models.CharField(max_length=191)
+    # Reversed key, so that names ending with some text (e.g. '*.pdf') are found through an index
+    key_reversed = models.CharField(max_length=191, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'key_hash'], name='unique_object_entry_key'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket', 'key_prefix']),
+            models.Index(fields=['bucket', 'parent_hash']),
+            models.Index(fields=['bucket', 'name']),
+            models.Index(fields=['bucket', 'key_reversed']),
+            models.Index(fields=['bucket', 'last_modified']),
+        ]
+
+    def __str__(self):
+        return f'{self.bucket.name}/{self.key}'
+
+
+class FolderRollup(models.Model):
+    """Recursive size and object count of a folder, rolled up from the inventory (see inventory.py)."""
+    bucket = models.ForeignKey(Bucket, on_delete=models.CASCADE, related_name='folder_rollups')
+    prefix = models.CharField(max_length=1024, blank=True)
+    size = models.BigIntegerField(default=0)
+    count = models.BigIntegerField(default=0)
+
+    # Set when objects below the folder changed; the rollup is recomputed when read.
+    # The version tells whether the folder changed again while it was recomputed
+    dirty = models.BooleanField(default=True)
+    version = models.PositiveIntegerField(default=0)
+
+    # Indexed lookups, as for ObjectEntry
+    prefix_hash = models.CharField(max_length=40)
+    key_prefix = models.CharField(max_length=191, blank=True)
+    parent_hash = models.CharField(max_length=40, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bucket', 'prefix_hash'], name='unique_folder_rollup_prefix'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket', 'key_prefix']),
+            models.Index(fields=['bucket', 'parent_hash']),
+        ]
+
+    def __str__(self):
+        return f'{self.bucket.name}/{self.prefix}'
+
+
+class UploadSession(models.Model):
+    """A multipart upload in progress, kept so that interrupted uploads can be resumed (see uploads.py)."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    bucket = models.ForeignKey(Bucket, on_delete=models.CASCADE, related_name='upload_sessions')
+    key = models.CharField(max_length=1024)
+    key_hash = models.CharField(max_length=40)
+    upload_id = models.CharField(max_length=1024)
+    part_size = models.BigIntegerField()
+    file_size = models.BigIntegerField()
+
+    # Computed by the browser from the file size, modification time and content samples
+    fingerprint = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'bucket', 'key_hash']),
+        ]
+
+    def __str__(self):
+        return f'{self.bucket.name}/{self.key} ({self.upload_id})'
+
+
+class RequestProfile(models.Model):
+    """Profile of a single request, recorded by ProfilingMiddleware (see profiling.py)."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+                             related_name='request_profiles')
+    method = models.CharField(max_length=16)
+    path = models.CharField(max_length=1024)
+    view = models.CharField(max_length=255, blank=True)
+    status = models.PositiveSmallIntegerField(null=True)
+    duration = models.FloatField(help_text='Seconds')
+    sampled = models.BooleanField(default=False, help_text='Picked by sampling rather than requested')
+    created = models.DateTimeField(auto_now_add=True)
+
+    # pstats report, marshalled pstats data (for snakeviz & co) and collapsed
+    # stacks (for flamegraph.pl, speedscope & co)
+    stats = models.TextField(blank=True)
+    profile = models.BinaryField()
+    stacks = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created']),
+        ]
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.duration * 1000:.0f} ms)'
+
+
+class Job(models.Model):
+    """A long-running bucket operation run in the background (see jobs.py)."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='jobs')
+    bucket = models.ForeignKey(Bucket, on_delete=models.CASCADE, related_name='jobs')
+
+    KINDS = (
+        ('delete', 'Delete'),
+        ('sign', 'Sign URLs'),
+    )
+    kind = models.CharField(max_length=16, choices=KINDS)
+
+    STATUSES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    )
+    status = models.CharField(max_length=16, choices=STATUSES, default='queued')
+    params = models.JSONField(default=dict)
+
+    # Objects processed so far, out of total (null while unknown)
+    processed = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(null=True, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+
+    # Where an interrupted job resumes, saved by its handler as it goes
+    checkpoint = models.JSONField(default=dict, blank=True)
+    cancel_requested = models.BooleanField(default=False)
+
+    # Runner holding the job and its last sign of life; running jobs whose
+    # heartbeat is too old are queued again
+    worker = models.CharField(max_length=255, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created']),
+            models.Index(fields=['user', 'created']),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.bucket.name} ({self.status})'
+
+
+class JobOutput(models.Model):
+    """A chunk of the output of a job, as NDJSON lines (e.g. the URLs signed by a 'sign' job)."""
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name='outputs')
+    index = models.PositiveIntegerField()
+    data = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'index'], name='unique_job_output_index'),
+        ]
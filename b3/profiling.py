@@ -0,0 +1,138 @@
+"""
+On-demand and sampled request profiling.
+
+Staff users profile a request by sending it with the X-B3-Profile header or the
+b3profile query parameter, and B3_PROFILING['SAMPLE_RATE'] profiles a fraction
+of all requests. A profile holds the cProfile statistics of the thread serving
+the request and the stacks sampled from that thread every STACK_INTERVAL
+seconds, and is browsed in the admin site. Work done by that request on other
+threads (e.g. parallel S3 listings) is not profiled.
+"""
+from collections import Counter
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from .models import RequestProfile
+
+
+PROFILING_DEFAULTS = {
+    'SAMPLE_RATE': 0.0,         # Fraction of all requests profiled
+    'MAX_PROFILES': 200,        # Older profiles are deleted
+    'STACK_INTERVAL': 0.005,    # Seconds between two stack samples
+    'STATS_LIMIT': 80,          # Functions listed in the pstats report
+}
+
+PROFILE_HEADER = 'X-B3-Profile'
+PROFILE_PARAM = 'b3profile'
+
+# cProfile can't profile two requests at once (and 3.12+ allows a single profiler
+# per process), so concurrent requests are served without profiling
+profiling_lock = threading.Lock()
+
+
+def get_profiling_settings():
+    return {**PROFILING_DEFAULTS, **getattr(settings, 'B3_PROFILING', {})}
+
+
+def is_requested(request):
+    return bool(request.headers.get(PROFILE_HEADER)) or PROFILE_PARAM in request.GET
+
+
+def is_sampled():
+    sample_rate = get_profiling_settings()['SAMPLE_RATE']
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+class StackSampler(threading.Thread):
+    """
+    Sample the stack of a thread at a fixed interval, and count the stacks in
+    the collapsed format used by flame graph tools ('outer;inner count').
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='b3-stack-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def collapsed(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+
+class RequestProfiler:
+    """
+    Profile of the request served by the current thread.
+    """
+
+    def __init__(self):
+        self.config = get_profiling_settings()
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident(), self.config['STACK_INTERVAL'])
+        self.start_time = None
+        self.duration = None
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.sampler.stop()
+        self.duration = time.perf_counter() - self.start_time
+
+    def save(self, request, user, response, sampled):
+        """
+        Save the profile and delete the profiles beyond MAX_PROFILES.
+        :param request: (HttpRequest) Profiled request
+        :param user: (User) User of the request
+        :param response: (HttpResponse) Response of the request
+        :param sampled: (bool) True if the request was picked by sampling
+        :return: (RequestProfile) Saved profile
+        """
+        report = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=report)
+        stats.sort_stats('cumulative').print_stats(self.config['STATS_LIMIT'])
+
+        match = getattr(request, 'resolver_match', None)
+        profile = RequestProfile.objects.create(
+            user=user if user.is_authenticated else None,
+            method=request.method,
+            path=request.get_full_path()[:1024],
+            view=match.view_name if match else '',
+            status=response.status_code,
+            duration=self.duration,
+            sampled=sampled,
+            stats=report.getvalue(),
+            profile=marshal.dumps(stats.stats),
+            stacks=self.sampler.collapsed(),
+        )
+
+        stale = RequestProfile.objects.order_by('-created').values_list('pk', flat=True)[self.config['MAX_PROFILES']:]
+        RequestProfile.objects.filter(pk__in=list(stale)).delete()
+        return profile
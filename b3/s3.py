@@ -1,7 +1,82 @@
 from boto3 import client as boto_client
 from botocore.config import Config
+from botocore.exceptions import ClientError
+from django.conf import settings
 
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
 from pathlib import Path
+import hashlib
+import logging
+import queue
+import threading
+import time
+
+from .cache import listing_cache, url_cache
+from .metrics import ContextThreadPoolExecutor, register_client
+from .signing import register_signers
+
+logger = logging.getLogger(__name__)
+
+
+register_signers()
+
+
+S3_CLIENT_DEFAULTS = {
+    'MAX_POOL_CONNECTIONS': 50,     # Connections kept per client (the botocore default is 10)
+    'CONNECT_TIMEOUT': 5,
+    'READ_TIMEOUT': 60,
+    'TCP_KEEPALIVE': True,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_MODE': 'standard',
+    'REGISTRY_TTL': 300,            # Seconds a bucket handle is reused without a DB lookup
+}
+
+# Compact per-object listing record. `mtime` is a POSIX timestamp and
+# `etag` is stored without the surrounding quotes returned by S3.
+ObjectRecord = namedtuple('ObjectRecord', ['key', 'size', 'mtime', 'etag'])
+
+# list_objects_v2 never returns more than 1000 entries per page
+MAX_PAGE_SIZE = 1000
+
+# S3 multipart uploads are limited to 10000 parts of 5 MiB to 5 GiB (except the last part),
+# and objects to 5 TiB
+MAX_PART_NUMBER = 10000
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_SIZE = 5 * 1024 ** 3
+MAX_OBJECT_SIZE = 5 * 1024 ** 4
+
+UPLOAD_DEFAULTS = {
+    'SINGLE_PUT_THRESHOLD': 16 * 1024 * 1024,   # Smaller files are uploaded with a single PUT
+    'MIN_PART_SIZE': 8 * 1024 * 1024,
+    'TARGET_PARTS': 1000,                       # Parts grow with the file size beyond this count
+    'CONCURRENCY': 5,                           # Parts uploaded in parallel by the browser
+    'POLICY_EXPIRY': 3600,                      # Seconds a folder upload policy stays valid
+}
+
+# Number of files whose uploads are started in parallel by S3.iter_start_upload
+UPLOAD_START_WORKERS = 16
+
+# delete_objects accepts up to 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+DELETE_MAX_WORKERS = 8
+
+# Number of prefix shards listed in parallel by S3.walk, and the number of
+# folder levels listed with a delimiter to discover those shards
+WALK_MAX_WORKERS = 8
+WALK_SHARD_DEPTH = 2
+
+# Folder tree expansion: levels listed per request, folders listed per request,
+# and folders of the next level prefetched in the background into the listing cache
+EXPAND_MAX_DEPTH = 3
+EXPAND_MAX_PREFIXES = 256
+EXPAND_PREFETCH_PREFIXES = 64
+PREFETCH_WORKERS = 4
+
+# Prefetches are best effort: when all the slots are taken, new ones are dropped
+prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='b3-prefetch')
+prefetch_slots = threading.BoundedSemaphore(EXPAND_PREFETCH_PREFIXES * 4)
 
 
 def get_filesize_str(file_size, precision=0):
@@ -20,8 +95,124 @@ def get_filesize_str(file_size, precision=0):
     return "%.*f %s" % (precision, file_size, size_strings[size_index])
 
 
+def plan_upload(file_size, concurrency=None):
+    """
+    Choose how a file is uploaded. Small files take a single presigned PUT.
+    Larger files use multipart uploads with parts that grow with the file size
+    (above TARGET_PARTS parts), are small enough for every concurrent upload
+    to get a part, and never exceed the 10000-part limit.
+    :param file_size: (int) File size in bytes
+    :param concurrency: (int) Number of parts the client uploads in parallel (optional)
+    :return: (tuple) Strategy ('single' or 'multipart') and part size in bytes
+    """
+    upload_settings = {**UPLOAD_DEFAULTS, **getattr(settings, 'B3_UPLOAD', {})}
+    if file_size > MAX_OBJECT_SIZE:
+        raise ValueError(f'Files larger than {get_filesize_str(MAX_OBJECT_SIZE)} cannot be uploaded.')
+    if file_size < upload_settings['SINGLE_PUT_THRESHOLD']:
+        return 'single', file_size
+
+    concurrency = concurrency or upload_settings['CONCURRENCY']
+    part_size = max(upload_settings['MIN_PART_SIZE'], -(-file_size // upload_settings['TARGET_PARTS']))
+    part_size = min(part_size, max(MIN_PART_SIZE, -(-file_size // concurrency)))
+    part_size = max(part_size, -(-file_size // MAX_PART_NUMBER))
+
+    # Whole MiBs keep the part boundaries readable
+    mib = 1024 * 1024
+    return 'multipart', min(-(-part_size // mib) * mib, MAX_PART_SIZE)
+
+
+def get_client_config():
+    """
+    Build the botocore configuration of the S3 clients from settings.B3_S3_CLIENT.
+    :return: (Config) botocore client configuration
+    """
+    client_settings = {**S3_CLIENT_DEFAULTS, **getattr(settings, 'B3_S3_CLIENT', {})}
+    return Config(
+        signature_version='s3v4',
+        max_pool_connections=client_settings['MAX_POOL_CONNECTIONS'],
+        connect_timeout=client_settings['CONNECT_TIMEOUT'],
+        read_timeout=client_settings['READ_TIMEOUT'],
+        tcp_keepalive=client_settings['TCP_KEEPALIVE'],
+        retries={'max_attempts': client_settings['MAX_ATTEMPTS'], 'mode': client_settings['RETRY_MODE']},
+    )
+
+
+class ClientRegistry:
+    """
+    Thread-safe registry of ready S3 clients, shared by every request of the process.
+    Clients are keyed by (credentials, endpoint, region) so that their connection
+    pools stay warm, and the S3 handle of every bucket is kept by bucket name so
+    that the bucket lookup and the secret key decryption happen only once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._buckets = {}
+
+    def get_client(self, key_id, key_secret, endpoint_url, region):
+        """
+        Get the client of the given credentials and endpoint, creating it if needed.
+        :return: boto3 S3 client
+        """
+        client_key = (key_id, hashlib.sha256(key_secret.encode()).hexdigest(), endpoint_url, region)
+        with self._lock:
+            client = self._clients.get(client_key)
+            if client is None:
+                client = boto_client("s3", region_name=region, aws_access_key_id=key_id,
+                                     aws_secret_access_key=key_secret, endpoint_url=endpoint_url,
+                                     config=get_client_config())
+                register_client(client)
+                self._clients[client_key] = client
+        return client
+
+    def get_bucket(self, bucket_name):
+        """
+        Get the S3 handle registered for a bucket.
+        :param bucket_name: (str) S3 bucket name
+        :return: (S3) S3 handle or None when the bucket is not registered or has expired
+        """
+        with self._lock:
+            entry = self._buckets.get(bucket_name)
+            if entry is None:
+                return None
+            if entry['expires_at'] < time.monotonic():
+                del self._buckets[bucket_name]
+                return None
+            return entry['handle']
+
+    def set_bucket(self, bucket_name, bucket_id, handle):
+        """
+        Register the S3 handle of a bucket. Other worker processes are not notified
+        when a bucket changes, so handles expire after REGISTRY_TTL seconds.
+        :param bucket_name: (str) S3 bucket name
+        :param bucket_id: (int) Primary key of the bucket, used to invalidate renamed buckets
+        :param handle: (S3) S3 handle
+        """
+        ttl = {**S3_CLIENT_DEFAULTS, **getattr(settings, 'B3_S3_CLIENT', {})}['REGISTRY_TTL']
+        with self._lock:
+            self._buckets[bucket_name] = {'id': bucket_id, 'handle': handle,
+                                          'expires_at': time.monotonic() + ttl}
+
+    def invalidate(self, bucket_name=None, bucket_id=None):
+        """
+        Drop the handle of a bucket, and its client when no other bucket uses it.
+        :param bucket_name: (str) S3 bucket name
+        :param bucket_id: (int) Primary key of the bucket
+        """
+        with self._lock:
+            for name, entry in list(self._buckets.items()):
+                if name == bucket_name or (bucket_id is not None and entry['id'] == bucket_id):
+                    del self._buckets[name]
+
+            in_use = {id(entry['handle'].client) for entry in self._buckets.values()}
+            self._clients = {k: c for k, c in self._clients.items() if id(c) in in_use}
+
+
+client_registry = ClientRegistry()
+
+
 class S3:
-    __handles = []
 
     @staticmethod
     def delete_handle(bucket_name):
@@ -29,90 +220,267 @@ class S3:
         Delete the S3 handle for the specified bucket name.
         :param bucket_name: (str) S3 bucket name
         """
-        S3.__handles = [h for h in S3.__handles if h['bucket'] != bucket_name]
+        client_registry.invalidate(bucket_name)
 
         
-    def __init__(self, key_pair, service_provider, service_region, bucket_name=None):
+    def __init__(self, key_pair, service_provider, service_region, bucket_name=None, endpoint_url=None):
         """
         Initialize the S3 client with the provided credentials and service provider.
+        Clients are shared through the client registry, so handles created with
+        the same credentials and endpoint reuse the same connection pool.
         :param key_pair: (str) Key pair in the format 'key_id:key_secret'
         :param service_provider: (str) Service provider ('aws' or 'backblaze')
         :param service_region: (str) Service region (e.g., 'us-west-1')
+        :param bucket_name: (str) S3 bucket name (optional)
+        :param endpoint_url: (str) Endpoint overriding the one of the service provider,
+                             e.g. a local S3-compatible server (optional)
         """
 
-        if bucket_name:
-            handle = next((h for h in self.__handles if h['bucket'] == bucket_name), None)
-            if handle:
-                self.client = handle['handle']
-                return
-            
         key_id, key_secret = key_pair
   
-        if service_provider == 'aws':
+        if endpoint_url:
+            url = endpoint_url
+        elif service_provider == 'aws':
             url = 'https://S3.' + service_region +'.amazonaws.com'
         elif service_provider == 'backblaze':
             url = 'https://S3.' + service_region +'.backblazeb2.com'
         else:
             raise ValueError("Unsupported service. Use 'aws' or 'backblaze'.")
 
+        self.bucket_name = bucket_name
+        self.service_provider = service_provider
+        self.key_id = key_id
+        self.client = client_registry.get_client(key_id, key_secret, url, service_region)
 
-        self.client = boto_client("s3", region_name=service_region, aws_access_key_id=key_id,
-                              aws_secret_access_key=key_secret, endpoint_url=url, 
-                              config=Config(signature_version='s3v4'))
-        
-        # Remove any existing handle for the same bucket
-        self.__handles = [h for h in self.__handles if h['bucket'] != bucket_name]
-        
-        self.__handles.append({'bucket': bucket_name, 'handle': self.client})
-
-    def get_object_list(self, bucket_name, path_prefix, delimiter='', raw_list=False):
+    def iter_object_pages(self, bucket_name, path_prefix, delimiter='', page_size=MAX_PAGE_SIZE,
+                          continuation_token=None):
         """
-        list objects (files and folders) in an S3 bucket with a specific prefix. 
-        It retrieves the contents of a bucket, optionally grouped by a delimiter, 
-        and can return either raw data or a processed list of folders and files
+        Lazily list objects in an S3 bucket one page at a time.
+        Only a single page is held in memory, and every object is reduced to
+        a compact ObjectRecord instead of the full boto dictionary.
         :param bucket_name: (str) S3 bucket name
         :param path_prefix: (str) Prefix to filter objects
         :param delimiter: (str) Delimiter to group objects (e.g., '/')
-        :param raw_list: (bool) If True, return raw object list
-        :return: (list) List of objects or folders
+        :param page_size: (int) Maximum number of entries per page (<= 1000)
+        :param continuation_token: (str) Token to resume listing from (optional)
+        :return: (generator) Tuples of (folders, records, next_continuation_token)
         """
+        arg_list = {"Bucket": bucket_name, "Prefix": path_prefix, "Delimiter": delimiter,
+                    "MaxKeys": min(page_size, MAX_PAGE_SIZE)}
+        if continuation_token:
+            arg_list["ContinuationToken"] = continuation_token
 
-
-        contents = []
-        common_prefixes = []
-        arg_list = {"Bucket": bucket_name, "Prefix": path_prefix, "Delimiter": delimiter}
         while True:
             response = self.client.list_objects_v2(**arg_list)
-            c = response.get('Contents')
-            if c:
-                contents += c
 
-            p = response.get('CommonPrefixes')
-            if p:
-                common_prefixes += p
+            folders = [item['Prefix'] for item in response.get('CommonPrefixes', ())]
+            records = [ObjectRecord(item['Key'], item['Size'], item['LastModified'].timestamp(),
+                                    item.get('ETag', '').strip('"'))
+                       for item in response.get('Contents', ())]
 
             # Check if there are more results to fetch
             paginator = response.get("NextContinuationToken")
-            if paginator:
-                arg_list["ContinuationToken"] = paginator
-            else:
+            yield folders, records, paginator
+
+            if not paginator:
                 break
+            arg_list["ContinuationToken"] = paginator
+
+    def iter_objects(self, bucket_name, path_prefix, delimiter=''):
+        """
+        Lazily iterate over every object under a prefix.
+        :param bucket_name: (str) S3 bucket name
+        :param path_prefix: (str) Prefix to filter objects
+        :param delimiter: (str) Delimiter to group objects (e.g., '/')
+        :return: (generator) ObjectRecord for each object
+        """
+        for _, records, _ in self.iter_object_pages(bucket_name, path_prefix, delimiter):
+            yield from records
+
+    def walk(self, bucket_name, path_prefix, max_workers=WALK_MAX_WORKERS, shard_depth=WALK_SHARD_DEPTH):
+        """
+        Recursively list every object under a prefix using parallel, prefix-sharded listings.
+        The first `shard_depth` levels are listed with the '/' delimiter to discover
+        sub-prefixes, every discovered prefix is listed as a separate shard on a
+        bounded worker pool, and the pages are merged into a single stream as they arrive.
+        Objects are yielded in no particular order.
+        :param bucket_name: (str) S3 bucket name
+        :param path_prefix: (str) Prefix to walk
+        :param max_workers: (int) Number of shards listed in parallel
+        :param shard_depth: (int) Number of folder levels used to discover shards
+        :return: (generator) ObjectRecord for each object
+        """
+        results = queue.Queue(maxsize=max_workers * 4)
+        stop = threading.Event()
+        lock = threading.Lock()
+        pending = 0
+        done = object()
+
+        def put(item):
+            # Don't block forever when the consumer stopped iterating
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def submit(prefix, depth):
+            nonlocal pending
+            with lock:
+                pending += 1
+            executor.submit(list_shard, prefix, depth)
+
+        def list_shard(prefix, depth):
+            try:
+                delimiter = '/' if depth < shard_depth else ''
+                for folders, records, _ in self.iter_object_pages(bucket_name, prefix, delimiter):
+                    if stop.is_set():
+                        return
+                    for folder in folders:
+                        submit(folder, depth + 1)
+                    if records:
+                        put(records)
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        executor = ContextThreadPoolExecutor(max_workers=max_workers)
+        try:
+            submit(path_prefix, 0)
+            while True:
+                item = results.get()
+                if item is done:
+                    with lock:
+                        pending -= 1
+                        if pending == 0:
+                            break
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield from item
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_object_page(self, bucket_name, path_prefix, delimiter='', continuation_token=None,
+                        page_size=MAX_PAGE_SIZE):
+        """
+        Fetch a single listing page, served from the listing cache when possible.
+        :param bucket_name: (str) S3 bucket name
+        :param path_prefix: (str) Prefix to filter objects
+        :param delimiter: (str) Delimiter to group objects (e.g., '/')
+        :param continuation_token: (str) Cursor returned by the previous page (optional)
+        :param page_size: (int) Maximum number of entries in the page (<= 1000)
+        :return: (tuple) Folders, ObjectRecords and the cursor of the next page (None on the last page)
+        """
+        return listing_cache.get_page(
+            bucket_name, path_prefix, delimiter, continuation_token, page_size,
+            lambda: next(self.iter_object_pages(bucket_name, path_prefix, delimiter, page_size,
+                                                continuation_token))
+        )
+
+    def get_subfolders(self, bucket_name, path_prefix):
+        """
+        Get every sub-folder of a folder, through the listing cache.
+        :param bucket_name: (str) S3 bucket name
+        :param path_prefix: (str) Folder prefix ('' for the bucket root)
+        :return: (list) Sub-folder prefixes
+        """
+        # Only the folders are needed here, so don't keep the file records around
+        dir_list = []
+        cursor = None
+        while True:
+            folders, _, cursor = self.get_object_page(bucket_name, path_prefix, '/', cursor)
+            dir_list += folders
+            if not cursor:
+                return dir_list
+
+    def get_folder_tree(self, bucket_name, prefixes, depth=1, max_workers=WALK_MAX_WORKERS,
+                        max_prefixes=EXPAND_MAX_PREFIXES):
+        """
+        List the sub-folders of several folders down to `depth` levels in one go.
+        Levels are listed one after the other, the folders of a level in parallel.
+        :param bucket_name: (str) S3 bucket name
+        :param prefixes: (list) Folder prefixes
+        :param depth: (int) Number of levels listed (at most EXPAND_MAX_DEPTH)
+        :param max_workers: (int) Number of folders listed in parallel
+        :param max_prefixes: (int) Maximum number of folders listed
+        :return: (tuple) Sub-folders of every listed folder, and the folders of
+                 the next level that were not listed
+        """
+        tree = {}
+        level = list(dict.fromkeys(prefixes))
+        with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+            for _ in range(max(1, min(depth, EXPAND_MAX_DEPTH))):
+                listed = [prefix for prefix in level if prefix not in tree][:max(max_prefixes - len(tree), 0)]
+                if not listed:
+                    break
+                for prefix, folders in zip(listed, executor.map(lambda p: self.get_subfolders(bucket_name, p), listed)):
+                    tree[prefix] = folders
+                level = [folder for prefix in listed for folder in tree[prefix]]
+
+        return tree, [prefix for prefix in level if prefix not in tree]
+
+    def prefetch_subfolders(self, bucket_name, prefixes, limit=EXPAND_PREFETCH_PREFIXES):
+        """
+        List folders in the background, so that their listings are in the listing
+        cache by the time they are expanded. Nothing is done when the cache is disabled.
+        :param bucket_name: (str) S3 bucket name
+        :param prefixes: (list) Folder prefixes
+        :param limit: (int) Maximum number of folders prefetched
+        """
+        if listing_cache.config['TTL'] <= 0:
+            return
+
+        def prefetch(prefix):
+            try:
+                self.get_subfolders(bucket_name, prefix)
+            except Exception as e:
+                logger.debug('Error prefetching %s/%s: %s', bucket_name, prefix, e)
+            finally:
+                prefetch_slots.release()
+
+        for prefix in prefixes[:limit]:
+            if not prefetch_slots.acquire(blocking=False):
+                break
+            prefetch_executor.submit(prefetch, prefix)
+
+    def get_object_list(self, bucket_name, path_prefix, delimiter='', raw_list=False):
+        """
+        list objects (files and folders) in an S3 bucket with a specific prefix. 
+        It retrieves the contents of a bucket, optionally grouped by a delimiter, 
+        and can return either raw data or a processed list of folders and files.
+        This materialises the whole listing; prefer iter_object_pages/iter_objects
+        for prefixes that may hold many objects.
+        :param bucket_name: (str) S3 bucket name
+        :param path_prefix: (str) Prefix to filter objects
+        :param delimiter: (str) Delimiter to group objects (e.g., '/')
+        :param raw_list: (bool) If True, return the list of ObjectRecords
+        :return: (list) List of objects or folders
+        """
+
+        folders = []
+        records = []
+        for _folders, _records, _ in self.iter_object_pages(bucket_name, path_prefix, delimiter):
+            folders += _folders
+            records += _records
 
         if raw_list:
-            return contents
-        
-        folders = [item['Prefix'] for item in common_prefixes]
-        files = [{'name': item['Key'], 'size': get_filesize_str(item['Size'], 2),
-                  'date': item['LastModified']} for item in contents if item['Key'] != path_prefix]
+            return records
+
+        files = [{'name': item.key, 'size': get_filesize_str(item.size, 2),
+                  'date': datetime.fromtimestamp(item.mtime, timezone.utc)} for item in records if item.key != path_prefix]
         return folders, files
 
-    def generate_presigned_url(self, bucket, key, method, expires_in=300, upload_id=None, part_number=None):
+    def generate_presigned_url(self, bucket, key, method, expires_in=None, upload_id=None, part_number=None):
         """
         Helper method to generate presigned URLs.
         :param bucket: (str) S3 bucket name
         :param key: (str) S3 object key
         :param method: (str) S3 operation (e.g., 'get_object', 'upload_part')
-        :param expires_in: (int) Expiration time in seconds
+        :param expires_in: (int) Expiration time in seconds (B3_PRESIGNED_URLS['EXPIRY'] by default)
         :param upload_id: (str) Upload ID for multipart uploads (optional)
         :param part_number: (int) Part number for multipart uploads (optional)
         :return: (str) Presigned URL
@@ -120,97 +488,350 @@ class S3:
         params = {'Bucket': bucket, 'Key': key}
         if upload_id and part_number:
             params.update({'UploadId': upload_id, 'PartNumber': part_number})
+        if expires_in is None:
+            expires_in = url_cache.config['EXPIRY']
         return self.client.generate_presigned_url(method, Params=params, ExpiresIn=expires_in)
 
-    def get_signed_url(self, folders, files, method='get_object'):
+    def get_object_url(self, bucket, key):
         """
-        Generate presigned URLs for folders and files.
+        Get a presigned GET URL of an object, reusing the cached URL while it is still valid long enough.
+        :param bucket: (str) S3 bucket name
+        :param key: (str) S3 object key
+        :return: (tuple) Presigned URL and the number of seconds it stays valid
+        """
+        return url_cache.get_url(self.key_id, bucket, key,
+                                 lambda expires_in: self.generate_presigned_url(bucket, key, 'get_object', expires_in))
+
+    def sign_url(self, bucket, key, method):
+        # GET URLs come from the URL cache, other operations are signed every time
+        if method == 'get_object':
+            return self.get_object_url(bucket, key)[0]
+        return self.generate_presigned_url(bucket, key, method)
+
+    def iter_signed_urls(self, folders, files, method='get_object', max_workers=WALK_MAX_WORKERS, file_sizes=None):
+        """
+        Generate presigned URLs for folders and files, one entry at a time while
+        the folders are walked, with the size and ETag of every object. A file
+        that can't be read gets an entry with an error instead, and the others follow.
         :param folders: (list) List of folder paths
         :param files: (list) List of file paths
         :param method: (str) S3 operation (e.g., 'get_object', 'put_object')
-        :return: (list) List of presigned URLs
+        :param max_workers: (int) Number of listings (and HEAD requests) run in parallel
+        :param file_sizes: (list) Sizes of the files already known from a listing, None
+                           for the others (optional). Files without a size are sent a HEAD request
+        :return: (generator) Dictionaries with the path, presigned URL, size and ETag of each
+                 object, or with the path and the error of the files that can't be read
         """
-        url_list = []
+        def get_record(path, size):
+            if size is not None:
+                return ObjectRecord(path[1], size, None, None)
+            try:
+                return self.get_object_record(*path)
+            except ClientError as e:
+                return e
+
+        # Selected files first, their records are fetched in parallel and are quick to get
+        with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+            paths = [self.parse_obj_path(_file) for _file in files]
+            records = executor.map(get_record, paths, file_sizes or [None] * len(paths))
+            for (_bucket_name, _key), _record in zip(paths, records):
+                if isinstance(_record, ClientError):
+                    yield {'path': _key.rsplit('/', 1)[-1], 'error': str(_record)}
+                    continue
+                yield {
+                    'path': _key.rsplit('/', 1)[-1],
+                    'token': self.sign_url(_bucket_name, _key, method),
+                    'size': _record.size,
+                    'etag': _record.etag,
+                }
 
-        # Process folders
         for folder in folders:
-            
+
             _bucket_name, _key = self.parse_obj_path(folder)
             _folder_path = _key if _key[-1] == '/' else _key + '/'
+            _parent = Path(_folder_path).parent
 
-            _contents = self.get_object_list(_bucket_name, _folder_path, raw_list=True)
-
-            for _content in _contents:
-                if _content['Key'][-1] != '/':
-                    _token = self.generate_presigned_url(
-                        _bucket_name, _content['Key'], method, expires_in=300
-                    )
+            for _content in self.walk(_bucket_name, _folder_path, max_workers=max_workers):
+                if _content.key[-1] != '/':
+                    yield {
+                        'path': Path(_content.key).relative_to(_parent).as_posix(),
+                        'token': self.sign_url(_bucket_name, _content.key, method),
+                        'size': _content.size,
+                        'etag': _content.etag,
+                    }
 
-                    url_list.append({
-                        'path': Path(_content['Key']).relative_to(Path(_folder_path).parent).as_posix(),
-                        'token': _token
-                    })
-
-        # Process files
-        for _file in files:
-            _bucket_name, _key = self.parse_obj_path(_file)
+    def get_signed_url(self, folders, files, method='get_object'):
+        """
+        Generate presigned URLs for folders and files.
+        :param folders: (list) List of folder paths
+        :param files: (list) List of file paths
+        :param method: (str) S3 operation (e.g., 'get_object', 'put_object')
+        :return: (list) List of presigned URLs
+        """
+        return list(self.iter_signed_urls(folders, files, method))
 
-            _token = self.generate_presigned_url(
-                _bucket_name, _key, method, expires_in=3000
+    def get_part_urls(self, bucket_name, obj_path, upload_id, first_part, count):
+        """
+        Generate presigned URLs for a window of parts of a multipart upload.
+        :param bucket_name: (str) S3 bucket name
+        :param obj_path: (str) S3 object key
+        :param upload_id: (str) Upload ID for the multipart upload
+        :param first_part: (int) Number of the first part of the window (1-based)
+        :param count: (int) Number of parts in the window
+        :return: (list) Presigned URLs of parts first_part .. first_part + count - 1
+        """
+        last_part = min(first_part + count - 1, MAX_PART_NUMBER)
+        return [
+            self.generate_presigned_url(
+                bucket_name, obj_path, 'upload_part',
+                upload_id=upload_id, part_number=part
             )
+            for part in range(first_part, last_part + 1)
+        ]
 
-            url_list.append({
-                'path': _key.rsplit('/', 1)[-1],
-                'token': _token,
-            })
-
-        return url_list
-    
-    def start_upload(self, files, upload_chunk_size):
+    def start_file_upload(self, _file, part_window=None, concurrency=None):
+        """
+        Start the upload of a file, with the strategy chosen by plan_upload.
+        :param _file: (list) File path and size
+        :param part_window: (int) Number of part URLs issued up front. The remaining
+                            URLs are requested with get_part_urls as the upload
+                            progresses. All the part URLs are issued when None.
+        :param concurrency: (int) Number of parts the client uploads in parallel (optional)
+        :return: (dict) Upload plan: strategy, part size, number of parts,
+                 upload ID (None for single PUTs) and the presigned URLs of the first parts
+        """
+        _bucket_name, _key = self.parse_obj_path(_file[0])
+        strategy, part_size = plan_upload(_file[1], concurrency)
+
+        if strategy == 'single':
+            return {
+                'strategy': strategy,
+                'token': [self.generate_presigned_url(_bucket_name, _key, 'put_object')],
+                'upload_id': None,
+                'part_size': part_size,
+                'part_count': 1,
+            }
+
+        res = self.client.create_multipart_upload(Bucket=_bucket_name, Key=_key)
+        upload_id = res['UploadId']
+        total_chunks = (_file[1] + part_size - 1) // part_size
+        window = total_chunks if part_window is None else min(part_window, total_chunks)
+        _token = self.get_part_urls(_bucket_name, _key, upload_id, 1, window)
+
+        return {
+            'strategy': strategy,
+            'token': _token,
+            'upload_id': upload_id,
+            'part_size': part_size,
+            'part_count': total_chunks,
+        }
+
+    def generate_upload_policy(self, bucket_name, prefix):
+        """
+        Generate a presigned POST policy letting the browser upload any number of
+        small files below a folder without asking the server for every file.
+        The policy is limited to keys starting with the prefix, to files smaller
+        than the single PUT threshold, and expires after POLICY_EXPIRY seconds.
+        :param bucket_name: (str) S3 bucket name
+        :param prefix: (str) Folder prefix the files are uploaded to
+        :return: (dict) POST URL, form fields, prefix, maximum file size and expiry,
+                 or None when the service has no browser POST uploads
         """
-        Start a multipart upload for the specified files.
+        # Backblaze's S3 compatible API has no POST object uploads
+        if self.service_provider == 'backblaze':
+            return None
+
+        upload_settings = {**UPLOAD_DEFAULTS, **getattr(settings, 'B3_UPLOAD', {})}
+        max_size = upload_settings['SINGLE_PUT_THRESHOLD'] - 1
+        policy = self.client.generate_presigned_post(
+            bucket_name, prefix + '${filename}',
+            Conditions=[['starts-with', '$key', prefix], ['content-length-range', 0, max_size]],
+            ExpiresIn=upload_settings['POLICY_EXPIRY'],
+        )
+        return {
+            'url': policy['url'],
+            'fields': policy['fields'],
+            'prefix': prefix,
+            'max_size': max_size,
+            'expires_in': upload_settings['POLICY_EXPIRY'],
+        }
+
+    def iter_start_upload(self, files, part_window=None, concurrency=None, max_workers=UPLOAD_START_WORKERS):
+        """
+        Start the uploads of many files on a bounded thread pool, yielding each
+        upload plan as soon as it is ready so the client can start uploading
+        while the other files are being prepared.
         :param files: (list) List of file paths and sizes
-        :param upload_chunk_size: (int) Chunk size for multipart uploads
-        :return: (list) List of presigned URLs for each part
-        """
-        url_list = []
-
-        for _file in files:
-            _bucket_name, _key = self.parse_obj_path(_file[0])
-            res = self.client.create_multipart_upload(Bucket=_bucket_name, Key=_key)
-            upload_id = res['UploadId']
-            total_chunks = (_file[1] + upload_chunk_size - 1) // upload_chunk_size
-            _token = [
-                self.generate_presigned_url(
-                    _bucket_name, _key, 'upload_part', expires_in=3600,
-                    upload_id=upload_id, part_number=part
-                )
-                for part in range(1, total_chunks + 1)
-            ]
-
-            url_list.append({
-                'token': _token,
-                'upload_id': upload_id
-            })
+        :param part_window: (int) Number of part URLs issued up front (see start_file_upload)
+        :param concurrency: (int) Number of parts the client uploads in parallel (optional)
+        :param max_workers: (int) Number of uploads started in parallel
+        :return: (generator) Index of the file in `files` and its upload plan, in completion order
+        """
+        pending = set()
+        executor = ContextThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='b3-upload')
+
+        def start(index, _file):
+            return index, self.start_file_upload(_file, part_window, concurrency)
 
+        try:
+            for index, _file in enumerate(files):
+                pending.add(executor.submit(start, index, _file))
+
+                # Bound the number of files started ahead of the consumer
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def start_upload(self, files, part_window=None, concurrency=None):
+        """
+        Start the upload of the specified files, with the strategy chosen by plan_upload.
+        :param files: (list) List of file paths and sizes
+        :param part_window: (int) Number of part URLs issued up front (see start_file_upload)
+        :param concurrency: (int) Number of parts the client uploads in parallel (optional)
+        :return: (list) Upload plan of each file, in the order of `files`
+        """
+        url_list = [None] * len(files)
+        for index, plan in self.iter_start_upload(files, part_window, concurrency):
+            url_list[index] = plan
         return url_list
 
     def complete_upload(self, bucket_name, obj_path, upload_id, parts):
         """
         Finalise the multipart upload by sending the list of parts to S3.
+        Single PUT uploads (no upload ID) are already stored and only refresh the listing cache.
         :param bucket: (str) S3 bucket name
         :param obj_path: (str) S3 object key
         :param upload_id: (str) Upload ID for the multipart upload
         :param parts: (list) List of parts to be uploaded
-        :return: None
+        :return: (bool) True if the upload was completed, False if it was aborted
         """
 
         try:
+            if not upload_id:
+                return True
             self.client.complete_multipart_upload(Bucket=bucket_name, Key=obj_path, UploadId=upload_id, MultipartUpload={'Parts': parts})
+            return True
             
         except Exception as e:
-            print(f'Error finalising {e}')
+            logger.error('Error finalising upload of %s/%s: %s', bucket_name, obj_path, e)
             self.client.abort_multipart_upload(Bucket=bucket_name, Key=obj_path, UploadId=upload_id)
+            return False
+
+        finally:
+            listing_cache.invalidate(bucket_name, [obj_path])
+
+    def list_upload_parts(self, bucket_name, obj_path, upload_id):
+        """
+        List the parts already uploaded to a multipart upload.
+        :param bucket_name: (str) S3 bucket name
+        :param obj_path: (str) S3 object key
+        :param upload_id: (str) Upload ID for the multipart upload
+        :return: (list) PartNumber, ETag and Size of each uploaded part, or None when
+                 the upload no longer exists (completed, aborted or expired)
+        """
+        parts = []
+        params = {'Bucket': bucket_name, 'Key': obj_path, 'UploadId': upload_id}
+        try:
+            while True:
+                res = self.client.list_parts(**params)
+                parts += [{'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'Size': part['Size']}
+                          for part in res.get('Parts', [])]
+                if not res.get('IsTruncated'):
+                    return parts
+                params['PartNumberMarker'] = res['NextPartNumberMarker']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchUpload':
+                return None
+            raise
+
+    def get_object_record(self, bucket_name, obj_path):
+        """
+        Get the listing record of a single object.
+        :param bucket_name: (str) S3 bucket name
+        :param obj_path: (str) S3 object key
+        :return: (ObjectRecord) Record of the object
+        """
+        res = self.client.head_object(Bucket=bucket_name, Key=obj_path)
+        return ObjectRecord(obj_path, res['ContentLength'], res['LastModified'].timestamp(),
+                            res.get('ETag', '').strip('"'))
+
+    def get_object_records(self, bucket_name, keys, max_workers=WALK_MAX_WORKERS):
+        """
+        Get the listing records of several objects, with one HEAD request per key
+        sent in parallel. Keys that don't exist are left out.
+        :param bucket_name: (str) S3 bucket name
+        :param keys: (list) S3 object keys
+        :param max_workers: (int) Number of HEAD requests sent in parallel
+        :return: (list) Records of the existing objects
+        """
+        def get_record(key):
+            try:
+                return self.get_object_record(bucket_name, key)
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                    return None
+                raise
+
+        with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+            return [record for record in executor.map(get_record, keys) if record]
+
+    def get_object_range(self, bucket_name, obj_path, start, end):
+        """
+        Read a byte range of an object.
+        :param bucket_name: (str) S3 bucket name
+        :param obj_path: (str) S3 object key
+        :param start: (int) First byte of the range
+        :param end: (int) Last byte of the range (inclusive)
+        :return: (bytes) Data of the range
+        """
+        res = self.client.get_object(Bucket=bucket_name, Key=obj_path, Range=f'bytes={start}-{end}')
+        return res['Body'].read()
+
+    def iter_object_chunks(self, objects, chunk_size, max_workers, prefetch):
+        """
+        Read the data of many objects in order, as ranged GETs prefetched on a
+        small worker pool. At most `prefetch` chunks are fetched or waiting at
+        any time, so memory stays bounded whatever the number and size of the objects.
+        :param objects: (iterable) Tuples starting with the bucket name and ending with
+                        the ObjectRecord of each object; they are yielded back with its data
+        :param chunk_size: (int) Size of the ranged GETs in bytes
+        :param max_workers: (int) Number of ranges fetched in parallel
+        :param prefetch: (int) Number of chunks fetched ahead of the consumer
+        :return: (generator) Object tuple, offset and data of each chunk (one empty chunk for empty objects)
+        """
+        def iter_ranges():
+            for item in objects:
+                bucket_name, record = item[0], item[-1]
+                if record.size == 0:
+                    yield item, 0, None
+                for start in range(0, record.size, chunk_size):
+                    yield item, start, (bucket_name, record.key, start, min(start + chunk_size, record.size) - 1)
+
+        ranges = iter_ranges()
+        pending = deque()
+        executor = ContextThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='b3-fetch')
+        try:
+            while True:
+                while len(pending) < prefetch:
+                    chunk = next(ranges, None)
+                    if chunk is None:
+                        break
+                    item, start, args = chunk
+                    pending.append((item, start, executor.submit(self.get_object_range, *args) if args else None))
+                if not pending:
+                    break
+                item, start, future = pending.popleft()
+                yield item, start, future.result() if future else b''
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def parse_obj_path(self, obj_path):
         """
@@ -227,6 +848,7 @@ class S3:
     def prepare_delete(self, folders, file_list):
         """
         Prepare a list of files and folders to be deleted from S3 bucket.
+        The folder markers are deleted with the folders, as in iter_delete_keys.
         :param folders: (list) List of folder paths
         :param file_list: (list) List of file paths
         :return: (list) List of files to be deleted
@@ -238,8 +860,7 @@ class S3:
         for folder in folders:
             _bucket_name, _key = self.parse_obj_path(folder)
             _folder_path = _key if _key[-1] == '/' else _key + '/'
-            _, _contents = self.get_object_list(_bucket_name, _folder_path)
-            delete_list += [_bucket_name+'/'+item['name'] for item in _contents]
+            delete_list += [_bucket_name+'/'+item.key for item in self.walk(_bucket_name, _folder_path)]
 
         # Files are already in the correct format
         # so we can just append them to the delete list
@@ -247,16 +868,92 @@ class S3:
 
         return delete_list
     
-    def initiate_delete(self, delete_list):
+    def iter_delete_keys(self, folders, file_list):
+        """
+        Stream the (bucket, key) pairs to be deleted as the folder listings arrive,
+        the folder markers included.
+        :param folders: (list) List of folder paths
+        :param file_list: (list) List of file paths
+        :return: (generator) Tuples of bucket name and key
+        """
+        for folder in folders:
+            _bucket_name, _key = self.parse_obj_path(folder)
+            _folder_path = _key if _key[-1] == '/' else _key + '/'
+            for item in self.walk(_bucket_name, _folder_path):
+                yield _bucket_name, item.key
+
+        for _file in file_list:
+            yield self.parse_obj_path(_file)
+
+    def delete_batch(self, bucket_name, keys):
+        """
+        Delete up to 1000 keys with a single DeleteObjects request.
+        :param bucket_name: (str) S3 bucket name
+        :param keys: (list) Keys to be deleted
+        :return: (list) Errors of the keys that could not be deleted
+        """
+        try:
+            response = self.client.delete_objects(
+                Bucket=bucket_name,
+                Delete={'Objects': [{'Key': _key} for _key in keys], 'Quiet': True}
+            )
+            errors = [{'path': bucket_name + '/' + e['Key'], 'code': e.get('Code'), 'message': e.get('Message')}
+                      for e in response.get('Errors', [])]
+        except ClientError as e:
+            logger.warning('Error deleting %d keys from %s: %s', len(keys), bucket_name, e)
+            error = e.response.get('Error', {})
+            errors = [{'path': bucket_name + '/' + _key, 'code': error.get('Code'), 'message': error.get('Message')}
+                      for _key in keys]
+        finally:
+            listing_cache.invalidate(bucket_name, keys)
+
+        return errors
+
+    def initiate_delete(self, delete_list, folders=(), max_workers=DELETE_MAX_WORKERS, progress=None):
         """
         Initiate the deletion of files and folders from S3 bucket.
-        :param delete_list: (list) List of files and folders to be deleted
+        Keys are sent in DeleteObjects batches of up to 1000 keys, and the
+        batches run in parallel on a bounded thread pool. Folders are listed
+        and deleted at the same time, without building the full key list.
+        :param delete_list: (list) List of files to be deleted
+        :param folders: (list) List of folders to be deleted recursively (optional)
+        :param max_workers: (int) Number of batches deleted in parallel
+        :param progress: (callable) Called with the number of deleted keys and the errors
+                         of every finished batch; an exception raised by it stops the deletion (optional)
+        :return: (dict) Number of deleted objects and the per-key errors
         """
+        result = {'deleted': 0, 'errors': []}
+        pending = set()
 
-        for item in delete_list:
-            _bucket_name, _key = self.parse_obj_path(item)
-            print(_bucket_name, _key)
-            self.client.delete_object(Bucket=_bucket_name, Key=_key)
-        
+        def collect(futures):
+            for future in futures:
+                batch_size, errors = future.result()
+                result['deleted'] += batch_size - len(errors)
+                result['errors'] += errors
+                if progress:
+                    progress(batch_size - len(errors), errors)
+
+        def run_batch(bucket_name, keys):
+            return len(keys), self.delete_batch(bucket_name, keys)
+
+        with ContextThreadPoolExecutor(max_workers=max_workers) as executor:
+            batches = {}
+            for _bucket_name, _key in self.iter_delete_keys(folders, delete_list):
+                batch = batches.setdefault(_bucket_name, [])
+                batch.append(_key)
+                if len(batch) < DELETE_BATCH_SIZE:
+                    continue
+
+                pending.add(executor.submit(run_batch, _bucket_name, batches.pop(_bucket_name)))
+
+                # Bound the number of batches held in memory
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+            for _bucket_name, batch in batches.items():
+                pending.add(executor.submit(run_batch, _bucket_name, batch))
 
+            collect(pending)
 
+        return result
@@ -0,0 +1,55 @@
+"""
+Bucket helpers shared by the views and the background jobs: the S3 handles of
+the configured buckets, and the bookkeeping of the writes made through b3
+(listing cache and bucket inventory).
+"""
+from . import inventory
+from .cache import listing_cache
+from .metrics import timed
+from .models import Bucket
+from .s3 import S3, client_registry
+
+
+def get_s3_handle(bucket_name):
+    s3 = client_registry.get_bucket(bucket_name)
+    if s3:
+        return s3
+
+    bucket = Bucket.objects.filter(name=bucket_name).first()
+    if not bucket:
+        return None
+    with timed('decrypt'):
+        secret_key = bucket.get_decrypted_secret_key()
+    s3 = S3((bucket.key_id, secret_key), bucket.service, bucket.region, bucket.name)
+    client_registry.set_bucket(bucket.name, bucket.pk, s3)
+    return s3
+
+
+def record_upload(s3, bucket_name, key):
+    # Keep the bucket inventory (if any) in line with the uploaded object
+    if inventory.has_inventory(bucket_name):
+        inventory.record_objects(bucket_name, [s3.get_object_record(bucket_name, key)])
+
+
+def record_policy_uploads(s3, bucket_name, keys):
+    # Files uploaded with a POST policy never reach the server, the browser reports them once done
+    listing_cache.invalidate(bucket_name, keys)
+    if keys and inventory.has_inventory(bucket_name):
+        inventory.record_objects(bucket_name, s3.get_object_records(bucket_name, keys))
+
+
+def record_delete(s3, bucket_name, folder_list, file_list, result):
+    # Keep the bucket inventory (if any) in line with the deleted objects
+    if not inventory.has_inventory(bucket_name):
+        return
+    folders = [s3.parse_obj_path(folder)[1].rstrip('/') + '/' for folder in folder_list]
+    keys = [s3.parse_obj_path(_file)[1] for _file in file_list]
+    kept_keys = [error['path'][len(bucket_name) + 1:] for error in result['errors']]
+    inventory.remove_objects(bucket_name, folders, keys, kept_keys)
+
+
+def get_folder_rollups(bucket_name, prefixes=None, parent=None):
+    # Recursive folder sizes and object counts, only known for buckets with an inventory
+    if not inventory.has_inventory(bucket_name):
+        return {}
+    return inventory.get_rollups(bucket_name, prefixes, parent)
@@ -0,0 +1,22 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .metrics import time_queries
+from .models import Bucket
+from .s3 import client_registry
+
+
+@receiver(post_save, sender=Bucket)
+@receiver(post_delete, sender=Bucket)
+def invalidate_bucket_handle(sender, instance, **kwargs):
+    # Drop the cached S3 handle so that new credentials, region or service
+    # (or the removal of the bucket) take effect on the next request
+    client_registry.invalidate(instance.name, instance.pk)
+
+
+@receiver(connection_created)
+def time_connection_queries(sender, connection, **kwargs):
+    # Charge the queries of every database connection to the Server-Timing of their request
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_queries)
@@ -0,0 +1,47 @@
+from functools import lru_cache
+import hashlib
+import hmac
+
+from botocore import auth
+
+
+@lru_cache(maxsize=256)
+def get_signing_key(secret_key, date_stamp, region_name, service_name):
+    """
+    Derive the SigV4 signing key. The key only changes once a day per
+    credentials, region and service, so the four HMAC rounds are cached.
+    :param secret_key: (str) AWS secret access key
+    :param date_stamp: (str) Request date in YYYYMMDD format
+    :param region_name: (str) Signing region
+    :param service_name: (str) Signing service (e.g., 's3')
+    :return: (bytes) Signing key
+    """
+    k_date = hmac.new(f"AWS4{secret_key}".encode(), date_stamp.encode(), hashlib.sha256).digest()
+    k_region = hmac.new(k_date, region_name.encode(), hashlib.sha256).digest()
+    k_service = hmac.new(k_region, service_name.encode(), hashlib.sha256).digest()
+    return hmac.new(k_service, b'aws4_request', hashlib.sha256).digest()
+
+
+class CachedSigningKeyMixin:
+    def signature(self, string_to_sign, request):
+        k_signing = get_signing_key(self.credentials.secret_key, request.context['timestamp'][0:8],
+                                    self._region_name, self._service_name)
+        return self._sign(k_signing, string_to_sign, hex=True)
+
+
+class CachedS3SigV4Auth(CachedSigningKeyMixin, auth.S3SigV4Auth):
+    pass
+
+
+class CachedS3SigV4QueryAuth(CachedSigningKeyMixin, auth.S3SigV4QueryAuth):
+    pass
+
+
+def register_signers():
+    """
+    Use the cached signing key for the 's3v4' signers. Nothing is replaced
+    when botocore uses the CRT signers, which derive the key natively.
+    """
+    for signature_version, signer in (('s3v4', CachedS3SigV4Auth), ('s3v4-query', CachedS3SigV4QueryAuth)):
+        if auth.AUTH_TYPE_MAPS.get(signature_version) in signer.__mro__:
+            auth.AUTH_TYPE_MAPS[signature_version] = signer
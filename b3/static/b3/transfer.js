@@ -3,44 +3,244 @@
 
 import { PopUp, InfoBox } from "./ui.js";
 
-const upload_chunk_size = 8 * 1024 * 1024; // 8 MB chunks
+const MAX_CONCURRENT_UPLOADS = 5; // Parts of a file uploaded in parallel (the server sizes the parts for it)
 const MAX_RETRIES = 3; // Maximum number of retries for failed chunks
 const BASE_DELAY = 1000; // Base delay in milliseconds for exponential backoff
+const PART_URL_WINDOW = 64; // Number of part URLs requested from the server at a time
+const FINGERPRINT_SAMPLE = 1024 * 1024; // Bytes hashed at each end of a file to recognise it on resume
+const RESUMABLE_MIN_SIZE = 16 * 1024 * 1024; // Smaller files take a single PUT and can't be resumed
+const MAX_CONCURRENT_FILES = 4; // Files uploaded in parallel
+const POLICY_MIN_FILES = 10; // Uploads of at least this many small files use a folder POST policy
+const MAX_CONCURRENT_DOWNLOADS = 5; // Files downloaded in parallel
+const DOWNLOAD_LOOKAHEAD = 1000; // Manifest entries read ahead of the downloads, to pick the largest files first
+const RANGE_DOWNLOAD_MIN_SIZE = 64 * 1024 * 1024; // Larger files are downloaded as byte ranges in parallel
+const RANGE_SIZE = 16 * 1024 * 1024; // Bytes requested per range
+const MAX_CONCURRENT_RANGES = 4; // Ranges of a file downloaded in parallel
+const RANGE_WRITE_BATCH = 2 * 1024 * 1024; // Bytes of a range held in memory before they are written
+
+
+// Presigned part URLs of a multipart upload, requested from the server
+// in windows of PART_URL_WINDOW parts as the upload progresses
+class PartUrls {
+    constructor(uploadDetails, bucket_name, object_path, csrfToken) {
+        this.upload_id = uploadDetails.upload_id;
+        this.part_count = uploadDetails.part_count;
+        this.bucket_name = bucket_name;
+        this.object_path = object_path;
+        this.csrfToken = csrfToken;
+        this.urls = new Map();
+        this.windows = new Map(); // Window requests in flight
+
+        uploadDetails.token.forEach((url, index) => this.urls.set(index + 1, url));
+    }
+
+    async get(part_number) {
+        if (!this.urls.has(part_number)) {
+            const first_part = part_number - ((part_number - 1) % PART_URL_WINDOW);
+            if (!this.windows.has(first_part)) {
+                this.windows.set(first_part, this.fetch_window(first_part)
+                    .finally(() => this.windows.delete(first_part)));
+            }
+            await this.windows.get(first_part);
+        }
+        return this.urls.get(part_number);
+    }
+
+    async fetch_window(first_part) {
+        const qData = {
+            bucket: this.bucket_name,
+            object_path: this.object_path,
+            upload_id: this.upload_id,
+            first_part: first_part,
+            count: Math.min(PART_URL_WINDOW, this.part_count - first_part + 1),
+        };
+
+        const response = await fetch('/b3/uploadparts/', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': this.csrfToken,
+            },
+            body: JSON.stringify(qData),
+        });
+
+        if (!response.ok) {
+            throw new Error(`Failed to get part URLs from part ${first_part}`);
+        }
+
+        const data = await response.json();
+        data.result.forEach((url, index) => this.urls.set(first_part + index, url));
+    }
+}
+
+
+// Presigned POST policy letting the browser upload small files anywhere below
+// a folder, requested again from the server shortly before it expires
+class UploadPolicy {
+    constructor(bucket_name, prefix, csrfToken) {
+        this.bucket_name = bucket_name;
+        this.prefix = prefix;
+        this.csrfToken = csrfToken;
+        this.policy = null;
+        this.expires_at = 0;
+    }
 
+    async get() {
+        if (!this.policy || Date.now() > this.expires_at) {
+            this.policy = post_upload_request('/b3/uploadpolicy/', {
+                operation: 'create',
+                bucket: this.bucket_name,
+                prefix: this.prefix,
+            }, this.csrfToken);
+            const policy = await this.policy;
+            this.expires_at = Date.now() + (policy ? policy.expires_in - 60 : 0) * 1000;
+        }
+        return await this.policy;
+    }
 
-async function upload_all(result, files, upload_path, csrfToken) {
+    async complete(keys) {
+        // One report for every file uploaded with the policy, to refresh the listings
+        await post_upload_request('/b3/uploadpolicy/', {
+            operation: 'complete',
+            bucket: this.bucket_name,
+            prefix: this.prefix,
+            keys: JSON.stringify(keys),
+        }, this.csrfToken);
+    }
+}
+
+async function* read_ndjson(response) {
+    // Parse a streamed NDJSON response line by line, as it arrives
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        for (const line of lines) {
+            if (line.trim()) yield JSON.parse(line);
+        }
+    }
+    if (buffer.trim()) yield JSON.parse(buffer);
+}
+
+async function upload_all(plans, files, upload_path, csrfToken) {
     
     const path_parts = upload_path.split('/');
     const bucket_name = path_parts.shift();
     const folder_path = path_parts.length > 0 ? path_parts.join('/') : '';
 
-    const promises = result.map((uploadDetails, index) =>
-        upload_single_file(uploadDetails, files[index], bucket_name, folder_path, csrfToken)
-    );
+    // Files start uploading as soon as their plan arrives, a few at a time
+    const active = new Set();
+    const policy_keys = [];
+    let policy = null;
+    try {
+        for await (const [index, uploadDetails] of plans) {
+            const promise = upload_single_file(uploadDetails, files[index], bucket_name, folder_path, csrfToken)
+                .then((uploaded) => {
+                    if (uploaded && uploadDetails.strategy === 'post') {
+                        policy = uploadDetails.policy;
+                        policy_keys.push(folder_path + files[index].name);
+                    }
+                })
+                .catch((error) => console.error(`Error uploading ${files[index].name}:`, error))
+                .finally(() => active.delete(promise));
+            active.add(promise);
+
+            if (active.size >= MAX_CONCURRENT_FILES) {
+                await Promise.race(active);
+            }
+        }
+    } catch (error) {
+        console.error('Error during upload initialization:', error);
+        alert('An error occurred while initializing the upload. Please try again.');
+    }
 
     // Wait for all uploads to complete
-    await Promise.all(promises);
+    await Promise.all(active);
+
+    if (policy_keys.length > 0) {
+        await policy.complete(policy_keys);
+        const current_path = document.getElementById('address_value').textContent;
+        if (current_path === upload_path) {
+            window.onFolder(bucket_name, folder_path); // Refresh folder view
+        }
+    }
 
 }
 
 async function upload_single_file(uploadDetails, file, bucket_name, folder_path, csrfToken) {
-    const uploaded_parts = [];
+    // The server plans the upload: a single PUT for small files, otherwise the part size.
+    // Resumed uploads come with the parts S3 already has
+    const part_size = uploadDetails.part_size;
+    const uploaded_parts = (uploadDetails.parts || []).map(part => ({ PartNumber: part.PartNumber, ETag: part.ETag }));
+    const done_parts = new Set(uploaded_parts.map(part => part.PartNumber));
     const failed_chunks = [];
-    const total_chunks = Math.ceil(file.size / upload_chunk_size);
+    const total_chunks = Math.ceil(file.size / part_size);
     const progress_bar = create_progress_bar(`Uploading ${file.name}: `, file.size);
+    const object_path = [folder_path, file.name].join('');
+    const part_urls = new PartUrls(uploadDetails, bucket_name, object_path, csrfToken);
+    progress_bar.value = (uploadDetails.parts || []).reduce((total, part) => total + part.Size, 0);
+
+    if (uploadDetails.strategy === 'post') {
+        // Uploaded straight to S3 with the folder policy, reported in one go by upload_all
+        try {
+            const policy = await uploadDetails.policy.get();
+            const form = new FormData();
+            for (const [name, value] of Object.entries(policy.fields)) {
+                form.append(name, value);
+            }
+            form.set('key', object_path);
+            form.append('file', file); // The file must be the last field
+            await upload_chunk_with_retry(policy.url, form, MAX_RETRIES, 'POST');
+            progress_bar.value = file.size;
+            return true;
+        } catch (error) {
+            console.error(`Failed to upload ${file.name}:`, error);
+            alert(`Failed to upload ${file.name} after retries. Please try again.`);
+            return false;
+        } finally {
+            progress_bar.parentElement.remove();
+        }
+    }
+
+    if (uploadDetails.strategy === 'single') {
+        try {
+            await upload_chunk_with_retry(uploadDetails.token[0], file);
+            progress_bar.value = file.size;
+        } catch (error) {
+            console.error(`Failed to upload ${file.name}:`, error);
+            alert(`Failed to upload ${file.name} after retries. Please try again.`);
+            return;
+        } finally {
+            progress_bar.parentElement.remove();
+        }
+        // There is no multipart upload to complete, this only refreshes the listings
+        try {
+            await finalize_upload({ bucket: bucket_name, object_path: object_path, upload_id: null, parts: '[]' },
+                csrfToken, file.name, bucket_name, folder_path);
+        } catch (error) {
+            console.error("Error finalizing upload:", error);
+        }
+        return;
+    }
 
-    const MAX_CONCURRENT_UPLOADS = 5; // Limit the number of concurrent uploads
-    const uploadPromises = [];
+    // Parts in flight, each removed when it settles so that at most
+    // MAX_CONCURRENT_UPLOADS parts (and part URL windows) are in progress
+    const uploadPromises = new Set();
 
     // Manage upload chunks in parallel
     for (let chunk_index = 0; chunk_index < total_chunks; chunk_index++) {
-        const chunk_start = chunk_index * upload_chunk_size;
-        const chunk_end = Math.min(chunk_start + upload_chunk_size, file.size);
+        if (done_parts.has(chunk_index + 1)) continue;
+        const chunk_start = chunk_index * part_size;
+        const chunk_end = Math.min(chunk_start + part_size, file.size);
         const file_chunk = file.slice(chunk_start, chunk_end);
 
         const uploadPromise = (async () => {
             try {
-                const etag = await upload_chunk_with_retry(uploadDetails.token[chunk_index], file_chunk);
+                const etag = await upload_chunk_with_retry(await part_urls.get(chunk_index + 1), file_chunk);
                 uploaded_parts.push({ PartNumber: chunk_index + 1, ETag: etag });
 
                 // Update progress bar
@@ -51,12 +251,12 @@ async function upload_single_file(uploadDetails, file, bucket_name, folder_path,
 
                 //throw error; // Abort if any chunk fails
             }
-        })();
+        })().finally(() => uploadPromises.delete(uploadPromise));
 
-        uploadPromises.push(uploadPromise);
+        uploadPromises.add(uploadPromise);
 
         // Wait for uploads if concurrency limit is reached
-        if (uploadPromises.length >= MAX_CONCURRENT_UPLOADS) {
+        if (uploadPromises.size >= MAX_CONCURRENT_UPLOADS) {
             await Promise.race(uploadPromises);
         }
     }
@@ -64,18 +264,19 @@ async function upload_single_file(uploadDetails, file, bucket_name, folder_path,
     await Promise.all(uploadPromises); // Wait for all remaining uploads to complete
 
     for (const chunk_index of failed_chunks) {
-        const chunk_start = chunk_index * upload_chunk_size;
-        const chunk_end = Math.min(chunk_start + upload_chunk_size, file.size);
+        const chunk_start = chunk_index * part_size;
+        const chunk_end = Math.min(chunk_start + part_size, file.size);
         const file_chunk = file.slice(chunk_start, chunk_end);
         try {
-            const etag = await upload_chunk_with_retry(uploadDetails.token[chunk_index], file_chunk);
+            const etag = await upload_chunk_with_retry(await part_urls.get(chunk_index + 1), file_chunk);
             uploaded_parts.push({ PartNumber: chunk_index + 1, ETag: etag });
             // Update progress bar
             progress_bar.value += file_chunk.size;
         } catch (error) {
             console.error(`Failed to upload chunk ${chunk_index + 1} after retries:`, error);
-            alert(`Failed to upload chunk ${chunk_index + 1} after retries. Please try again.`);
-            return; // Abort if any chunk fails after retries
+            alert(`Failed to upload chunk ${chunk_index + 1} of ${file.name} after retries. `
+                + 'Upload the file again to resume from the parts already uploaded.');
+            return; // Stop here, the uploaded parts are kept for a resume
         }
     }
     
@@ -90,7 +291,7 @@ async function upload_single_file(uploadDetails, file, bucket_name, folder_path,
     // Finalize the multipart upload
     const qData = {
         bucket: bucket_name,
-        object_path: [folder_path, file.name].join(''),
+        object_path: object_path,
         upload_id: uploadDetails.upload_id,
         parts: JSON.stringify(uploaded_parts),
     };
@@ -103,10 +304,10 @@ async function upload_single_file(uploadDetails, file, bucket_name, folder_path,
     }
 }
 
-async function upload_chunk_with_retry(url, file_chunk, retries = MAX_RETRIES) {
+async function upload_chunk_with_retry(url, file_chunk, retries = MAX_RETRIES, method = 'PUT') {
     for (let attempt = 0; attempt < retries; attempt++) {
         const response = await fetch(url, {
-            method: 'PUT',
+            method: method,
             body: file_chunk,
         });
 
@@ -143,102 +344,154 @@ async function finalize_upload(qData, csrfToken, file_name, bucket_name, folder_
     }
 }
 
+async function file_fingerprint(file) {
+    // Recognises the same file after a page reload: size, modification time and,
+    // in secure contexts, a hash of its first and last FINGERPRINT_SAMPLE bytes
+    let digest = '';
+    if (window.crypto && crypto.subtle) {
+        const sample = await new Blob([
+            file.slice(0, FINGERPRINT_SAMPLE),
+            file.slice(Math.max(FINGERPRINT_SAMPLE, file.size - FINGERPRINT_SAMPLE)),
+        ]).arrayBuffer();
+        const hash = await crypto.subtle.digest('SHA-256', sample);
+        digest = Array.from(new Uint8Array(hash), (byte) => byte.toString(16).padStart(2, '0')).join('');
+    }
+    return `${file.size}:${file.lastModified}:${digest}`;
+}
+
+async function post_upload_request(url, qData, csrfToken) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrfToken,
+        },
+        body: JSON.stringify(qData),
+    });
+
+    if (!response.ok) {
+        throw new Error(`Failed to get upload details: ${response.statusText}`);
+    }
+    const data = await response.json();
+    return data.result;
+}
+
+async function* iter_upload_plans(bucket_name, file_list, planned, csrfToken) {
+    // Files already planned in the browser (resumed uploads and folder policy uploads)
+    // first, then the plans of the new uploads as the server streams them
+    yield* planned.entries();
+
+    const new_indexes = file_list.map((_, index) => index).filter((index) => !planned.has(index));
+    if (new_indexes.length === 0) return;
+
+    const response = await fetch('/b3/startupload/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrfToken,
+        },
+        body: JSON.stringify({
+            bucket: bucket_name,
+            file_list: JSON.stringify(new_indexes.map((index) => file_list[index])),
+            part_window: PART_URL_WINDOW,
+            concurrency: MAX_CONCURRENT_UPLOADS,
+        }),
+    });
+
+    if (!response.ok) {
+        throw new Error(`Failed to get upload details: ${response.statusText}`);
+    }
+    if (response.headers.get('Content-Type').startsWith('application/json')) {
+        const data = await response.json();
+        throw new Error(data.result);
+    }
+
+    for await (const entry of read_ndjson(response)) {
+        if (entry.error) {
+            throw new Error(entry.error);
+        }
+        yield [new_indexes[entry.index], entry];
+    }
+}
+
 async function upload(files) {
     const csrfToken = $('[name="csrfmiddlewaretoken"]').val();
     const upload_path = document.getElementById('address_value').textContent;
     const file_array = Array.isArray(files) ? files : Array.from(files)
-    const file_list = file_array.map(file => [upload_path + file.name, file.size]);
     const bucket_name = upload_path.split('/')[0];
-
-    const qData = {
-        bucket: bucket_name,
-        file_list: JSON.stringify(file_list),
-        chunk_size: upload_chunk_size,
-    };
+    const folder_path = upload_path.substring(bucket_name.length + 1);
+    const planned = new Map();
+    let file_list;
 
     try {
-        const response = await fetch('/b3/startupload/', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrfToken,
-            },
-            body: JSON.stringify(qData),
-        });
+        // Only the files uploaded in parts can be resumed, the others need no fingerprint
+        file_list = await Promise.all(file_array.map(async (file) => [
+            upload_path + file.name, file.size, file.size >= RESUMABLE_MIN_SIZE ? await file_fingerprint(file) : '',
+        ]));
+        const resumable = file_list.map((_, index) => index).filter((index) => file_list[index][2]);
+
+        // Interrupted uploads of the same files continue where they stopped,
+        // the other files start new uploads
+        if (resumable.length > 0) {
+            const details = await post_upload_request('/b3/resumeupload/', {
+                bucket: bucket_name,
+                file_list: JSON.stringify(resumable.map((index) => file_list[index])),
+            }, csrfToken);
+            resumable.forEach((file_index, index) => details[index] && planned.set(file_index, details[index]));
+        }
 
-        if (response.ok) {
-            const data = await response.json();
-            upload_all(data.result, files, upload_path, csrfToken);
-        } else {
-            console.error('Failed to get upload details', response.statusText);
-            alert('An error occurred while initializing the upload.');
+        // Many small files go straight to S3 with a single POST policy for the folder
+        // (when the service supports it), without a request to the server per file
+        const small_files = file_list.map((_, index) => index).filter((index) => file_array[index].size < RESUMABLE_MIN_SIZE);
+        if (small_files.length >= POLICY_MIN_FILES) {
+            const policy = new UploadPolicy(bucket_name, folder_path, csrfToken);
+            const details = await policy.get();
+            if (details) {
+                small_files.filter((index) => file_array[index].size <= details.max_size)
+                    .forEach((index) => planned.set(index, { strategy: 'post', policy: policy }));
+            }
         }
     } catch (error) {
         console.error('Error during upload initialization:', error);
         alert('An error occurred while initializing the upload. Please try again.');
+        return;
     }
-}
-
-async function fallback_download(url_list) {
-    for (const url of url_list) {
-        await new Promise((resolve) => {
-
-            const a = document.createElement('a');
-            a.href = url.token;
-            a.download = url.path.replace(/\//g, "#"); // Use the path as the filename, replacing slashes with hashes
-            a.style.display = 'none';
-            document.body.appendChild(a);
-            a.click();
-            document.body.removeChild(a);
-            resolve();
-        });
 
-        // Introduce a small delay between downloads to avoid overwhelming the browser
-        await new Promise((resolve) => setTimeout(resolve, 500));
-    }
+    upload_all(iter_upload_plans(bucket_name, file_list, planned, csrfToken), file_array, upload_path, csrfToken);
 }
 
-// Handle download of all files with concurrency
-async function download(url_list) {
-
-    if (!('showDirectoryPicker' in window)) {
-
-        const popup = PopUp.createAndShow('download_compatibility', 'Browser Compatibility',
-            "Your browser lacks modern features! Please use the latest versions of Chrome or Edge.\
-            <br/><br/>While you may continue downloading files with your current browser, \
-            <br/>the folder structure will be flattened, and all files will be downloaded to your browser's \
-            <br/>default download location—typically the 'Downloads' folder.\
-            <br/><br/>In cases where two folders contain files with identical names, \
-            <br/>it may become challenging to distinguish between them.\
-            <br/><br/>For an optimal experience, consider using the latest versions of Chrome or Edge. \
-            <br/>These browsers preserve the original folder hierarchy and allow you to choose your preferred download location.\
-            ");
-
-
-        const okBtn = document.getElementById('download_compatibility_ok');
-        const cancelBtn = document.getElementById('download_compatibility_cancel');
-        okBtn.innerText = "Continue Downloading";
-        cancelBtn.innerText = "Cancel Downloading";
-
-        okBtn.onclick = () => {
-            popup.remove();
-            fallback_download(url_list)
-            .then(() => {
-                const ib = InfoBox.createAndShow('download_info', 'Download Operation',
-                    `Download completed! <br><br> `);
-            })
-            .catch(error => console.error('Error during downloads:', error));
-        };
-
-        cancelBtn.onclick = () => {
-            popup.remove();
-        };
-
+function download_zip(bucket_name, folder_list, file_list) {
+    // Let the browser save the archive streamed by the server; a form post
+    // keeps the selection out of the URL and the download out of memory
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = '/b3/downloadzip/';
+    form.style.display = 'none';
 
-        return;
+    const fields = {
+        csrfmiddlewaretoken: $('[name="csrfmiddlewaretoken"]').val(),
+        bucket: bucket_name,
+        folder_list: JSON.stringify(folder_list),
+        file_list: JSON.stringify(file_list),
+    };
+    for (const [name, value] of Object.entries(fields)) {
+        const input = document.createElement('input');
+        input.type = 'hidden';
+        input.name = name;
+        input.value = value;
+        form.appendChild(input);
     }
 
+    document.body.appendChild(form);
+    form.submit();
+    document.body.removeChild(form);
+}
 
+// Handle download of all files with concurrency
+async function download(entries) {
+    // `entries` is the download manifest, a list or an async iterable (e.g. read_ndjson)
+    // of {path, token, size, etag}; downloads start as soon as the first entries arrive.
+    // Files the server can't read come as {path, error} and are reported at the end
 
     let root_dir_handle;
     try {
@@ -254,24 +507,55 @@ async function download(url_list) {
         return; // Exit the function if the directory selection is aborted or fails
     }
 
-    const MAX_CONCURRENT_DOWNLOADS = 5; // Limit concurrent downloads
-    const downloadQueue = [];
+    const pending = [];
+    const active = new Set();
+    const failed = [];
+
+    const start_downloads = () => {
+        while (active.size < MAX_CONCURRENT_DOWNLOADS && pending.length > 0) {
+            // Largest known file first, so that small files fill in around it
+            let next = 0;
+            pending.forEach((entry, index) => {
+                if ((entry.size ?? 0) > (pending[next].size ?? 0)) next = index;
+            });
+            const [entry] = pending.splice(next, 1);
 
-    for (const url of url_list) {
-        if (downloadQueue.length >= MAX_CONCURRENT_DOWNLOADS) {
-            await Promise.race(downloadQueue); // Wait for one download to complete
+            const downloadPromise = download_single_file(entry, root_dir_handle);
+            active.add(downloadPromise);
+            downloadPromise.finally(() => {
+                active.delete(downloadPromise);
+                start_downloads();
+            });
         }
+    };
 
-        const downloadPromise = download_single_file(url, root_dir_handle);
-        downloadQueue.push(downloadPromise);
+    for await (const entry of entries) {
+        if (entry.error && entry.path) {
+            console.error(`Error downloading ${entry.path}:`, entry.error);
+            failed.push(entry.path);
+            continue;
+        }
+        if (entry.error) {
+            console.error('Error listing the downloads:', entry.error);
+            alert(`Some files can't be downloaded: ${entry.error}`);
+            break;
+        }
+        pending.push(entry);
+        start_downloads();
 
-        downloadPromise.finally(() => {
-            downloadQueue.splice(downloadQueue.indexOf(downloadPromise), 1);
-        });
+        // Stop reading the manifest while enough entries are waiting
+        while (pending.length >= DOWNLOAD_LOOKAHEAD) {
+            await Promise.race(active);
+        }
     }
 
-    await Promise.all(downloadQueue);
+    while (active.size > 0) {
+        await Promise.race(active);
+    }
 
+    if (failed.length > 0) {
+        alert(`These files can't be downloaded: ${failed.join(', ')}`);
+    }
 }
 
 // Download a single file
@@ -285,11 +569,122 @@ async function download_single_file(url, root_dir_handle) {
     }
 
     const fileHandle = await current_handle.getFileHandle(file_name, { create: true });
-    await download_url(url.token, fileHandle, url.path);
+    await download_url(url.token, fileHandle, url.path, url.size, url.etag);
+}
+
+function check_etag(response, etag) {
+    // The ETag header is only visible when the bucket CORS rules expose it
+    const response_etag = response.headers.get('ETag');
+    if (etag && response_etag && response_etag.replaceAll('"', '') !== etag) {
+        throw new Error('The file changed since the download started.');
+    }
+}
+
+// Download one byte range and write it at its offset, resuming from the
+// last written byte when the request fails
+async function download_range_with_retry(url, writable, start, end, etag, on_written, retries = MAX_RETRIES) {
+    let position = start;
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const response = await fetch(url, { headers: { Range: `bytes=${position}-${end}` } });
+            if (response.status !== 206) {
+                throw new Error(`Range request failed: ${response.status} ${response.statusText}`);
+            }
+            check_etag(response, etag);
+
+            const reader = response.body.getReader();
+            const buffer = [];
+            let bufferSize = 0;
+
+            const flush = async () => {
+                if (bufferSize === 0) return;
+                const data = new Blob(buffer);
+                const length = bufferSize;
+                buffer.length = 0;
+                bufferSize = 0;
+                await writable.write({ type: 'write', position: position, data: data });
+                position += length;
+                on_written(length);
+            };
+
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+
+                buffer.push(value);
+                bufferSize += value.length;
+                if (bufferSize >= RANGE_WRITE_BATCH) {
+                    await flush();
+                }
+            }
+            await flush();
+
+            if (position !== end + 1) {
+                throw new Error(`Received ${position - start} of ${end + 1 - start} bytes.`);
+            }
+            return;
+
+        } catch (error) {
+            if (attempt >= retries - 1) throw error;
+            const delay = BASE_DELAY * Math.pow(2, attempt); // Exponential backoff
+            await new Promise(resolve => setTimeout(resolve, delay));
+            console.warn(`Retrying range ${start}-${end} (${attempt + 1}/${retries}):`, error);
+        }
+    }
+}
+
+// Download a large file as byte ranges fetched in parallel, so that it isn't
+// limited to the throughput of a single connection. The size comes from the
+// download manifest, and at most MAX_CONCURRENT_RANGES write batches are held in memory.
+async function download_ranges(url, fileHandle, fileName, size, etag) {
+    let writable;
+    try {
+        writable = await fileHandle.createWritable();
+
+        const progress_bar = create_progress_bar(`Downloading ${fileName} : `, size);
+        let bytesReceived = 0;
+        const on_written = (length) => {
+            bytesReceived += length;
+            progress_bar.value = bytesReceived;
+        };
+
+        let next_start = 0;
+        let failed = false;
+        const next_ranges = async () => {
+            while (next_start < size && !failed) {
+                const start = next_start;
+                const end = Math.min(start + RANGE_SIZE, size) - 1;
+                next_start = end + 1;
+                try {
+                    await download_range_with_retry(url, writable, start, end, etag, on_written);
+                } catch (error) {
+                    failed = true;
+                    throw error;
+                }
+            }
+        };
+
+        const workers = Math.min(MAX_CONCURRENT_RANGES, Math.ceil(size / RANGE_SIZE));
+        await Promise.all(Array.from({ length: workers }, next_ranges));
+
+        await writable.close();
+        progress_bar.parentElement.remove();
+
+    } catch (error) {
+        if (writable) {
+            await writable.abort().catch(() => {});
+        }
+        console.error(`Error downloading ${fileName}:`, error);
+        alert(`Failed to download ${fileName}. Please try again.`);
+    }
 }
 
 // Use fetch and stream data directly to a file
-async function download_url(url, fileHandle, fileName, batchSize = 8 * 1024 * 1024) { // Default batch size: 8 MB
+async function download_url(url, fileHandle, fileName, size = null, etag = null, batchSize = 8 * 1024 * 1024) { // Default batch size: 8 MB
+    if (typeof size === 'number' && size >= RANGE_DOWNLOAD_MIN_SIZE) {
+        return download_ranges(url, fileHandle, fileName, size, etag);
+    }
+
     try {
         const response = await fetch(url);
 
@@ -301,7 +696,13 @@ async function download_url(url, fileHandle, fileName, batchSize = 8 * 1024 * 10
         const writable = await fileHandle.createWritable();
         const reader = response.body.getReader();
 
-        const totalBytes = response.headers.get('Content-Length') ? parseInt(response.headers.get('Content-Length'), 10) : null;
+        if (!response.ok) {
+            throw new Error(`Download failed: ${response.status} ${response.statusText}`);
+        }
+
+        check_etag(response, etag);
+
+        const totalBytes = response.headers.get('Content-Length') ? parseInt(response.headers.get('Content-Length'), 10) : size;
         let bytesReceived = 0;
 
         const progress_bar = create_progress_bar(`Downloading ${fileName} : `, totalBytes);
@@ -337,6 +738,11 @@ async function download_url(url, fileHandle, fileName, batchSize = 8 * 1024 * 10
             await writable.write(new Blob(buffer)); // Write remaining data
         }
 
+        if (typeof size === 'number' && bytesReceived !== size) {
+            await writable.abort();
+            throw new Error(`Received ${bytesReceived} of ${size} bytes.`);
+        }
+
         await writable.close();
         progress_bar.parentElement.remove();
 
@@ -363,7 +769,51 @@ function create_progress_bar(msg, total_bytes){
 
 }
 
-async function uploadSelectedFolder(folder){
+async function sync_upload(files, on_remote_only = null) {
+    // Upload only the files that are new or changed since they were last uploaded:
+    // the server diffs a manifest of the files against the target folder.
+    // on_remote_only receives the paths of the objects missing locally, if given
+    const csrfToken = $('[name="csrfmiddlewaretoken"]').val();
+    const upload_path = document.getElementById('address_value').textContent;
+    const bucket_name = upload_path.split('/')[0];
+    const folder_path = upload_path.substring(bucket_name.length + 1);
+    let plan;
+
+    try {
+        plan = await post_upload_request('/b3/syncupload/', {
+            bucket: bucket_name,
+            prefix: folder_path,
+            manifest: JSON.stringify(files.map((file) => [file.name, file.size, file.lastModified])),
+            delete: on_remote_only !== null,
+        }, csrfToken);
+        if (typeof plan === 'string') {
+            throw new Error(plan);
+        }
+    } catch (error) {
+        console.error('Error comparing the files with the bucket:', error);
+        alert('An error occurred while comparing the files with the bucket. Please try again.');
+        return;
+    }
+
+    console.info(`Sync: ${plan.upload.length} files to upload, ${plan.unchanged} unchanged`);
+    if (plan.upload.length > 0) {
+        upload(plan.upload.map((index) => files[index]));
+    }
+    if (on_remote_only && plan.delete.length > 0) {
+        on_remote_only(plan.delete, upload_path);
+    }
+}
+
+function upload_files(files, options) {
+    // Folder uploads, in sync mode when asked for
+    if (options && options.sync) {
+        sync_upload(files, options.on_remote_only || null);
+    } else {
+        upload(files);
+    }
+}
+
+async function uploadSelectedFolder(folder, options = {}){
     let file_list = [];
 
     for (let i = 0; i < folder.length; i++){
@@ -376,12 +826,12 @@ async function uploadSelectedFolder(folder){
         file_list.push(file);
     }
     
-    upload(file_list);
+    upload_files(file_list, options);
             
   
 }
 
-async function uploadDroppedItems(drop_items){
+async function uploadDroppedItems(drop_items, options = {}){
 
     let file_list = [];
     let wk_entry_list = [];
@@ -403,7 +853,7 @@ async function uploadDroppedItems(drop_items){
         }
     }
 
-    upload(file_list);
+    upload_files(file_list, options);
     
 
 }
@@ -444,8 +894,11 @@ async function readEntriesPromise(dirReader){
 }
 
 export  {
+    create_progress_bar,
     uploadDroppedItems,
     download,
+    download_zip,
+    read_ndjson,
     upload,
     uploadSelectedFolder
 };
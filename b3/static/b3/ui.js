@@ -1,5 +1,5 @@
 
-import { upload, download, uploadDroppedItems, uploadSelectedFolder } from './transfer.js';
+import { create_progress_bar, upload, download, download_zip, read_ndjson, uploadDroppedItems, uploadSelectedFolder } from './transfer.js';
 // import { download } from './transfer.js'; 
 // import { uploadDroppedItems } from './transfer.js';
 
@@ -79,27 +79,35 @@ document.addEventListener('DOMContentLoaded', () => {
     const folderUpload = document.querySelector('#folderUpload');
     folderUpload.addEventListener('change', (event)=>{
         console.log(event.target.files);
-        uploadSelectedFolder(event.target.files);
+        uploadSelectedFolder(event.target.files, getSyncOptions());
     });
 
     dragElement( document.getElementById("separator"), "H");
     resizePanels();
 
+    resumeJobs();
+
 });
 
+// Folder levels loaded per expand: the deeper levels come nested and collapsed,
+// so expanding them needs no request (the server prefetches the level below them)
+const TREE_EXPAND_DEPTH = 2;
+
 window.onCaret = async function (obj, bucket_name, dir_path){
     // Toggle the caret icon and expand/collapse the directory
     obj.classList.toggle("caret-right");
     obj.classList.toggle("caret-down");
     var qData = {
         'bucket_name':bucket_name,
-        'dir_path': dir_path
+        'prefixes': [dir_path],
+        'depth': TREE_EXPAND_DEPTH
     };
     var csrfToken = $('[name="csrfmiddlewaretoken"]').val();
     var ele_id = bucket_name + '_' + dir_path;
+    var children = obj.parentElement.querySelector(':scope > ul.dir_children');
 
 
-    if (document.getElementById(ele_id).nextSibling == null){
+    if (children == null){
 
         try {
             const response = await fetch('/b3/expanddir/', {
@@ -113,7 +121,7 @@ window.onCaret = async function (obj, bucket_name, dir_path){
 
             if (response.ok) {
                 const data = await response.json();
-                document.getElementById(ele_id).insertAdjacentHTML("afterend", data.result);
+                document.getElementById(ele_id).insertAdjacentHTML("afterend", data.result[dir_path]);
             } else {
                 console.error('Error expanding directory:', response.statusText);
                 alert('Error expanding directory.');
@@ -124,53 +132,328 @@ window.onCaret = async function (obj, bucket_name, dir_path){
         }
 
     } else {
-        document.getElementById(ele_id).nextSibling.classList.toggle("li_close");
+        children.classList.toggle("li_close");
     }
 }
 
 
 
-window.onFolder = async function (bucket_name, dir_path){
-    // Fetch and display the contents of the selected folder
-    
-    const timeZone = Intl.DateTimeFormat().resolvedOptions().timeZone;
+// Listing of the folder shown in the right panel. Rows are kept as plain
+// objects and only the rows in view are rendered (virtualized table)
+const ROW_HEIGHT = 28; // Must match the height of '#file_table tbody tr' in style.css
+const OVERSCAN_ROWS = 20; // Rows rendered above and below the visible area
+
+let listing_state = { bucket_name: null, dir_path: null, cursor: null, search: null, loading: false, rows: [], selected: new Set() };
+
+const size_units = ['B', 'KB', 'MB', 'GB', 'TB'];
+function formatFileSize(file_size){
+    let size_index = 0;
+    while (file_size >= 1024 && size_index < 4){
+        size_index += 1;
+        file_size = file_size / 1024;
+    }
+    return `${file_size.toFixed(2)} ${size_units[size_index]}`;
+}
+
+// 'sv-SE' formats dates as YYYY-MM-DD HH:MM:SS in the browser's timezone
+const date_formatter = new Intl.DateTimeFormat('sv-SE', {
+    year: 'numeric', month: '2-digit', day: '2-digit',
+    hour: '2-digit', minute: '2-digit', second: '2-digit', hour12: false,
+});
+
+function escapeHtml(text){
+    return text.replace(/[&<>"']/g, (c) => `&#${c.charCodeAt(0)};`);
+}
+
+function appendListingRows(state, contents){
+    for (let i = 0; i < contents.folders.length; i++){
+        // Recursive folder sizes are only known for buckets with an inventory
+        state.rows.push({
+            type: 'folder',
+            name: contents.folders[i],
+            path: `${state.bucket_name}/${contents.prefix}${contents.folders[i]}/`,
+            size: contents.folder_sizes[i],
+            count: contents.folder_counts[i],
+        });
+    }
+    for (let i = 0; i < contents.names.length; i++){
+        state.rows.push({
+            type: 'file',
+            name: contents.names[i],
+            path: `${state.bucket_name}/${contents.prefix}${contents.names[i]}`,
+            size: contents.sizes[i],
+            mtime: contents.mtimes[i],
+        });
+    }
+    state.cursor = contents.cursor;
+}
+
+function appendSearchRows(state, results){
+    // Search results are files anywhere below the searched folder,
+    // named by their path relative to it
+    for (let i = 0; i < results.keys.length; i++){
+        const key = results.keys[i];
+        state.rows.push({
+            type: 'file',
+            name: key.substring(state.dir_path.length),
+            path: `${state.bucket_name}/${key}`,
+            folder: key.substring(0, key.lastIndexOf('/') + 1),
+            size: results.sizes[i],
+            mtime: results.mtimes[i],
+        });
+    }
+    state.search.cursor = results.cursor;
+    state.search.has_more = results.cursor !== null;
+}
 
+function renderRow(row, index){
+    if (row.type === 'parent'){
+        return `<tr><td><span class="folder_list" data-row="${index}">..</span></td><td></td><td></td></tr>`;
+    }
+
+    const checked = listing_state.selected.has(row.path) ? 'checked' : '';
+    const path = escapeHtml(row.path);
+    const name = escapeHtml(row.name);
+
+    if (row.type === 'folder'){
+        return `<tr><td class="td_folder" id="${path}"><input type="checkbox" data-row="${index}" ${checked}/>`
+            + `<span class="folder_list" data-row="${index}">${name}</span></td>`
+            + (row.size == null ? '<td></td>' : `<td title="${row.count} objects">${formatFileSize(row.size)}</td>`)
+            + '<td></td></tr>';
+    }
+
+    return `<tr><td class="td_file" id="${path}"><input type="checkbox" data-row="${index}" ${checked}/>`
+        + (row.folder === undefined ? `<span class="file_list">${name}</span></td>`
+            : `<span class="file_list search_result" data-row="${index}" title="Open containing folder">${name}</span></td>`)
+        + `<td>${formatFileSize(row.size)}</td>`
+        + `<td>${date_formatter.format(new Date(row.mtime * 1000))}</td></tr>`;
+}
+
+function renderListing(){
+    // Render only the rows in view, with spacer rows standing in for the others
+    const frame = document.getElementById('right_frame');
+    const table = document.getElementById('file_table');
+    if (!table) return;
+
+    const rows = listing_state.rows;
+    const header_height = table.tHead.offsetHeight;
+    const first = Math.max(0, Math.floor((frame.scrollTop - header_height) / ROW_HEIGHT) - OVERSCAN_ROWS);
+    const last = Math.min(rows.length, Math.ceil((frame.scrollTop + frame.clientHeight) / ROW_HEIGHT) + OVERSCAN_ROWS);
+
+    let html = `<tr class="spacer_row"><td colspan="3" style="height:${first * ROW_HEIGHT}px"></td></tr>`;
+    for (let i = first; i < last; i++){
+        html += renderRow(rows[i], i);
+    }
+    html += `<tr class="spacer_row"><td colspan="3" style="height:${(rows.length - last) * ROW_HEIGHT}px"></td></tr>`;
+
+    table.tBodies[0].innerHTML = html;
+}
+
+async function fetchListingPage(bucket_name, dir_path, cursor){
     var qData = {
         'bucket_name':bucket_name,
         'dir_path': dir_path,
-        'timezone': timeZone,
+        'cursor': cursor,
     };
     var csrfToken = $('[name="csrfmiddlewaretoken"]').val();
 
+    const response = await fetch('/b3/listdir/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrfToken,
+        },
+        body: JSON.stringify(qData),
+    });
+
+    if (!response.ok) {
+        throw new Error(`Error fetching folder contents: ${response.statusText}`);
+    }
+    return await response.json();
+}
+
+async function fetchSearchPage(state, cursor){
+    var qData = Object.assign({ 'bucket_name': state.bucket_name, 'dir_path': state.dir_path, 'cursor': cursor }, state.search.query);
+    var csrfToken = $('[name="csrfmiddlewaretoken"]').val();
+
+    const response = await fetch('/b3/search/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': csrfToken,
+        },
+        body: JSON.stringify(qData),
+    });
+
+    if (!response.ok) {
+        throw new Error(`Error searching: ${response.statusText}`);
+    }
+    const data = await response.json();
+    if (typeof data.result === 'string') {
+        throw new Error(data.result);
+    }
+    return data;
+}
+
+window.onSearch = async function (){
+    // Search below the folder shown in the right panel, results are paged in as the user scrolls down
+    const address = document.getElementById('address_value').textContent;
+    if (!listing_state.bucket_name || !address) {
+        alert('Open a bucket or folder to search in first.');
+        return;
+    }
+    const size_mb = (id) => {
+        const value = document.getElementById(id).value;
+        return value === '' ? null : Math.round(parseFloat(value) * 1024 * 1024);
+    };
+    const query = {
+        query: document.getElementById('search_query').value,
+        mode: document.getElementById('search_mode').value,
+        min_size: size_mb('search_min_size'),
+        max_size: size_mb('search_max_size'),
+        modified_after: document.getElementById('search_after').value,
+        modified_before: document.getElementById('search_before').value,
+    };
+
+    const bucket_name = listing_state.bucket_name;
+    const dir_path = listing_state.search ? listing_state.dir_path : address.substring(bucket_name.length + 1);
+    listing_state = { bucket_name: bucket_name, dir_path: dir_path, cursor: null, loading: true, rows: [],
+                      selected: new Set(), search: { query: query, cursor: null, has_more: false } };
+    const state = listing_state;
+    document.getElementById('address_value').innerHTML = escapeHtml(`${bucket_name}/${dir_path} (search: ${query.query})`);
+    state.rows.push({ type: 'parent', name: '..', path: `${bucket_name}/${dir_path}`, prefix: dir_path });
+
+    try {
+        const data = await fetchSearchPage(state, null);
+        if (state !== listing_state) return;
+
+        appendSearchRows(state, data.result);
+
+        const frame = document.getElementById('right_frame');
+        frame.innerHTML = `<table id="file_table"><thead><tr><th>Name</th><th>Size</th><th>LastModified</th></tr></thead>`
+            + `<tbody></tbody></table>`;
+        frame.scrollTop = 0;
+        renderListing();
+    } catch (error) {
+        console.error('Error:', error);
+        alert(`An error occurred while searching: ${error.message}`);
+    } finally {
+        state.loading = false;
+    }
+
+    loadMoreRows();
+}
+
+window.onFolder = async function (bucket_name, dir_path){
+    // Fetch and display the first page of the selected folder,
+    // the remaining pages are loaded as the user scrolls down
+    
     document.getElementById('address_value').innerHTML= bucket_name + '/' + dir_path;
+    listing_state = { bucket_name: bucket_name, dir_path: dir_path, cursor: null, search: null, loading: true, rows: [], selected: new Set() };
+    const state = listing_state;
+
+    if (dir_path !== ''){
+        let prev_folder = dir_path.split('/').slice(0, -2).join('/');
+        prev_folder = prev_folder === '' ? '' : prev_folder + '/';
+        state.rows.push({ type: 'parent', name: '..', path: `${bucket_name}/${prev_folder}`, prefix: prev_folder });
+    }
 
     try {
-        const response = await fetch('/b3/listdir/', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrfToken,
-            },
-            body: JSON.stringify(qData),
-        });
+        const data = await fetchListingPage(bucket_name, dir_path, null);
+        if (state !== listing_state) return; // Another folder was opened meanwhile
 
-        if (response.ok) {
-            const data = await response.json();
-            document.getElementById('right_frame').innerHTML = "";
-            document.getElementById('right_frame').insertAdjacentHTML("afterbegin", data.result);
-        } else {
-            console.error('Error fetching folder contents:', response.statusText);
-            alert('Error fetching folder contents.');
-        }
+        appendListingRows(state, data.result);
+
+        const frame = document.getElementById('right_frame');
+        frame.innerHTML = `<table id="file_table"><thead><tr><th>Name</th><th>Size</th><th>LastModified</th></tr></thead>`
+            + `<tbody></tbody></table>`;
+        frame.scrollTop = 0;
+        renderListing();
     } catch (error) {
         console.error('Error:', error);
         console.log("bucket_name: ", bucket_name, " dir_path: ", dir_path);
         alert('An error occurred while fetching folder contents.');
+    } finally {
+        state.loading = false;
+    }
+
+    loadMoreRows();
+}
+
+async function loadMoreRows(){
+    // Fetch the next listing page when the end of the loaded rows is in view
+    const state = listing_state;
+    const frame = document.getElementById('right_frame');
+
+    const has_more = state.search ? state.search.has_more : state.cursor;
+    if (!has_more || state.loading || !document.getElementById('file_table')) return;
+    if (frame.scrollTop + frame.clientHeight < frame.scrollHeight - frame.clientHeight) return;
+
+    state.loading = true;
+    try {
+        if (state.search) {
+            const data = await fetchSearchPage(state, state.search.cursor);
+            if (state !== listing_state) return;
+            appendSearchRows(state, data.result);
+        } else {
+            const data = await fetchListingPage(state.bucket_name, state.dir_path, state.cursor);
+            if (state !== listing_state) return;
+            appendListingRows(state, data.result);
+        }
+        renderListing();
+    } catch (error) {
+        console.error('Error:', error);
+        state.cursor = null;
+        if (state.search) state.search.has_more = false;
+    } finally {
+        state.loading = false;
     }
 
+    // Keep filling while the panel is not scrollable yet
+    loadMoreRows();
+}
 
+function getSelectedItems(){
+    // Selection is kept in the listing state, rows out of view are not in the DOM
+    const selected = listing_state.rows.filter(row => listing_state.selected.has(row.path));
+    return {
+        folder_list: selected.filter(row => row.type === 'folder').map(row => row.path),
+        file_list: selected.filter(row => row.type === 'file').map(row => row.path),
+        file_sizes: selected.filter(row => row.type === 'file').map(row => row.size),
+    };
 }
 
+let render_pending = false;
+document.getElementById('right_frame').addEventListener('scroll', () => {
+    if (!render_pending){
+        render_pending = true;
+        requestAnimationFrame(() => {
+            render_pending = false;
+            renderListing();
+        });
+    }
+    loadMoreRows();
+});
+
+document.getElementById('right_frame').addEventListener('click', (event) => {
+    const index = event.target.dataset.row;
+    if (index === undefined) return;
+    const row = listing_state.rows[index];
+
+    if (event.target.tagName === 'INPUT'){
+        if (event.target.checked){
+            listing_state.selected.add(row.path);
+        } else {
+            listing_state.selected.delete(row.path);
+        }
+    } else if (row.type === 'folder'){
+        window.onFolder(listing_state.bucket_name, row.path.substring(listing_state.bucket_name.length + 1));
+    } else if (row.type === 'parent'){
+        window.onFolder(listing_state.bucket_name, row.prefix);
+    } else if (row.folder !== undefined){
+        window.onFolder(listing_state.bucket_name, row.folder);
+    }
+});
 
 
 window.onUpload = function (){
@@ -192,6 +475,17 @@ window.onclick = function(event) {
     }
 }
 
+function getSyncOptions(){
+    // Sync mode of the folder uploads, set in the upload dialog
+    const sync = document.getElementById('upload_sync').checked;
+    const with_delete = sync && document.getElementById('upload_sync_delete').checked;
+    return {
+        sync: sync,
+        // Objects missing locally are only deleted once the user confirms
+        on_remote_only: with_delete ? (paths, upload_path) => confirmDelete([], paths, upload_path) : null,
+    };
+}
+
 window.onFilesUpload = function (){
     document.getElementById("upload_options").style.display = "none";
     filesUpload.click();
@@ -202,64 +496,105 @@ window.onFolderUpload = function (){
     folderUpload.click();
 }
 
-async function initiateDelete(delete_list, delete_path){
-    const csrfToken = $('[name="csrfmiddlewaretoken"]').val();
-    const bucket_name = delete_path.split('/')[0];
+// Large deletes run as background jobs on the server, the browser polls their progress
+const JOB_POLL_INTERVAL = 1000; // ms
 
-    const qData = {
-        bucket: bucket_name,
-        delete_list: JSON.stringify(delete_list),
-        operation: 'initiate',
+async function watchJob(job, label){
+    // Show the progress of a job until it finishes, with a button to cancel it
+    const csrfToken = $('[name="csrfmiddlewaretoken"]').val();
+    const progress_bar = create_progress_bar(label, job.total);
+    const cancelBtn = document.createElement('button');
+    cancelBtn.innerText = 'Cancel';
+    cancelBtn.onclick = async () => {
+        cancelBtn.disabled = true;
+        await fetch(`/b3/jobs/${job.id}/cancel/`, {method: 'POST', headers: {'X-CSRFToken': csrfToken}});
     };
+    progress_bar.parentElement.appendChild(cancelBtn);
+
+    while (job.status === 'queued' || job.status === 'running'){
+        // Unknown totals show an indeterminate progress bar
+        progress_bar.previousSibling.textContent = `${label} ${job.processed} objects `;
+        if (job.total) {
+            progress_bar.max = job.total;
+            progress_bar.value = job.processed;
+        } else {
+            progress_bar.removeAttribute('value');
+        }
 
-    try {
-        const response = await fetch('/b3/delete/', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrfToken,
-            },
-            body: JSON.stringify(qData),
-        });
+        await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+        try {
+            const response = await fetch(`/b3/jobs/${job.id}/`);
+            if (response.ok) {
+                job = (await response.json()).result;
+            }
+        } catch (error) {
+            console.error('Error polling job:', error);
+        }
+    }
 
-        if (response.ok) {
-            const data = await response.json();
-            
-            if (delete_path === document.getElementById('address_value').textContent) {
-                const path_parts = delete_path.split('/');
-                const bucket_name = path_parts.shift();
-                const folder_path = path_parts.length > 0 ? path_parts.join('/') : '';
-                window.onFolder(bucket_name, folder_path); // Refresh folder view
+    progress_bar.parentElement.remove();
+    return job;
+}
 
-                const ib = InfoBox.createAndShow('delete_info', 'Delete Operation',
-                    `Delete operation completed successfully. <br><br> `);
+function showDeleteResult(job){
+    if (job.status === 'failed') {
+        alert(`Error performing delete operation: ${job.error}`);
+        return;
+    }
 
+    const result = job.result;
+    const errors = result.errors || [];
+    const status = job.status === 'cancelled' ? 'Delete operation cancelled' : 'Delete operation completed';
+
+    if (errors.length > 0) {
+        console.error('Failed to delete:', errors);
+        const tb_list = errors.slice(0, 100).map((item) => {
+            return `<tr><td>${item.path}</td><td>${item.code}</td></tr>`;
+        }).join('');
+
+        InfoBox.createAndShow('delete_info', 'Delete Operation',
+            `${status}. Deleted ${result.deleted} objects, ${result.error_count} could not be deleted: <br><br>
+            <div style="text-align: left; overflow: auto; max-height: 200px; padding: 10px; border: 1px solid #ccc;">
+                <table>${tb_list}</table>
+            </div>`);
+    } else {
+        InfoBox.createAndShow('delete_info', 'Delete Operation',
+            `${status} (${result.deleted || 0} objects). <br><br> `);
+    }
+}
+
+async function resumeJobs(){
+    // Follow the jobs still running from an earlier visit
+    try {
+        const response = await fetch('/b3/jobs/');
+        if (!response.ok) {
+            return;
+        }
+        const data = await response.json();
+        for (const job of data.result) {
+            if (job.kind === 'delete' && (job.status === 'queued' || job.status === 'running')) {
+                watchJob(job, `Deleting in ${job.bucket}: `).then(showDeleteResult);
             }
-            
-        } else {
-            alert('Error performing delete operation.');
         }
     } catch (error) {
-        console.error('Error:', error);
-        alert('An error occurred while initializing the delete operation.');
-    }  
-
-
+        console.error('Error listing jobs:', error);
+    }
 }
 
-async function prepareDelete(folder_list, file_list, delete_path){
+async function initiateDelete(folder_list, file_list, delete_path){
     const csrfToken = $('[name="csrfmiddlewaretoken"]').val();
     const bucket_name = delete_path.split('/')[0];
 
+    // Folders are expanded and deleted in batches by a background job
     const qData = {
+        kind: 'delete',
         bucket: bucket_name,
         folder_list: JSON.stringify(folder_list),
         file_list: JSON.stringify(file_list),
-        operation: 'prepare',
     };
 
     try {
-        const response = await fetch('/b3/delete/', {
+        const response = await fetch('/b3/jobs/', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -268,62 +603,62 @@ async function prepareDelete(folder_list, file_list, delete_path){
             body: JSON.stringify(qData),
         });
 
-        if (response.ok) {
-            const data = await response.json();
-
-            var tb_list = data.result.map((item) => {
-                return `<tr><td>${item}</td></tr>`;
-            }).join('');
-
-            // Create a confirmation popup
-            const popup = PopUp.createAndShow('delete_confirmation', 'Delete Confirmation', 
-                `<b>Are you sure you want to delete the following items?</b> <br/><br/>`); 
-            let dl = popup.modal.getElementsByClassName('popup-body')[0];
-            dl.innerHTML += `
-                <div style="text-align: left; overflow: auto; max-height: 200px; padding: 10px; border: 1px solid #ccc;">
-                    <table>${tb_list}</table>
-                </div>`;
-
-            const okBtn = document.getElementById('delete_confirmation_ok');
-            okBtn.innerText = "Delete";
-
-            okBtn.onclick = () => {
-                popup.remove(); 
-                initiateDelete(data.result, delete_path); // Proceed with deletion
+        const data = response.ok ? await response.json() : null;
+        if (!data || typeof data.result === 'string') {
+            alert('Error performing delete operation.');
+            return;
+        }
 
-            };
+        const job = await watchJob(data.result, `Deleting in ${delete_path}: `);
 
-            
-        } else {
-            alert('Servor error occurred while preparing for delete.');
+        if (delete_path === document.getElementById('address_value').textContent) {
+            const path_parts = delete_path.split('/');
+            const bucket_name = path_parts.shift();
+            const folder_path = path_parts.length > 0 ? path_parts.join('/') : '';
+            window.onFolder(bucket_name, folder_path); // Refresh folder view
         }
+        showDeleteResult(job);
     } catch (error) {
         console.error('Error:', error);
         alert('An error occurred while initializing the delete operation.');
-    }  
+    }
+}
+
+function confirmDelete(folder_list, file_list, delete_path){
 
+    var tb_list = folder_list.map((item) => {
+        return `<tr><td>${item}* (folder and all its contents)</td></tr>`;
+    }).concat(file_list.map((item) => {
+        return `<tr><td>${item}</td></tr>`;
+    })).join('');
 
+    // Create a confirmation popup
+    const popup = PopUp.createAndShow('delete_confirmation', 'Delete Confirmation', 
+        `<b>Are you sure you want to delete the following items?</b> <br/><br/>`); 
+    let dl = popup.modal.getElementsByClassName('popup-body')[0];
+    dl.innerHTML += `
+        <div style="text-align: left; overflow: auto; max-height: 200px; padding: 10px; border: 1px solid #ccc;">
+            <table>${tb_list}</table>
+        </div>`;
+
+    const okBtn = document.getElementById('delete_confirmation_ok');
+    okBtn.innerText = "Delete";
+
+    okBtn.onclick = () => {
+        popup.remove(); 
+        initiateDelete(folder_list, file_list, delete_path); // Proceed with deletion
+
+    };
 
 }
 
 window.onDelete = async function (){
     // Trigger delete process
     const csrfToken = $('[name="csrfmiddlewaretoken"]').val();
-    const ta = document.getElementById('file_table');
     const current_path = document.getElementById('address_value').textContent;
-    
-    if(!ta){
-        alert("No files or folders selected to delete. Use checkboxes to select.")
-        return;
-    }
-    // Gather selected folders and files
-    const folder_list = Array.from(ta.getElementsByClassName('td_folder'))
-        .filter(td_folder => $(td_folder.getElementsByTagName('input')[0]).is(':checked'))
-        .map(td_folder => td_folder.id);
 
-    const file_list = Array.from(ta.getElementsByClassName('td_file'))
-        .filter(td_file => $(td_file.getElementsByTagName('input')[0]).is(':checked'))
-        .map(td_file => td_file.id);
+    // Gather selected folders and files
+    const { folder_list, file_list } = getSelectedItems();
 
     
     if (folder_list.length === 0 && file_list.length === 0){
@@ -331,36 +666,36 @@ window.onDelete = async function (){
         return;
     }
 
-    await prepareDelete(folder_list, file_list, current_path);
+    confirmDelete(folder_list, file_list, current_path);
 
 }
 
 // Trigger download process
 window.onDownload = async function () {
     const csrfToken = $('[name="csrfmiddlewaretoken"]').val();
-    const ta = document.getElementById('file_table');
+    // Gather selected folders and files
+    const { folder_list, file_list, file_sizes } = getSelectedItems();
 
-    if(!ta){
+    if (folder_list.length === 0 && file_list.length === 0){
         alert("No files or folders selected to download. Use checkboxes to select.");
         return;
     }
 
-    // Gather selected folders and files
-    const folder_list = Array.from(ta.getElementsByClassName('td_folder'))
-        .filter(td_folder => $(td_folder.getElementsByTagName('input')[0]).is(':checked'))
-        .map(td_folder => td_folder.id);
-
-    const file_list = Array.from(ta.getElementsByClassName('td_file'))
-        .filter(td_file => $(td_file.getElementsByTagName('input')[0]).is(':checked'))
-        .map(td_file => td_file.id);
-
     const current_path = document.getElementById('address_value').textContent;
     const bucket_name = current_path.split('/')[0];
 
+    // Without the File System Access API the folder structure can't be
+    // recreated on disk, so the selection is downloaded as one ZIP archive
+    if (!('showDirectoryPicker' in window)) {
+        download_zip(bucket_name, folder_list, file_list);
+        return;
+    }
+
     const qData = {
         bucket: bucket_name,
         folder_list: JSON.stringify(folder_list),
         file_list: JSON.stringify(file_list),
+        file_sizes: JSON.stringify(file_sizes),
         method: 'get_object',
     };
 
@@ -375,8 +710,8 @@ window.onDownload = async function () {
         });
 
         if (response.ok) {
-            const data = await response.json();
-            await download(data.result);
+            // The manifest is streamed while the folders are walked
+            await download(read_ndjson(response));
         } else {
             alert('Error initializing downloads.');
         }
@@ -480,7 +815,7 @@ document.addEventListener("drop", (ev) => {
 
     if (tgt_loc){
         console.log(ev.dataTransfer.items);
-        uploadDroppedItems(ev.dataTransfer.items);
+        uploadDroppedItems(ev.dataTransfer.items, getSyncOptions());
     }
 
 });
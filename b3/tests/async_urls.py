@@ -0,0 +1,14 @@
+"""
+The project URLs with the S3-bound views routed to async_views, as b3/urls.py
+does when B3_ASYNC_VIEWS is set.
+"""
+from django.urls import include, path
+
+from .. import async_views, urls
+
+urlpatterns = [
+    path('b3/', include(([
+        path(str(pattern.pattern), getattr(async_views, pattern.callback.__name__, pattern.callback), name=pattern.name)
+        for pattern in urls.urlpatterns
+    ], urls.app_name))),
+]
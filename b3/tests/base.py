@@ -0,0 +1,52 @@
+import json
+
+import boto3
+from django.contrib.auth.models import User
+from moto import mock_aws
+
+from ..cache import listing_cache, url_cache
+from ..models import Bucket
+from ..s3 import client_registry
+from ..services import get_s3_handle
+
+
+BUCKET = 'bkt1'
+REGION = 'us-west-1'
+
+
+class S3TestMixin:
+    """
+    Runs every test against a moto S3 bucket registered as BUCKET.
+    """
+
+    def setUp(self):
+        super().setUp()
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+
+        # Clients, listings and URLs of other tests belong to their own moto backend
+        client_registry.invalidate(BUCKET)
+        listing_cache.clear()
+        url_cache.clear()
+        self.addCleanup(listing_cache.clear)
+
+        self.client_s3 = boto3.client('s3', region_name=REGION)
+        self.client_s3.create_bucket(Bucket=BUCKET, CreateBucketConfiguration={'LocationConstraint': REGION})
+        self.bucket = Bucket.objects.create(name=BUCKET, key_id='key', secret_key='secret',
+                                            service='aws', region=REGION)
+        self.s3 = get_s3_handle(BUCKET)
+
+    def put(self, *keys, body=b'x'):
+        for key in keys:
+            self.client_s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+
+    def login(self, username='user', **kwargs):
+        user = User.objects.create_user(username, **kwargs)
+        self.client.force_login(user)
+        return user
+
+    def post_json(self, url, data):
+        response = self.client.post(url, json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response
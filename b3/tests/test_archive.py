@@ -0,0 +1,53 @@
+import io
+import json
+import zipfile
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from ..archive import iter_zip
+from .base import BUCKET, S3TestMixin
+
+
+@override_settings(B3_ZIP_DOWNLOAD={'CHUNK_SIZE': 4, 'MAX_WORKERS': 2, 'PREFETCH_CHUNKS': 3})
+class ArchiveTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('docs/', 'docs/empty')
+        self.put('docs/a.txt', body=b'hello world')
+        self.put('docs/sub/b.txt', body=b'0123456789' * 5)
+        self.put('top.txt', body=b'top')
+
+    def read_zip(self, chunks):
+        return zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+    def test_folders_and_files(self):
+        archive = self.read_zip(iter_zip(self.s3, [f'{BUCKET}/docs'], [f'{BUCKET}/top.txt']))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ['docs/a.txt', 'docs/empty', 'docs/sub/b.txt', 'top.txt'])
+        self.assertEqual(archive.read('docs/sub/b.txt'), b'0123456789' * 5)
+        self.assertEqual(archive.read('docs/empty'), b'x')
+
+    def test_streamed_in_chunks(self):
+        chunks = list(iter_zip(self.s3, [f'{BUCKET}/docs/sub/'], []))
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual(self.read_zip(chunks).read('sub/b.txt'), b'0123456789' * 5)
+
+    def test_zip64_entries(self):
+        # Entries past the ZIP64 limit get ZIP64 records, readable by any unzip
+        with mock.patch('zipfile.ZIP64_LIMIT', 20):
+            chunks = list(iter_zip(self.s3, [f'{BUCKET}/docs/sub'], [f'{BUCKET}/top.txt']))
+        archive = self.read_zip(chunks)
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.read('sub/b.txt'), b'0123456789' * 5)
+        self.assertEqual(archive.getinfo('sub/b.txt').extract_version, zipfile.ZIP64_VERSION)
+
+    def test_download_zip_view(self):
+        self.login()
+        response = self.client.post('/b3/downloadzip/', {'bucket': BUCKET, 'folder_list': json.dumps([f'{BUCKET}/docs']),
+                                                         'file_list': json.dumps(['other/x'])})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="docs.zip"')
+        archive = self.read_zip(response.streaming_content)
+        self.assertEqual(archive.namelist(), ['docs/a.txt', 'docs/empty', 'docs/sub/b.txt'])
@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+
+from django.test import TestCase, override_settings
+
+from ..models import UploadSession
+from .base import BUCKET, S3TestMixin
+
+
+@override_settings(ROOT_URLCONF='b3.tests.async_urls')
+class AsyncViewTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('a/', 'a/1', 'a/2', 'a/b/3')
+        self.user = self.login()
+        self.async_client.force_login(self.user)
+
+    async def post(self, url, data):
+        response = await self.async_client.post(url, json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    async def read_lines(self, response):
+        self.assertTrue(response.streaming)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        return [json.loads(line) for line in body.decode().splitlines()]
+
+    def test_routed_to_async_views(self):
+        response = self.client.get('/b3/obj/bkt1/a/1')
+        self.assertEqual(response.resolver_match.func.__name__, 'get_object')
+        self.assertTrue(asyncio.iscoroutinefunction(response.resolver_match.func))
+
+    async def test_list_dir_matches_sync_view(self):
+        data = {'bucket_name': BUCKET, 'dir_path': 'a/'}
+        response = await self.post('/b3/listdir/', data)
+        with override_settings(ROOT_URLCONF='main.urls'):
+            expected = await sync_to_async(self.client.post)('/b3/listdir/', json.dumps(data),
+                                                             content_type='application/json')
+        self.assertEqual(json.loads(response.content), json.loads(expected.content))
+        self.assertEqual(json.loads(response.content)['result']['names'], ['1', '2'])
+
+    async def test_download_streams_manifest(self):
+        response = await self.post('/b3/download/', {'bucket': BUCKET, 'folder_list': json.dumps([f'{BUCKET}/a/b']),
+                                                     'file_list': json.dumps([f'{BUCKET}/a/1', f'{BUCKET}/gone']),
+                                                     'method': 'get_object'})
+        entries = await self.read_lines(response)
+        self.assertEqual(sorted(entry['path'] for entry in entries), ['1', 'b/3', 'gone'])
+        self.assertIn('error', next(entry for entry in entries if entry['path'] == 'gone'))
+
+    async def test_start_upload_streams_plans(self):
+        file_list = [[f'{BUCKET}/u/1', 10, 'f1'], [f'{BUCKET}/u/2', 200 * 1024 * 1024, 'f2']]
+        response = await self.post('/b3/startupload/', {'bucket': BUCKET, 'part_window': 2,
+                                                        'file_list': json.dumps(file_list)})
+        plans = sorted(await self.read_lines(response), key=lambda plan: plan['index'])
+        self.assertEqual([plan['strategy'] for plan in plans], ['single', 'multipart'])
+        self.assertEqual(len(plans[1]['token']), 2)
+        session = await UploadSession.objects.aget()
+        self.assertEqual((session.key, session.upload_id), ('u/2', plans[1]['upload_id']))
+
+    async def test_upload_parts_validated(self):
+        response = await self.post('/b3/uploadparts/', {'bucket': BUCKET, 'object_path': 'big', 'upload_id': 'u1',
+                                                        'first_part': 0, 'count': 2})
+        self.assertEqual(json.loads(response.content)['result'], 'error first_part and count must be positive')
+
+    async def test_delete(self):
+        response = await self.post('/b3/delete/', {'operation': 'initiate', 'bucket': BUCKET,
+                                                   'folder_list': json.dumps([f'{BUCKET}/a'])})
+        self.assertEqual(json.loads(response.content)['result'], {'deleted': 4, 'errors': []})
+        response = await self.post('/b3/listdir/', {'bucket_name': BUCKET, 'dir_path': ''})
+        self.assertEqual(json.loads(response.content)['result']['folders'], [])
+
+    async def test_login_required(self):
+        await self.async_client.alogout()
+        response = await self.async_client.post('/b3/listdir/', '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 302)
@@ -0,0 +1,81 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from ..cache import LISTING_CACHE_DEFAULTS, VERSION_TTL_FACTOR, ListingCache, LocalStore, get_parent_prefixes
+from .base import BUCKET, S3TestMixin
+
+
+class LocalStoreTests(TestCase):
+
+    def test_lru_eviction(self):
+        store = LocalStore(max_entries=2)
+        store.set('a', 1)
+        store.set('b', 2)
+        store.get('a')
+        store.set('c', 3)
+        self.assertEqual((store.get('a'), store.get('b'), store.get('c')), (1, None, 3))
+        self.assertEqual(store.evictions, 1)
+
+    def test_expiry(self):
+        store = LocalStore(max_entries=10)
+        with mock.patch('b3.cache.time.monotonic', return_value=100):
+            store.set('a', 1, timeout=10)
+            self.assertFalse(store.add('a', 2))
+        with mock.patch('b3.cache.time.monotonic', return_value=111):
+            self.assertIsNone(store.get('a'))
+
+
+class ListingCacheTests(S3TestMixin, TestCase):
+
+    def list_keys(self, prefix):
+        _, records, _ = self.s3.get_object_page(BUCKET, prefix, '/')
+        return [record.key for record in records]
+
+    def test_parent_prefixes(self):
+        self.assertEqual(get_parent_prefixes('a/b/c.txt'), ['', 'a/', 'a/b/'])
+        self.assertEqual(get_parent_prefixes('c.txt'), [''])
+
+    def test_pages_are_cached(self):
+        self.put('a/1')
+        self.assertEqual(self.list_keys('a/'), ['a/1'])
+
+        # Written behind the cache's back, so still hidden
+        self.put('a/2')
+        self.assertEqual(self.list_keys('a/'), ['a/1'])
+
+    @override_settings(B3_LISTING_CACHE={'TTL': 0})
+    def test_disabled(self):
+        cache = ListingCache()
+        loader = mock.Mock(side_effect=range(10))
+        cache.get_page(BUCKET, 'a/', '/', None, 100, loader)
+        self.assertEqual(cache.get_page(BUCKET, 'a/', '/', None, 100, loader), 1)
+
+    def test_invalidate_other_prefixes_kept(self):
+        cache = ListingCache({**LISTING_CACHE_DEFAULTS, 'TTL': 60})
+        loader = mock.Mock(side_effect=range(10))
+        cache.get_page(BUCKET, 'a/', '/', None, 100, loader)
+        cache.get_page(BUCKET, 'x/', '/', None, 100, loader)
+
+        cache.invalidate(BUCKET, ['a/b/c'])
+        self.assertEqual(cache.get_page(BUCKET, 'a/', '/', None, 100, loader), 2)
+        self.assertEqual(cache.get_page(BUCKET, 'x/', '/', None, 100, loader), 1)
+        self.assertEqual(cache.invalidations, 3)
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 3))
+
+    def test_shared_store(self):
+        cache = ListingCache({**LISTING_CACHE_DEFAULTS, 'BACKEND': 'django', 'TTL': 60})
+        cache.clear()
+        loader = mock.Mock(side_effect=range(10))
+        cache.get_page(BUCKET, 'a/', '/', None, 100, loader)
+        self.assertEqual(ListingCache(cache.config).get_page(BUCKET, 'a/', '/', None, 100, loader), 0)
+        cache.invalidate(BUCKET, ['a/b'])
+        self.assertEqual(ListingCache(cache.config).get_page(BUCKET, 'a/', '/', None, 100, loader), 1)
+
+    def test_version_tokens_expire(self):
+        cache = ListingCache({**LISTING_CACHE_DEFAULTS, 'TTL': 60})
+        with mock.patch('b3.cache.time.monotonic', return_value=1000):
+            cache.invalidate(BUCKET, ['a/b'])
+        version_key = cache._make_key('version', BUCKET, 'a/', '/')
+        _, expires_at = cache.store._data[version_key]
+        self.assertEqual(expires_at, 1000 + 60 * VERSION_TTL_FACTOR)
@@ -0,0 +1,52 @@
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from .. import s3
+from .base import BUCKET, S3TestMixin
+
+
+class DeleteTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('a/', 'a/1', 'a/b/2', 'a/b/c/3', 'top')
+
+    def list_keys(self, prefix, delimiter=''):
+        _, records, _ = self.s3.get_object_page(BUCKET, prefix, delimiter)
+        return [record.key for record in records]
+
+    def test_delete_keys_include_folder_marker(self):
+        expected = [(BUCKET, key) for key in ('a/', 'a/1', 'a/b/2', 'a/b/c/3')]
+        self.assertCountEqual(self.s3.iter_delete_keys([f'{BUCKET}/a'], []), expected)
+        self.assertCountEqual(self.s3.prepare_delete([f'{BUCKET}/a'], []), [f'{b}/{k}' for b, k in expected])
+
+    def test_delete_invalidates_parent_folders(self):
+        self.assertEqual(self.list_keys('a/', '/'), ['a/', 'a/1'])
+        self.assertEqual(self.list_keys('a/b/', '/'), ['a/b/2'])
+
+        self.assertEqual(self.s3.delete_batch(BUCKET, ['a/1', 'a/b/2']), [])
+        self.assertEqual(self.list_keys('a/', '/'), ['a/'])
+        self.assertEqual(self.list_keys('a/b/', '/'), [])
+
+    def test_initiate_delete_batches(self):
+        keys = [f'p/{i}' for i in range(25)]
+        self.put(*keys)
+        progress = mock.Mock()
+        with mock.patch.object(s3, 'DELETE_BATCH_SIZE', 10), \
+                mock.patch.object(self.s3, 'delete_batch', wraps=self.s3.delete_batch) as delete_batch:
+            result = self.s3.initiate_delete([f'{BUCKET}/top'], [f'{BUCKET}/p'], max_workers=2, progress=progress)
+
+        self.assertEqual(result, {'deleted': 26, 'errors': []})
+        self.assertEqual(sorted(len(call.args[1]) for call in delete_batch.call_args_list), [6, 10, 10])
+        self.assertEqual(sum(call.args[0] for call in progress.call_args_list), 26)
+        self.assertEqual(self.list_keys(''), ['a/', 'a/1', 'a/b/2', 'a/b/c/3'])
+
+    def test_delete_view(self):
+        self.login()
+        response = self.post_json('/b3/delete/', {'operation': 'initiate', 'bucket': BUCKET,
+                                                  'delete_list': json.dumps([f'{BUCKET}/top']),
+                                                  'folder_list': json.dumps([f'{BUCKET}/a/b/'])})
+        self.assertEqual(json.loads(response.content)['result'], {'deleted': 3, 'errors': []})
+        self.assertEqual(self.list_keys(''), ['a/', 'a/1'])
@@ -0,0 +1,71 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import TestCase
+
+from .. import metrics, s3
+from .base import BUCKET, S3TestMixin
+
+
+def count_listings():
+    return sum(value for (operation, bucket, _), value in metrics.S3_REQUESTS._values.items()
+               if operation == 'ListObjectsV2' and bucket == BUCKET)
+
+
+class FolderTreeTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('a/1', 'a/b/2', 'a/b/c/3', 'a/b/c/d/e/4', 'a/f/5', 'g/6')
+
+    def test_levels(self):
+        self.assertEqual(self.s3.get_folder_tree(BUCKET, ['']), ({'': ['a/', 'g/']}, ['a/', 'g/']))
+        tree, next_level = self.s3.get_folder_tree(BUCKET, ['a/', 'a/'], depth=2)
+        self.assertEqual(tree, {'a/': ['a/b/', 'a/f/'], 'a/b/': ['a/b/c/'], 'a/f/': []})
+        self.assertEqual(next_level, ['a/b/c/'])
+
+    def test_depth_capped(self):
+        tree, next_level = self.s3.get_folder_tree(BUCKET, [''], depth=10)
+        self.assertEqual(len(tree), sum(len(level) for level in ([''], ['a/', 'g/'], ['a/b/', 'a/f/'])))
+        self.assertEqual(next_level, ['a/b/c/'])
+
+    def test_max_prefixes(self):
+        tree, next_level = self.s3.get_folder_tree(BUCKET, [''], depth=3, max_prefixes=2)
+        self.assertEqual(list(tree), ['', 'a/'])
+        self.assertEqual(next_level, ['a/b/', 'a/f/'])
+
+    def test_next_level_prefetched(self):
+        prefetch_executor = ThreadPoolExecutor(max_workers=2)
+        with mock.patch.object(s3, 'prefetch_executor', prefetch_executor):
+            self.s3.prefetch_subfolders(BUCKET, ['a/b/', 'a/f/'])
+            prefetch_executor.shutdown(wait=True)
+
+        listings = count_listings()
+        self.assertEqual(self.s3.get_subfolders(BUCKET, 'a/b/'), ['a/b/c/'])
+        self.assertEqual(self.s3.get_subfolders(BUCKET, 'a/f/'), [])
+        self.assertEqual(count_listings(), listings)
+
+
+class ExpandDirTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('a/b/c/1', 'g/2')
+        self.login()
+
+    def expand(self, **kwargs):
+        return json.loads(self.post_json('/b3/expanddir/', {'bucket_name': BUCKET, **kwargs}).content)['result']
+
+    def test_expand_several_levels(self):
+        result = self.expand(prefixes=['', 'g/'], depth=2)
+        self.assertEqual(set(result), {'', 'g/'})
+        self.assertIn(f'id="{BUCKET}_a/b/"', result[''])
+        self.assertIn('<ul class="dir_children li_close">', result[''])
+        self.assertNotIn('a/b/c/', result[''])
+        self.assertEqual(result['g/'], '')
+
+    def test_single_folder(self):
+        html_str = self.expand(dir_path='a/')
+        self.assertIn(f'id="{BUCKET}_a/b/"', html_str)
+        self.assertNotIn('li_close', html_str)
@@ -0,0 +1,142 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .. import inventory, jobs
+from ..models import Job
+from .base import BUCKET, S3TestMixin
+
+
+@override_settings(B3_JOBS={'RUNNER': 'process', 'STALE_AFTER': 60})
+class JobTests(S3TestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='user')
+
+    def submit(self, kind, folders, files):
+        return jobs.submit_job(self.user, self.bucket, kind, {'folder_list': folders, 'file_list': files})
+
+    def run_jobs(self):
+        runner = jobs.JobRunner(workers=2)
+        runner.run_pending()
+        runner.executor.shutdown()
+
+    def test_claimed_once(self):
+        job = self.submit('delete', [], [])
+        first, second = jobs.JobRunner(workers=1), jobs.JobRunner(workers=1)
+        with mock.patch.object(first, 'run_job'), mock.patch.object(second, 'run_job'):
+            self.assertEqual(first.poll(), 1)
+            self.assertEqual(second.poll(), 0)
+        first.executor.shutdown()
+        second.executor.shutdown()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ('running', first.name))
+
+    def test_stale_job_requeued(self):
+        job = self.submit('delete', [], [])
+        Job.objects.filter(pk=job.pk).update(status='running', worker='gone',
+                                             heartbeat=timezone.now() - timedelta(minutes=5))
+        runner = jobs.JobRunner(workers=1)
+        with mock.patch.object(runner, 'run_job'):
+            runner.poll()
+        runner.executor.shutdown()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ('running', runner.name))
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            self.submit('copy', [], [])
+
+    def test_delete_job(self):
+        self.put('top/', 'top/a', 'top/sub/', 'top/sub/b', 'keep/c')
+        job = self.submit('delete', [f'{BUCKET}/top'], [f'{BUCKET}/keep/c'])
+        self.run_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual((job.processed, job.total, job.result['deleted']), (5, 5, 5))
+        self.assertNotIn('Contents', self.client_s3.list_objects_v2(Bucket=BUCKET))
+
+    def test_delete_estimate_counts_folder_markers(self):
+        self.put('top/', 'top/a', 'top/sub/', 'top/sub/b', 'keep/c')
+        inventory.sync_inventory(self.bucket, self.s3)
+        self.assertEqual(jobs.estimate_total(BUCKET, [f'{BUCKET}/top'], [f'{BUCKET}/keep/c']), 5)
+
+    def test_delete_resumes_from_checkpoint(self):
+        self.put('one/a', 'two/b')
+        job = self.submit('delete', [f'{BUCKET}/one', f'{BUCKET}/two'], [])
+        Job.objects.filter(pk=job.pk).update(checkpoint={'folders': 1, 'files': 0})
+        self.run_jobs()
+
+        keys = [item['Key'] for item in self.client_s3.list_objects_v2(Bucket=BUCKET)['Contents']]
+        self.assertEqual(keys, ['one/a'])
+
+    def test_sign_job(self):
+        self.put('docs/a', 'docs/b', 'c')
+        job = self.submit('sign', [f'{BUCKET}/docs'], [f'{BUCKET}/c'])
+        with mock.patch.object(jobs, 'OUTPUT_CHUNK_SIZE', 2):
+            self.run_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.checkpoint), ('done', {'signed': 3}, {'chunks': 2}))
+        lines = ''.join(job.outputs.order_by('index').values_list('data', flat=True)).splitlines()
+        self.assertCountEqual([json.loads(line)['path'] for line in lines], ['c', 'docs/a', 'docs/b'])
+
+    def test_cancel_queued_job(self):
+        job = self.submit('delete', [], [])
+        jobs.cancel_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'cancelled')
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'cancelled')
+
+
+@override_settings(B3_JOBS={'RUNNER': 'process'})
+class JobViewTests(S3TestMixin, TestCase):
+
+    def submit(self, kind='delete'):
+        response = self.post_json('/b3/jobs/', {'kind': kind, 'bucket': BUCKET, 'folder_list': '[]',
+                                                'file_list': json.dumps([f'{BUCKET}/x'])})
+        return json.loads(response.content)['result']
+
+    def test_users_see_their_jobs(self):
+        self.login('owner')
+        job = self.submit()
+        self.assertEqual(job['status'], 'queued')
+        self.assertEqual([item['id'] for item in self.client.get('/b3/jobs/').json()['result']], [job['id']])
+        self.assertEqual(self.client.get(f'/b3/jobs/{job["id"]}/').json()['result']['status'], 'queued')
+
+        self.login('other')
+        self.assertEqual(self.client.get(f'/b3/jobs/{job["id"]}/').status_code, 404)
+        self.assertEqual(self.client.get('/b3/jobs/').json()['result'], [])
+
+        self.login('staff', is_staff=True)
+        self.assertEqual(self.client.get(f'/b3/jobs/{job["id"]}/').status_code, 200)
+
+    def test_cancel(self):
+        self.login()
+        job = self.submit()
+        response = self.client.post(f'/b3/jobs/{job["id"]}/cancel/')
+        self.assertEqual(response.json()['result']['status'], 'cancelled')
+
+    def test_output_of_finished_jobs(self):
+        self.login()
+        job = self.submit('sign')
+        self.assertEqual(self.client.get(f'/b3/jobs/{job["id"]}/output/').json()['result'],
+                         f'error job {job["id"]} is queued')
+
+        job = Job.objects.get(pk=job['id'])
+        job.status = 'done'
+        job.save()
+        job.outputs.create(index=1, data='{"path": "b"}\n')
+        job.outputs.create(index=0, data='{"path": "a"}\n')
+        response = self.client.get(f'/b3/jobs/{job.pk}/output/')
+        self.assertEqual(b''.join(response.streaming_content), b'{"path": "a"}\n{"path": "b"}\n')
@@ -0,0 +1,51 @@
+import json
+
+from django.test import TestCase
+
+from .base import BUCKET, S3TestMixin
+
+
+class ListDirTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def list_dir(self, dir_path, cursor=None):
+        data = {'bucket_name': BUCKET, 'dir_path': dir_path, 'cursor': cursor}
+        return json.loads(self.post_json('/b3/listdir/', data).content)['result']
+
+    def test_columnar_payload(self):
+        self.put('a/', 'a/b/c', 'a/d/e')
+        self.put('a/x.txt', body=b'hello')
+        contents = self.list_dir('a/')
+        self.assertEqual(contents['prefix'], 'a/')
+        self.assertEqual(contents['folders'], ['b', 'd'])
+        self.assertEqual(contents['names'], ['x.txt'])
+        self.assertEqual(contents['sizes'], [5])
+        self.assertIsInstance(contents['mtimes'][0], int)
+        self.assertEqual((contents['folder_sizes'], contents['folder_counts']), ([None, None], [None, None]))
+        self.assertIsNone(contents['cursor'])
+
+    def test_compact_json(self):
+        self.put('x')
+        response = self.post_json('/b3/listdir/', {'bucket_name': BUCKET, 'dir_path': ''})
+        self.assertNotIn(b', ', response.content)
+        self.assertNotIn(b': ', response.content)
+
+    def test_pages_follow_the_cursor(self):
+        keys = [f'p/{i:04}' for i in range(1005)]
+        self.put(*keys)
+
+        first = self.list_dir('p/')
+        self.assertEqual(len(first['names']), 1000)
+        self.assertIsNotNone(first['cursor'])
+
+        second = self.list_dir('p/', first['cursor'])
+        self.assertIsNone(second['cursor'])
+        self.assertEqual(['p/' + name for name in first['names'] + second['names']], keys)
+
+    def test_unknown_bucket(self):
+        data = {'bucket_name': 'nope', 'dir_path': ''}
+        contents = json.loads(self.post_json('/b3/listdir/', data).content)['result']
+        self.assertEqual((contents['folders'], contents['names']), ([], []))
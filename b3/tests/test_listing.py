@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from django.test import TestCase
+
+from .base import BUCKET, S3TestMixin
+
+
+class ListingPageTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('a/', 'a/1', 'a/2', 'a/3', 'a/b/4', 'a/c/5')
+
+    def test_pages_follow_the_cursor(self):
+        pages = list(self.s3.iter_object_pages(BUCKET, 'a/', '/', page_size=2))
+        keys = [record.key for _, records, _ in pages for record in records]
+        folders = [folder for folders, _, _ in pages for folder in folders]
+        self.assertEqual(keys, ['a/', 'a/1', 'a/2', 'a/3'])
+        self.assertEqual(folders, ['a/b/', 'a/c/'])
+        self.assertIsNone(pages[-1][2])
+        self.assertTrue(all(cursor for _, _, cursor in pages[:-1]))
+
+    def test_listing_resumes_from_a_cursor(self):
+        first = next(self.s3.iter_object_pages(BUCKET, 'a/', '', page_size=3))
+        _, records, cursor = first
+        rest = [record.key for _, records, _ in self.s3.iter_object_pages(BUCKET, 'a/', '', page_size=3,
+                                                                          continuation_token=cursor)
+                for record in records]
+        self.assertEqual([record.key for record in records] + rest, ['a/', 'a/1', 'a/2', 'a/3', 'a/b/4', 'a/c/5'])
+
+    def test_records(self):
+        record = next(self.s3.iter_objects(BUCKET, 'a/1'))
+        self.assertEqual((record.key, record.size), ('a/1', 1))
+        self.assertIsInstance(record.mtime, float)
+        self.assertEqual(record.etag, '9dd4e461268c8034f5c8564e155c67a6')
+
+    def test_object_list(self):
+        folders, files = self.s3.get_object_list(BUCKET, 'a/', '/')
+        self.assertEqual(folders, ['a/b/', 'a/c/'])
+        self.assertEqual([item['name'] for item in files], ['a/1', 'a/2', 'a/3'])
+        self.assertIsInstance(files[0]['date'], datetime)
+        self.assertIsNotNone(files[0]['date'].tzinfo)
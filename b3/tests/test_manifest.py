@@ -0,0 +1,59 @@
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from .. import metrics
+from .base import BUCKET, S3TestMixin
+
+
+def count_heads():
+    return sum(value for (operation, bucket, _), value in metrics.S3_REQUESTS._values.items()
+               if operation == 'HeadObject' and bucket == BUCKET)
+
+
+class ManifestTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('docs/', 'docs/a.txt', 'docs/sub/b.txt', 'c.txt')
+        self.login()
+
+    def download(self, folder_list=(), file_list=(), **kwargs):
+        data = {'bucket': BUCKET, 'folder_list': json.dumps(list(folder_list)),
+                'file_list': json.dumps(list(file_list)), 'method': 'get_object', **kwargs}
+        response = self.post_json('/b3/download/', data)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_folders_and_files(self):
+        entries = self.download([f'{BUCKET}/docs'], [f'{BUCKET}/c.txt'])
+        # Selected files come first, folder contents in the order the shards are listed
+        self.assertEqual(entries[0]['path'], 'c.txt')
+        self.assertCountEqual([entry['path'] for entry in entries[1:]], ['docs/a.txt', 'docs/sub/b.txt'])
+        self.assertTrue(all(entry['size'] == 1 and entry['etag'] and entry['token'] for entry in entries))
+
+    def test_unreadable_files_reported(self):
+        entries = self.download(file_list=[f'{BUCKET}/gone', f'{BUCKET}/c.txt'])
+        self.assertEqual(entries[0]['path'], 'gone')
+        self.assertIn('404', entries[0]['error'])
+        self.assertNotIn('token', entries[0])
+        self.assertEqual((entries[1]['path'], entries[1]['size']), ('c.txt', 1))
+
+    def test_known_sizes_skip_head_requests(self):
+        heads = count_heads()
+        entries = self.download(file_list=[f'{BUCKET}/c.txt', f'{BUCKET}/docs/a.txt'], file_sizes=json.dumps([1, None]))
+        self.assertEqual(count_heads(), heads + 1)
+        self.assertEqual([(entry['size'], bool(entry['etag'])) for entry in entries], [(1, False), (1, True)])
+
+    def test_invalid_sizes_ignored(self):
+        heads = count_heads()
+        self.download(file_list=[f'{BUCKET}/c.txt'], file_sizes=json.dumps([1, 2]))
+        self.download(file_list=[f'{BUCKET}/c.txt'], file_sizes=json.dumps(['1']))
+        self.assertEqual(count_heads(), heads + 2)
+
+    def test_listing_errors_end_the_stream(self):
+        with mock.patch('b3.s3.S3.walk', side_effect=RuntimeError('listing failed')):
+            entries = self.download([f'{BUCKET}/docs'], [f'{BUCKET}/c.txt'])
+        self.assertEqual([entry.get('path') for entry in entries], ['c.txt', None])
+        self.assertEqual(entries[-1], {'error': 'listing failed'})
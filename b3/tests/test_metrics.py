@@ -0,0 +1,66 @@
+import re
+
+from botocore.exceptions import ClientError
+from django.test import TestCase, override_settings
+
+from .. import metrics
+from .base import BUCKET, S3TestMixin
+
+
+def get_server_timing(response):
+    return {name: int(count) for name, count in re.findall(r'(\w+);dur=[\d.]+;desc="(\d+) calls"',
+                                                           response['Server-Timing'])}
+
+
+def get_observations(histogram, labels):
+    counts, _ = histogram._values.get(labels, ([], 0))
+    return sum(counts)
+
+
+class MetricsTests(S3TestMixin, TestCase):
+
+    def test_get_prefix(self):
+        self.assertEqual(metrics.get_prefix({'Key': 'a/b/c.txt'}), 'a/')
+        self.assertEqual(metrics.get_prefix({'Prefix': 'a/'}), 'a/')
+        self.assertEqual(metrics.get_prefix({'Key': 'file.txt'}), '')
+        self.assertEqual(metrics.get_prefix({}), '')
+
+    def test_calls_labelled(self):
+        self.put('a/1', 'x/2')
+        before = [get_observations(metrics.S3_DURATION, ('HeadObject', BUCKET, 'a/')),
+                  metrics.S3_REQUESTS._values.get(('HeadObject', BUCKET, '200'), 0),
+                  metrics.S3_REQUESTS._values.get(('HeadObject', BUCKET, '404'), 0)]
+        self.s3.client.head_object(Bucket=BUCKET, Key='a/1')
+        self.s3.client.head_object(Bucket=BUCKET, Key='a/1')
+        self.s3.client.head_object(Bucket=BUCKET, Key='x/2')
+        with self.assertRaises(ClientError):
+            self.s3.client.head_object(Bucket=BUCKET, Key='a/gone')
+        self.s3.client.list_objects_v2(Bucket=BUCKET, Prefix='')
+
+        after = [get_observations(metrics.S3_DURATION, ('HeadObject', BUCKET, 'a/')),
+                 metrics.S3_REQUESTS._values.get(('HeadObject', BUCKET, '200'), 0),
+                 metrics.S3_REQUESTS._values.get(('HeadObject', BUCKET, '404'), 0)]
+        self.assertEqual([b - a for a, b in zip(before, after)], [3, 3, 1])
+        self.assertIn(('ListObjectsV2', BUCKET, ''), metrics.S3_DURATION._values)
+
+    def test_server_timing(self):
+        self.put('a/1')
+        self.login()
+        response = self.post_json('/b3/listdir/', {'bucket_name': BUCKET, 'dir_path': 'a/'})
+        phases = get_server_timing(response)
+        self.assertEqual((phases['s3'], phases['render']), (1, 1))
+        self.assertGreaterEqual(phases['db'], 1)
+        self.assertRegex(response['Server-Timing'], r'total;dur=[\d.]+$')
+
+    @override_settings(B3_METRICS_TOKEN='secret')
+    def test_metrics_endpoint(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE b3_s3_requests_total counter', response.content)
+        self.assertIn(b'b3_request_duration_seconds_bucket', response.content)
+
+        self.login('staff', is_staff=True)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
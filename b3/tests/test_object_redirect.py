@@ -0,0 +1,64 @@
+from unittest import mock
+from urllib.parse import parse_qs, quote, urlsplit
+
+from django.test import TestCase
+
+from ..cache import PresignedUrlCache, url_cache
+from .base import BUCKET, S3TestMixin
+
+
+class PresignedUrlCacheTests(TestCase):
+
+    def test_urls_refreshed_before_expiry(self):
+        cache = PresignedUrlCache({'EXPIRY': 100, 'REFRESH_MARGIN': 30, 'MAX_ENTRIES': 10})
+        signer = mock.Mock(side_effect=['url1', 'url2'])
+        with mock.patch('b3.cache.time.time', return_value=1000), \
+                mock.patch('b3.cache.time.monotonic', return_value=1000):
+            self.assertEqual(cache.get_url('key', BUCKET, 'a', signer), ('url1', 100))
+        with mock.patch('b3.cache.time.time', return_value=1060), \
+                mock.patch('b3.cache.time.monotonic', return_value=1060):
+            self.assertEqual(cache.get_url('key', BUCKET, 'a', signer), ('url1', 40))
+        with mock.patch('b3.cache.time.time', return_value=1071), \
+                mock.patch('b3.cache.time.monotonic', return_value=1071):
+            self.assertEqual(cache.get_url('key', BUCKET, 'a', signer), ('url2', 100))
+        signer.assert_called_with(100)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_keyed_by_credentials(self):
+        cache = PresignedUrlCache({'EXPIRY': 100, 'REFRESH_MARGIN': 30, 'MAX_ENTRIES': 10})
+        signer = mock.Mock(side_effect=['url1', 'url2'])
+        cache.get_url('key1', BUCKET, 'a', signer)
+        self.assertEqual(cache.get_url('key2', BUCKET, 'a', signer)[0], 'url2')
+
+
+class ObjectRedirectTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('a/b c.txt')
+        self.login()
+
+    def test_redirect_to_presigned_url(self):
+        response = self.client.get(f'/b3/obj/{BUCKET}/a/b c.txt')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Cache-Control'], 'private, max-age=3000')
+        url = urlsplit(response['Location'])
+        self.assertEqual(url.path, f'/{BUCKET}/' + quote('a/b c.txt'))
+        self.assertEqual(parse_qs(url.query)['X-Amz-Expires'], ['3600'])
+
+    def test_url_reused(self):
+        hits = url_cache.hits
+        first = self.client.get(f'/b3/obj/{BUCKET}/a/b c.txt')['Location']
+        self.assertEqual(self.client.get(f'/b3/obj/{BUCKET}/a/b c.txt')['Location'], first)
+        self.assertEqual(url_cache.hits, hits + 1)
+
+    def test_unknown_bucket(self):
+        self.assertEqual(self.client.get('/b3/obj/nope/a').status_code, 404)
+
+    def test_get_only(self):
+        self.assertEqual(self.client.post(f'/b3/obj/{BUCKET}/a/b c.txt').status_code, 405)
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(f'/b3/obj/{BUCKET}/a/b c.txt')
+        self.assertEqual((response.status_code, urlsplit(response['Location']).path), (302, '/'))
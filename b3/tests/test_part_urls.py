@@ -0,0 +1,68 @@
+import datetime
+import json
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from botocore import auth
+from django.test import TestCase
+
+from ..signing import CachedS3SigV4Auth, CachedS3SigV4QueryAuth, get_signing_key
+from ..views import MAX_PART_WINDOW
+from .base import BUCKET, S3TestMixin
+
+
+class SigningTests(S3TestMixin, TestCase):
+
+    def sign(self, method='get_object', **kwargs):
+        now = datetime.datetime(2024, 5, 1, 12, 0, 0)
+        with mock.patch('botocore.auth.get_current_datetime', return_value=now):
+            return self.s3.generate_presigned_url(BUCKET, 'a/1', method, **kwargs)
+
+    def test_signers_registered(self):
+        self.assertIs(auth.AUTH_TYPE_MAPS['s3v4'], CachedS3SigV4Auth)
+        self.assertIs(auth.AUTH_TYPE_MAPS['s3v4-query'], CachedS3SigV4QueryAuth)
+
+    def test_cached_key_matches_stock_signer(self):
+        get_signing_key.cache_clear()
+        cached = [self.sign(), self.sign('upload_part', upload_id='u1', part_number=3)]
+        self.assertEqual(get_signing_key.cache_info().hits, 1)
+
+        with mock.patch.dict(auth.AUTH_TYPE_MAPS, {'s3v4': auth.S3SigV4Auth, 's3v4-query': auth.S3SigV4QueryAuth}):
+            stock = [self.sign(), self.sign('upload_part', upload_id='u1', part_number=3)]
+
+        self.assertEqual(cached, stock)
+        self.assertIn('X-Amz-Signature', parse_qs(urlsplit(cached[0]).query))
+
+
+class PartUrlTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def upload_parts(self, **kwargs):
+        data = {'bucket': BUCKET, 'object_path': 'big', 'upload_id': 'u1', **kwargs}
+        return json.loads(self.post_json('/b3/uploadparts/', data).content)['result']
+
+    def part_numbers(self, urls):
+        return [int(parse_qs(urlsplit(url).query)['partNumber'][0]) for url in urls]
+
+    def test_window(self):
+        self.assertEqual(self.part_numbers(self.upload_parts(first_part=5, count=3)), [5, 6, 7])
+
+    def test_window_capped(self):
+        self.assertEqual(len(self.upload_parts(first_part=1, count=MAX_PART_WINDOW + 10)), MAX_PART_WINDOW)
+        self.assertEqual(self.part_numbers(self.upload_parts(first_part=9999, count=5)), [9999, 10000])
+
+    def test_window_validated(self):
+        self.assertEqual(self.upload_parts(first_part='x', count=2), 'error first_part and count must be integers')
+        self.assertEqual(self.upload_parts(count=2), 'error first_part and count must be integers')
+        self.assertEqual(self.upload_parts(first_part=0, count=2), 'error first_part and count must be positive')
+        self.assertEqual(self.upload_parts(first_part=1, count=-1), 'error first_part and count must be positive')
+
+    def test_start_issues_first_window(self):
+        size = 200 * 1024 * 1024
+        plan = self.s3.start_file_upload([f'{BUCKET}/big', size], part_window=2)
+        self.assertEqual(plan['strategy'], 'multipart')
+        self.assertGreater(plan['part_count'], 2)
+        self.assertEqual(self.part_numbers(plan['token']), [1, 2])
@@ -0,0 +1,65 @@
+import os
+import pstats
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from ..models import RequestProfile
+from ..profiling import profiling_lock
+from .base import BUCKET, S3TestMixin
+
+
+class ProfilingTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('a/1')
+
+    def list_dir(self, query='', **headers):
+        return self.client.post(f'/b3/listdir/{query}', {'bucket_name': BUCKET, 'dir_path': 'a/'},
+                                content_type='application/json', headers=headers)
+
+    def test_staff_request_profiled(self):
+        user = self.login('staff', is_staff=True)
+        response = self.list_dir('?b3profile=1')
+        profile = RequestProfile.objects.get()
+        self.assertEqual(response['X-B3-Profile-Id'], str(profile.pk))
+        self.assertEqual((profile.user, profile.method, profile.path), (user, 'POST', '/b3/listdir/?b3profile=1'))
+        self.assertEqual((profile.view, profile.status, profile.sampled), ('browser:listdir', 200, False))
+        self.assertIn('listDir', profile.stats)
+
+    def test_profile_header(self):
+        self.login('staff', is_staff=True)
+        self.assertIn('X-B3-Profile-Id', self.list_dir(X_B3_Profile='1'))
+
+    def test_other_users_not_profiled(self):
+        self.login()
+        self.assertNotIn('X-B3-Profile-Id', self.list_dir('?b3profile=1'))
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_concurrent_requests_not_profiled(self):
+        self.login('staff', is_staff=True)
+        with profiling_lock:
+            self.assertNotIn('X-B3-Profile-Id', self.list_dir('?b3profile=1'))
+
+    @override_settings(B3_PROFILING={'SAMPLE_RATE': 1.0, 'MAX_PROFILES': 2})
+    def test_sampled_requests(self):
+        self.login()
+        for _ in range(3):
+            self.list_dir()
+        self.assertEqual(RequestProfile.objects.count(), 2)
+        self.assertTrue(all(RequestProfile.objects.values_list('sampled', flat=True)))
+
+    def test_download(self):
+        self.login('admin', is_staff=True, is_superuser=True)
+        pk = self.list_dir('?b3profile=1')['X-B3-Profile-Id']
+
+        response = self.client.get(f'/admin/b3/requestprofile/{pk}/download/prof/')
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="b3-profile-{pk}.prof"')
+        with tempfile.NamedTemporaryFile(suffix='.prof', delete=False) as f:
+            f.write(response.content)
+        self.addCleanup(os.remove, f.name)
+        self.assertTrue(any(name == 'listDir' for _, _, name in pstats.Stats(f.name).stats))
+
+        response = self.client.get(f'/admin/b3/requestprofile/{pk}/download/folded/')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
@@ -0,0 +1,73 @@
+import json
+
+from django.test import TestCase
+
+from ..models import UploadSession
+from .base import BUCKET, S3TestMixin
+
+
+MIB = 1024 * 1024
+
+
+class ResumeUploadTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.login()
+        self.file = [f'{BUCKET}/big.bin', 20 * MIB, 'fingerprint']
+
+    def start_upload(self, file_list):
+        response = self.post_json('/b3/startupload/', {'bucket': BUCKET, 'file_list': json.dumps(file_list)})
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def resume(self, file_list):
+        data = {'bucket': BUCKET, 'file_list': json.dumps(file_list)}
+        return json.loads(self.post_json('/b3/resumeupload/', data).content)['result']
+
+    def upload_part(self, plan, number, size):
+        return self.client_s3.upload_part(Bucket=BUCKET, Key='big.bin', UploadId=plan['upload_id'],
+                                          PartNumber=number, Body=b'x' * size)
+
+    def test_sessions_recorded(self):
+        plans = self.start_upload([self.file, [f'{BUCKET}/small', 10, 'other'], [f'{BUCKET}/nofp', 20 * MIB]])
+        upload_id = next(plan['upload_id'] for plan in plans if plan['index'] == 0)
+        session = UploadSession.objects.get()
+        self.assertEqual((session.user, session.key, session.upload_id), (self.user, 'big.bin', upload_id))
+        self.assertEqual((session.file_size, session.fingerprint), (20 * MIB, 'fingerprint'))
+
+    def test_resume_lists_uploaded_parts(self):
+        plan, = self.start_upload([self.file])
+        self.assertEqual((plan['part_size'], plan['part_count']), (5 * MIB, 4))
+        etag = self.upload_part(plan, 1, 5 * MIB)['ETag']
+        # A truncated part is uploaded again
+        self.upload_part(plan, 2, MIB)
+        self.upload_part(plan, 4, 5 * MIB)
+
+        details, = self.resume([self.file])
+        self.assertEqual((details['upload_id'], details['part_size'], details['part_count']),
+                         (plan['upload_id'], 5 * MIB, 4))
+        self.assertEqual([part['PartNumber'] for part in details['parts']], [1, 4])
+        self.assertEqual(details['parts'][0]['ETag'], etag)
+
+    def test_changed_file_not_resumed(self):
+        self.start_upload([self.file])
+        self.assertEqual(self.resume([[self.file[0], self.file[1], 'changed'], [self.file[0], 30 * MIB, 'fingerprint']]),
+                         [None, None])
+
+    def test_other_users_not_resumed(self):
+        self.start_upload([self.file])
+        self.login('other')
+        self.assertEqual(self.resume([self.file]), [None])
+
+    def test_aborted_upload_forgotten(self):
+        plan, = self.start_upload([self.file])
+        self.client_s3.abort_multipart_upload(Bucket=BUCKET, Key='big.bin', UploadId=plan['upload_id'])
+        self.assertEqual(self.resume([self.file]), [None])
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_finished_upload_forgotten(self):
+        plan, = self.start_upload([self.file])
+        parts = [{'PartNumber': 1, 'ETag': self.upload_part(plan, 1, 5 * MIB)['ETag']}]
+        self.post_json('/b3/finishupload/', {'bucket': BUCKET, 'object_path': 'big.bin', 'upload_id': plan['upload_id'],
+                                             'parts': json.dumps(parts)})
+        self.assertFalse(UploadSession.objects.exists())
@@ -0,0 +1,62 @@
+import json
+
+from django.test import TestCase
+
+from .. import inventory
+from ..models import FolderRollup
+from ..s3 import ObjectRecord
+from .base import BUCKET, S3TestMixin
+
+
+class RollupTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('a/1', 'a/b/2', 'a/b/c/3', 'x/4')
+        self.put('a/b/big', body=b'x' * 100)
+        inventory.sync_inventory(self.bucket, self.s3)
+
+    def rollup(self, prefix):
+        return inventory.get_rollups(BUCKET, [prefix]).get(prefix)
+
+    def test_synced_rollups(self):
+        self.assertEqual(inventory.get_rollups(BUCKET, ['', 'a/', 'a/b/', 'a/b/c/']), {
+            '': {'size': 104, 'count': 5},
+            'a/': {'size': 103, 'count': 4},
+            'a/b/': {'size': 102, 'count': 3},
+            'a/b/c/': {'size': 1, 'count': 1},
+        })
+        self.assertEqual(set(inventory.get_rollups(BUCKET, parent='')), {'a/', 'x/'})
+        self.assertFalse(FolderRollup.objects.filter(dirty=True).exists())
+
+    def test_recorded_objects_refresh_their_folders(self):
+        inventory.record_objects(BUCKET, [ObjectRecord('a/b/new/5', 10, 0, 'e'), ObjectRecord('a/1', 5, 0, 'e')])
+        self.assertEqual(set(FolderRollup.objects.filter(dirty=True).values_list('prefix', flat=True)),
+                         {'', 'a/', 'a/b/', 'a/b/new/'})
+
+        self.assertEqual(self.rollup('a/b/'), {'size': 112, 'count': 4})
+        self.assertEqual(self.rollup('a/'), {'size': 117, 'count': 5})
+        self.assertEqual(self.rollup('x/'), {'size': 1, 'count': 1})
+
+    def test_removed_folders_dropped(self):
+        inventory.remove_objects(BUCKET, folders=['a/b/'], keys=['x/4'], kept_keys=['a/b/big'])
+        self.assertEqual(inventory.get_rollups(BUCKET, ['', 'a/', 'a/b/', 'a/b/c/', 'x/']), {
+            '': {'size': 101, 'count': 2},
+            'a/': {'size': 101, 'count': 2},
+            'a/b/': {'size': 100, 'count': 1},
+        })
+        self.assertFalse(FolderRollup.objects.filter(prefix__in=['a/b/c/', 'x/']).exists())
+
+    def test_rebuild_below_a_prefix(self):
+        FolderRollup.objects.filter(prefix='a/b/c/').update(size=0, count=0)
+        inventory.rebuild_rollups(self.bucket, 'a/b/')
+        self.assertEqual(self.rollup('a/b/c/'), {'size': 1, 'count': 1})
+        self.assertTrue(FolderRollup.objects.get(prefix='a/').dirty)
+        self.assertEqual(self.rollup('a/'), {'size': 103, 'count': 4})
+
+    def test_list_dir_folder_sizes(self):
+        self.login()
+        response = self.post_json('/b3/listdir/', {'bucket_name': BUCKET, 'dir_path': 'a/'})
+        contents = json.loads(response.content)['result']
+        self.assertEqual(contents['folders'], ['b'])
+        self.assertEqual((contents['folder_sizes'], contents['folder_counts']), ([102], [3]))
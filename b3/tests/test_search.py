@@ -0,0 +1,114 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .. import inventory
+from ..models import ObjectEntry
+from .base import BUCKET, S3TestMixin
+
+
+class SearchTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('a/report.pdf', 'a/report', 'a/b/old_report.pdf', 'a/b/report2.txt', 'x/report.pdf')
+        self.put('a/big.bin', body=b'x' * 5000)
+        inventory.sync_inventory(self.bucket, self.s3)
+
+    def search(self, query, **kwargs):
+        return [item.key for item in inventory.search(BUCKET, query, **kwargs)['items']]
+
+    def test_substring_ranked(self):
+        self.assertEqual(self.search('report', prefix='a/'),
+                         ['a/report', 'a/report.pdf', 'a/b/report2.txt', 'a/b/old_report.pdf'])
+
+    def test_prefix(self):
+        self.assertEqual(self.search('old', mode='prefix'), ['a/b/old_report.pdf'])
+        self.assertEqual(self.search('b/r', mode='prefix', prefix='a/'), ['a/b/report2.txt'])
+
+    def test_glob(self):
+        self.assertCountEqual(self.search('*.pdf', mode='glob', prefix='a/'), ['a/report.pdf', 'a/b/old_report.pdf'])
+        self.assertEqual(self.search('b/*.txt', mode='glob', prefix='a/'), ['a/b/report2.txt'])
+        self.assertEqual(self.search('rep*', mode='glob', prefix='a/'), ['a/report', 'a/report.pdf', 'a/b/report2.txt'])
+
+    def test_suffix_glob_uses_reversed_keys(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertCountEqual(self.search('*.PDF', mode='glob'),
+                                  ['a/report.pdf', 'a/b/old_report.pdf', 'x/report.pdf'])
+        self.assertIn('key_reversed', queries[-1]['sql'])
+
+    def test_reversed_keys_backfilled(self):
+        ObjectEntry.objects.update(key_reversed='')
+        inventory.sync_inventory(self.bucket, self.s3)
+        self.assertEqual(ObjectEntry.objects.get(key='a/report.pdf').key_reversed, 'fdp.troper/a')
+
+    def test_regex(self):
+        self.assertEqual(self.search('^rep.*[0-9]', mode='regex'), ['a/b/report2.txt'])
+        with self.assertRaises(ValueError):
+            self.search('(', mode='regex')
+
+    def test_path_relative_to_prefix(self):
+        self.assertEqual(self.search('b/rep', prefix='a/'), ['a/b/report2.txt'])
+        self.assertEqual(self.search('a/b', prefix='a/'), [])
+
+    def test_filters(self):
+        self.assertEqual(self.search('', min_size=1000), ['a/big.bin'])
+        self.assertEqual(self.search('report', modified_before=timezone.now() - timedelta(days=1)), [])
+
+    def test_cursor_pages(self):
+        for candidates in (1000, 2):
+            with mock.patch.object(inventory, 'SEARCH_RANK_CANDIDATES', candidates):
+                keys, cursor = [], None
+                while True:
+                    page = inventory.search(BUCKET, 'report', cursor=cursor, page_size=1)
+                    keys += [item.key for item in page['items']]
+                    cursor = page['cursor']
+                    if cursor is None:
+                        break
+                self.assertCountEqual(keys, ['a/report.pdf', 'a/report', 'a/b/old_report.pdf',
+                                             'a/b/report2.txt', 'x/report.pdf'])
+
+    def test_scans_refused_on_large_folders(self):
+        with mock.patch.object(inventory, 'SEARCH_SCAN_LIMIT', 5):
+            with self.assertRaisesMessage(ValueError, 'the bucket holds 6 objects'):
+                self.search('report')
+            with self.assertRaises(ValueError):
+                self.search('rep.*', mode='regex')
+            self.assertEqual(self.search('report', prefix='a/'),
+                             ['a/report', 'a/report.pdf', 'a/b/report2.txt', 'a/b/old_report.pdf'])
+            self.assertEqual(self.search('old', mode='prefix'), ['a/b/old_report.pdf'])
+            self.assertEqual(len(self.search('*.pdf', mode='glob')), 3)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            self.search('x', mode='fuzzy')
+
+
+class SearchViewTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('a/report.pdf', 'a/notes.txt')
+        self.login()
+
+    def search(self, **kwargs):
+        return json.loads(self.post_json('/b3/search/', {'bucket_name': BUCKET, **kwargs}).content)['result']
+
+    def test_not_indexed(self):
+        self.assertEqual(self.search(query='report'), f'error {BUCKET} is not indexed, run "manage.py b3sync {BUCKET}" first')
+
+    def test_payload(self):
+        inventory.sync_inventory(self.bucket, self.s3)
+        result = self.search(query='report', dir_path='a/')
+        self.assertEqual((result['keys'], result['sizes'], result['cursor']), (['a/report.pdf'], [1], None))
+        self.assertIsInstance(result['mtimes'][0], int)
+
+    def test_errors(self):
+        inventory.sync_inventory(self.bucket, self.s3)
+        self.assertEqual(self.search(query='x', cursor='1'), 'error invalid search cursor')
+        self.assertTrue(self.search(query='(', mode='regex').startswith('error Invalid regular expression'))
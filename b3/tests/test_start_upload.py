@@ -0,0 +1,60 @@
+import json
+import threading
+from unittest import mock
+
+from django.test import TestCase
+
+from .base import BUCKET, S3TestMixin
+
+
+class IterStartUploadTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.files = [[f'{BUCKET}/f{i}', i] for i in range(40)]
+
+    def test_plans_in_file_order(self):
+        plans = self.s3.start_upload(self.files)
+        self.assertEqual(len(plans), 40)
+        self.assertTrue(all(plan['strategy'] == 'single' for plan in plans))
+        self.assertEqual([plan['part_size'] for plan in plans], list(range(40)))
+
+    def test_uploads_started_in_parallel(self):
+        barrier = threading.Barrier(4, timeout=10)
+
+        def start_file_upload(_file, part_window, concurrency):
+            barrier.wait()
+            return {'size': _file[1]}
+
+        with mock.patch.object(self.s3, 'start_file_upload', side_effect=start_file_upload):
+            results = list(self.s3.iter_start_upload(self.files[:8], max_workers=4))
+        self.assertCountEqual([index for index, _ in results], range(8))
+        self.assertTrue(all(plan['size'] == index for index, plan in results))
+
+
+class StartUploadViewTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def start_upload(self, file_list):
+        response = self.post_json('/b3/startupload/', {'bucket': BUCKET, 'file_list': json.dumps(file_list)})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_one_line_per_file(self):
+        lines = self.start_upload([[f'{BUCKET}/f{i}', i] for i in range(20)])
+        self.assertEqual(sorted(line['index'] for line in lines), list(range(20)))
+        self.assertTrue(all(line['part_size'] == line['index'] for line in lines))
+
+    def test_error_line(self):
+        def start_file_upload(_file, part_window, concurrency):
+            if _file[1] == 3:
+                raise ValueError('failed to start')
+            return {'strategy': 'single'}
+
+        with mock.patch('b3.s3.S3.start_file_upload', side_effect=start_file_upload):
+            lines = self.start_upload([[f'{BUCKET}/f{i}', i] for i in range(5)])
+        self.assertEqual(lines[-1], {'error': 'failed to start'})
+        self.assertNotIn(3, [line.get('index') for line in lines])
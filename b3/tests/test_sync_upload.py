@@ -0,0 +1,64 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from ..s3 import ObjectRecord
+from ..uploads import diff_manifest, is_changed
+from .base import BUCKET, S3TestMixin
+
+
+class IsChangedTests(SimpleTestCase):
+
+    def test_size_and_mtime(self):
+        record = ObjectRecord('a', 3, 1000.0, '900150983cd24fb0d6963f7d28e17f72')
+        self.assertTrue(is_changed(['a', 4, 0], record))
+        self.assertFalse(is_changed(['a', 3, 999000], record))
+        self.assertFalse(is_changed(['a', 3, 1002000], record))
+        self.assertTrue(is_changed(['a', 3, 1010000], record))
+
+    def test_md5(self):
+        record = ObjectRecord('a', 3, 1000.0, '900150983cd24fb0d6963f7d28e17f72')
+        self.assertFalse(is_changed(['a', 3, 1010000, '900150983CD24FB0D6963F7D28E17F72'], record))
+        self.assertTrue(is_changed(['a', 3, 0, '0' * 32], record))
+
+        multipart = ObjectRecord('a', 3, 1000.0, 'abc-2')
+        self.assertFalse(is_changed(['a', 3, 999000, '0' * 32], multipart))
+
+
+class DiffManifestTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.put('dst/d/same', 'dst/d/old', 'dst/d/sub/deep', 'dst/top', 'dst/gone', 'dst/other/kept', body=b'abc')
+        future = (timezone.now() + timedelta(days=1)).timestamp() * 1000
+        self.manifest = [
+            ['d/same', 3, 0],
+            ['d/changed', 3, future],
+            ['d/new', 1, 0],
+            ['top', 3, 0],
+        ]
+        self.put('dst/d/changed', body=b'abc')
+
+    def test_diff(self):
+        diff = diff_manifest(self.s3, BUCKET, 'dst/', self.manifest)
+        self.assertEqual(diff, {'upload': [1, 2], 'delete': [], 'unchanged': 2})
+
+    def test_deletes_limited_to_the_manifest_folders(self):
+        diff = diff_manifest(self.s3, BUCKET, 'dst/', self.manifest, find_deletes=True)
+        self.assertEqual(diff['delete'], [f'{BUCKET}/dst/d/old', f'{BUCKET}/dst/d/sub/deep'])
+
+    def test_sync_upload_view(self):
+        self.login()
+        data = {'bucket': BUCKET, 'prefix': 'dst/', 'manifest': json.dumps(self.manifest), 'delete': True}
+        result = json.loads(self.post_json('/b3/syncupload/', data).content)['result']
+        self.assertEqual(result, {'upload': [1, 2], 'delete': [f'{BUCKET}/dst/d/old', f'{BUCKET}/dst/d/sub/deep'],
+                                  'unchanged': 2})
+
+    def test_manifest_size_limit(self):
+        self.login()
+        with mock.patch('b3.views.SYNC_MAX_MANIFEST_SIZE', 10):
+            response = self.post_json('/b3/syncupload/', {'bucket': BUCKET, 'manifest': json.dumps(self.manifest)})
+        self.assertEqual(json.loads(response.content)['result'], 'error manifest larger than 10 bytes')
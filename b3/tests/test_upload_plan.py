@@ -0,0 +1,64 @@
+import json
+from urllib.parse import urlsplit
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from ..s3 import MAX_OBJECT_SIZE, MAX_PART_NUMBER, MAX_PART_SIZE, MIN_PART_SIZE, plan_upload
+from .base import BUCKET, S3TestMixin
+
+
+MIB = 1024 * 1024
+GIB = 1024 * MIB
+
+
+class PlanUploadTests(SimpleTestCase):
+
+    def test_single_put_below_threshold(self):
+        self.assertEqual(plan_upload(0), ('single', 0))
+        self.assertEqual(plan_upload(16 * MIB - 1), ('single', 16 * MIB - 1))
+        self.assertEqual(plan_upload(16 * MIB), ('multipart', 5 * MIB))
+
+    def test_part_size_grows_with_the_file(self):
+        self.assertEqual(plan_upload(GIB), ('multipart', 8 * MIB))
+        self.assertEqual(plan_upload(100 * GIB), ('multipart', 103 * MIB))
+        self.assertEqual(plan_upload(MAX_OBJECT_SIZE), ('multipart', MAX_PART_SIZE))
+
+    def test_every_concurrent_upload_gets_a_part(self):
+        self.assertEqual(plan_upload(40 * MIB), ('multipart', 8 * MIB))
+        self.assertEqual(plan_upload(40 * MIB, concurrency=8), ('multipart', 5 * MIB))
+
+    def test_part_limits(self):
+        for size in (16 * MIB, 777 * MIB + 3, 49 * GIB, 999 * GIB, MAX_OBJECT_SIZE):
+            _, part_size = plan_upload(size)
+            self.assertTrue(MIN_PART_SIZE <= part_size <= MAX_PART_SIZE, size)
+            self.assertEqual(part_size % MIB, 0)
+            self.assertLessEqual(-(-size // part_size), MAX_PART_NUMBER, size)
+
+    @override_settings(B3_UPLOAD={'SINGLE_PUT_THRESHOLD': MIB, 'TARGET_PARTS': 10})
+    def test_settings(self):
+        self.assertEqual(plan_upload(MIB - 1), ('single', MIB - 1))
+        self.assertEqual(plan_upload(GIB), ('multipart', 103 * MIB))
+
+    def test_too_large(self):
+        with self.assertRaisesMessage(ValueError, 'cannot be uploaded'):
+            plan_upload(MAX_OBJECT_SIZE + 1)
+
+
+class StartUploadTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def test_single_put(self):
+        response = self.post_json('/b3/startupload/', {'bucket': BUCKET, 'file_list': json.dumps([[f'{BUCKET}/a', 10]])})
+        plan = json.loads(b''.join(response.streaming_content))
+        self.assertEqual((plan['strategy'], plan['upload_id'], plan['part_count']), ('single', None, 1))
+        self.assertEqual(len(plan['token']), 1)
+        self.assertEqual(urlsplit(plan['token'][0]).path, f'/{BUCKET}/a')
+
+    def test_too_large_rejected(self):
+        file_list = [[f'{BUCKET}/a', 10], [f'{BUCKET}/b', MAX_OBJECT_SIZE + 1]]
+        response = self.post_json('/b3/startupload/', {'bucket': BUCKET, 'file_list': json.dumps(file_list)})
+        self.assertEqual(json.loads(response.content)['result'], 'error Files larger than 5 TB cannot be uploaded.')
+        self.assertEqual(self.client_s3.list_multipart_uploads(Bucket=BUCKET).get('Uploads', []), [])
@@ -0,0 +1,59 @@
+import base64
+import json
+
+import requests
+from django.test import TestCase
+
+from .. import inventory
+from ..models import ObjectEntry
+from ..s3 import S3
+from .base import BUCKET, S3TestMixin
+
+
+class UploadPolicyTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def upload_policy(self, **kwargs):
+        return json.loads(self.post_json('/b3/uploadpolicy/', {'bucket': BUCKET, **kwargs}).content)['result']
+
+    def list_keys(self, prefix):
+        _, records, _ = self.s3.get_object_page(BUCKET, prefix, '/')
+        return [record.key for record in records]
+
+    def test_policy_scoped_to_the_prefix(self):
+        policy = self.upload_policy(operation='create', prefix='up/')
+        self.assertEqual((policy['prefix'], policy['max_size'], policy['expires_in']), ('up/', 16 * 1024 * 1024 - 1, 3600))
+        self.assertEqual(policy['fields']['key'], 'up/${filename}')
+
+        document = json.loads(base64.b64decode(policy['fields']['policy']))
+        self.assertIn(['starts-with', '$key', 'up/'], document['conditions'])
+        self.assertIn(['content-length-range', 0, policy['max_size']], document['conditions'])
+
+    def test_post_upload(self):
+        policy = self.upload_policy(operation='create', prefix='up/')
+        response = requests.post(policy['url'], data=policy['fields'], files={'file': ('a.txt', b'hello')})
+        self.assertLess(response.status_code, 300)
+        self.assertEqual(self.client_s3.get_object(Bucket=BUCKET, Key='up/a.txt')['Body'].read(), b'hello')
+
+    def test_not_supported_by_backblaze(self):
+        s3 = S3(('key', 'secret'), 'backblaze', 'us-west-004', BUCKET)
+        self.assertIsNone(s3.generate_upload_policy(BUCKET, 'up/'))
+
+    def test_complete_refreshes_listing(self):
+        self.assertEqual(self.list_keys('up/'), [])
+        self.put('up/a.txt')
+        self.assertEqual(self.upload_policy(operation='complete', prefix='up/', keys=json.dumps(['up/a.txt'])), 'ok')
+        self.assertEqual(self.list_keys('up/'), ['up/a.txt'])
+
+    def test_complete_records_the_reported_keys(self):
+        self.put('old')
+        inventory.sync_inventory(self.bucket, self.s3)
+        self.put('up/a.txt', 'up/b.txt', 'elsewhere', 'unreported')
+
+        keys = ['up/a.txt', 'up/b.txt', 'up/missing', 'elsewhere']
+        self.assertEqual(self.upload_policy(operation='complete', prefix='up/', keys=json.dumps(keys)), 'ok')
+        self.assertCountEqual(ObjectEntry.objects.values_list('key', flat=True), ['old', 'up/a.txt', 'up/b.txt'])
+        self.assertEqual(inventory.get_rollups(BUCKET, ['up/']), {'up/': {'size': 2, 'count': 2}})
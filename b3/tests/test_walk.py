@@ -0,0 +1,33 @@
+from django.test import TestCase
+
+from .base import BUCKET, S3TestMixin
+
+
+class WalkTests(S3TestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.keys = {'top', 'a/', 'a/1', 'a/b/2', 'a/b/c/3', 'a/b/c/d/4', 'e/5', 'e/f/6'}
+        self.put(*self.keys)
+
+    def test_walk_lists_every_key_once(self):
+        for shard_depth in (0, 1, 2, 5):
+            for max_workers in (1, 4):
+                keys = [record.key for record in self.s3.walk(BUCKET, '', max_workers=max_workers,
+                                                              shard_depth=shard_depth)]
+                self.assertCountEqual(keys, self.keys, (shard_depth, max_workers))
+
+    def test_walk_prefix(self):
+        keys = [record.key for record in self.s3.walk(BUCKET, 'a/b/', shard_depth=1)]
+        self.assertCountEqual(keys, ['a/b/2', 'a/b/c/3', 'a/b/c/d/4'])
+
+    def test_walk_many_pages(self):
+        self.put(*[f'p/{i % 3}/{i}' for i in range(2100)])
+        keys = [record.key for record in self.s3.walk(BUCKET, 'p/', shard_depth=0)]
+        self.assertEqual(len(keys), 2100)
+        self.assertEqual(len(set(keys)), 2100)
+
+    def test_walk_stops_early(self):
+        walker = self.s3.walk(BUCKET, '', max_workers=2, shard_depth=2)
+        self.assertIn(next(walker).key, self.keys)
+        walker.close()
@@ -0,0 +1,149 @@
+"""
+Server-side state of the multipart uploads started through b3.
+
+Every multipart upload is recorded as an UploadSession with the fingerprint of
+the uploaded file, so that when the same user uploads the same file to the same
+key again (e.g. after a page reload or a network failure), the upload continues
+from the parts already stored by S3 instead of starting from zero.
+
+Folder uploads in sync mode first diff a manifest of the local files against
+the objects of the target folder, so that only new and changed files are sent.
+"""
+from itertools import chain
+
+from .inventory import hash_str
+from .models import Bucket, UploadSession
+
+
+# Seconds a local modification time may be ahead of the upload time of its
+# object (clock skew) before the file counts as changed
+SYNC_MTIME_TOLERANCE = 2
+
+
+def create_sessions(user, bucket_name, files, uploads):
+    """
+    Record the multipart uploads started for a list of files.
+    Single PUT uploads have nothing to resume and are not recorded.
+    :param user: (User) User uploading the files
+    :param bucket_name: (str) S3 bucket name
+    :param files: (list) Path ('bucket/key'), size and fingerprint of each file
+    :param uploads: (list) Upload plans returned by S3.start_upload, in the same order
+    """
+    bucket = Bucket.objects.filter(name=bucket_name).first()
+    if not bucket or not user.is_authenticated:
+        return
+    sessions = []
+    for _file, upload in zip(files, uploads):
+        if len(_file) < 3 or not _file[2] or not upload['upload_id']:
+            continue
+        key = _file[0][len(bucket_name) + 1:]
+        sessions.append(UploadSession(user=user, bucket=bucket, key=key, key_hash=hash_str(key),
+                                      upload_id=upload['upload_id'], part_size=upload['part_size'],
+                                      file_size=_file[1], fingerprint=_file[2]))
+    UploadSession.objects.bulk_create(sessions)
+
+
+def find_sessions(user, bucket_name, files):
+    """
+    Find the interrupted uploads of a list of files.
+    :param user: (User) User uploading the files
+    :param bucket_name: (str) S3 bucket name
+    :param files: (list) Path ('bucket/key'), size and fingerprint of each file
+    :return: (list) Latest matching UploadSession of each file, or None
+    """
+    keys = [_file[0][len(bucket_name) + 1:] for _file in files]
+    sessions = {}
+    for session in UploadSession.objects.filter(user=user, bucket__name=bucket_name,
+                                                key_hash__in=[hash_str(key) for key in keys]).order_by('created'):
+        sessions[(session.key, session.file_size, session.fingerprint)] = session
+
+    return [sessions.get((key, _file[1], _file[2] if len(_file) > 2 else None)) for key, _file in zip(keys, files)]
+
+
+def get_resume_details(s3, bucket_name, session):
+    """
+    Get what is needed to continue an interrupted upload.
+    :param s3: (S3) S3 handle of the bucket
+    :param bucket_name: (str) S3 bucket name
+    :param session: (UploadSession) Upload session (or None)
+    :return: (dict) Upload ID, part size, number of parts and uploaded parts,
+             or None when the upload can't be resumed
+    """
+    if session is None:
+        return None
+    parts = s3.list_upload_parts(bucket_name, session.key, session.upload_id)
+    if parts is None:
+        return None
+    return {
+        'strategy': 'multipart',
+        'upload_id': session.upload_id,
+        'part_size': session.part_size,
+        'part_count': (session.file_size + session.part_size - 1) // session.part_size,
+        # The last part is the only one allowed to be smaller than the part size
+        'parts': [part for part in parts if part['Size'] == session.part_size
+                  or part['PartNumber'] * session.part_size >= session.file_size],
+        'token': [],
+    }
+
+
+def drop_sessions(upload_ids):
+    """
+    Forget upload sessions, once completed or aborted, or when S3 no longer knows them.
+    :param upload_ids: (list) Upload IDs
+    """
+    UploadSession.objects.filter(upload_id__in=upload_ids).delete()
+
+
+def is_changed(entry, record):
+    """
+    Tell whether a local file differs from its object: by size, by MD5 hash when
+    the manifest has one and the object has a single-part ETag (an MD5 of its
+    content), else by a local modification after the object was uploaded.
+    :param entry: (list) Relative path, size, modification time (ms) and optional MD5 of the file
+    :param record: (ObjectRecord) Object of the file
+    :return: (bool) True if the file needs uploading
+    """
+    if record.size != entry[1]:
+        return True
+    digest = entry[3] if len(entry) > 3 else ''
+    if digest and record.etag and '-' not in record.etag:
+        return digest.lower() != record.etag.lower()
+    return entry[2] / 1000 > record.mtime + SYNC_MTIME_TOLERANCE
+
+
+def diff_manifest(s3, bucket_name, prefix, manifest, find_deletes=False):
+    """
+    Diff the manifest of a folder upload against the objects below the target folder.
+    The folders of the manifest are mirrored: they are listed recursively, and
+    their objects missing from the manifest are the remote deletes. Files at the
+    top of the manifest are only compared with the objects next to them.
+    :param s3: (S3) S3 handle
+    :param bucket_name: (str) S3 bucket name
+    :param prefix: (str) Target folder prefix ('' for the bucket root)
+    :param manifest: (list) Relative path, size, modification time (ms since epoch)
+                     and optional MD5 hex digest of every local file
+    :param find_deletes: (bool) If True, list the objects missing from the manifest
+    :return: (dict) Indexes of the manifest entries to upload, paths ('bucket/key')
+             of the remote deletes and the number of unchanged files
+    """
+    indexes = {prefix + entry[0]: index for index, entry in enumerate(manifest)}
+    roots = sorted({entry[0].split('/', 1)[0] + '/' for entry in manifest if '/' in entry[0]})
+    records = {}
+    deletes = []
+
+    for record in chain.from_iterable(s3.walk(bucket_name, prefix + root) for root in roots):
+        index = indexes.get(record.key)
+        if index is not None:
+            records[index] = record
+        elif find_deletes and not record.key.endswith('/'):
+            deletes.append(f'{bucket_name}/{record.key}')
+
+    if any('/' not in entry[0] for entry in manifest):
+        for record in s3.iter_objects(bucket_name, prefix, '/'):
+            index = indexes.get(record.key)
+            if index is not None:
+                records[index] = record
+
+    upload = [index for index, entry in enumerate(manifest)
+              if index not in records or is_changed(entry, records[index])]
+    return {'upload': upload, 'delete': sorted(deletes), 'unchanged': len(manifest) - len(upload)}
@@ -1,15 +1,31 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import views, async_views
 
 app_name = 'browser'
 
+# The S3-bound views have async versions for ASGI deployments
+s3_views = async_views if getattr(settings, 'B3_ASYNC_VIEWS', False) else views
+
 urlpatterns = [
     path('', views.index, name='index'),
-    path('expanddir/', views.expandDir, name='expanddir'),
-    path('listdir/', views.listDir, name='listdir'),
-    path('download/', views.download, name='download'),
-    path('startupload/', views.start_upload, name='start_upload'),
-    path('finishupload/', views.finish_upload, name='finish_upload'),
-    path('delete/', views.delete, name='delete'),
+    path('expanddir/', s3_views.expandDir, name='expanddir'),
+    path('listdir/', s3_views.listDir, name='listdir'),
+    path('download/', s3_views.download, name='download'),
+    path('obj/<str:bucket>/<path:key>', s3_views.get_object, name='get_object'),
+    path('downloadzip/', s3_views.download_zip, name='download_zip'),
+    path('startupload/', s3_views.start_upload, name='start_upload'),
+    path('syncupload/', s3_views.sync_upload, name='sync_upload'),
+    path('uploadpolicy/', s3_views.upload_policy, name='upload_policy'),
+    path('resumeupload/', s3_views.resume_upload, name='resume_upload'),
+    path('uploadparts/', s3_views.upload_parts, name='upload_parts'),
+    path('finishupload/', s3_views.finish_upload, name='finish_upload'),
+    path('delete/', s3_views.delete, name='delete'),
+    path('jobs/', views.job_list, name='job_list'),
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('jobs/<int:job_id>/cancel/', views.cancel_job, name='cancel_job'),
+    path('jobs/<int:job_id>/output/', s3_views.job_output, name='job_output'),
+    path('search/', views.search, name='search'),
+    path('cachestats/', views.cache_stats, name='cache_stats'),
 ]
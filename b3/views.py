@@ -1,88 +1,257 @@
 import os
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET
 import json
+import logging
 from .s3 import *
 from pathlib import Path
-import pytz
+from datetime import datetime, time
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Bucket, Job
+from .cache import listing_cache, url_cache
+from .metrics import registry, timed
+from . import inventory, jobs, uploads
+from .services import get_s3_handle, record_upload, record_policy_uploads, record_delete, get_folder_rollups
+from .archive import iter_zip
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of part URLs issued by a single uploadparts/ request
+MAX_PART_WINDOW = 1000
+
+# Recent jobs listed by jobs/
+JOB_LIST_SIZE = 20
+
+# Largest syncupload/ request, in bytes (a manifest holds about 100 bytes per file)
+SYNC_MAX_MANIFEST_SIZE = 64 * 1024 * 1024
+
+def get_resume_details(s3, bucket_name, sessions):
+    return [uploads.get_resume_details(s3, bucket_name, session) for session in sessions]
+
+
+def forget_stale_sessions(sessions, details):
+    # Sessions S3 no longer knows (completed, aborted or expired) can't be resumed
+    uploads.drop_sessions([session.upload_id for session, detail in zip(sessions, details)
+                           if session and detail is None])
+
+
+def check_upload_sizes(file_list):
+    # Reject the whole request before any upload is started
+    for _file in file_list:
+        plan_upload(_file[1])
+
+
+def iter_upload_plans(user, s3, bucket_name, file_list, part_window, concurrency):
+    """
+    Start the uploads of many files and stream their plans as NDJSON lines,
+    each tagged with the index of its file, as soon as they are ready.
+    :return: (generator) NDJSON lines
+    """
+    try:
+        for index, plan in s3.iter_start_upload(file_list, part_window, concurrency):
+            uploads.create_sessions(user, bucket_name, [file_list[index]], [plan])
+            yield json.dumps({'index': index, **plan}) + '\n'
+    except Exception as e:
+        logger.exception('Error streaming a response')
+        yield json.dumps({'error': str(e)}) + '\n'
+
+
+def iter_signed_urls(s3, folder_list, file_list, method, file_sizes=None):
+    """
+    Stream the download manifest of the selected folders and files as NDJSON
+    lines, while the folders are still being walked.
+    :return: (generator) NDJSON lines
+    """
+    try:
+        for entry in s3.iter_signed_urls(folder_list, file_list, method, file_sizes=file_sizes):
+            yield json.dumps(entry) + '\n'
+    except Exception as e:
+        logger.exception('Error streaming a response')
+        yield json.dumps({'error': str(e)}) + '\n'
+
+
+def get_file_sizes(post_data, file_list):
+    # Sizes of the selected files known from the listing, which spare a HEAD request per file
+    sizes = json.loads(post_data.get('file_sizes') or 'null')
+    if not isinstance(sizes, list) or len(sizes) != len(file_list):
+        return None
+    return [size if isinstance(size, int) and size >= 0 else None for size in sizes]
 
-from .models import Bucket
 
-def get_s3_handle(bucket_name):
-    bucket = Bucket.objects.filter(name=bucket_name).first()
-    if not bucket:
-        return None
-    return S3((bucket.key_id, bucket.get_decrypted_secret_key()), bucket.service, bucket.region, bucket.name)
+def object_redirect(url, expires_in):
+    """
+    Redirect to a presigned URL. Browsers may reuse the redirect as long as the
+    URL stays valid for at least the refresh margin of the URL cache.
+    :param url: (str) Presigned URL
+    :param expires_in: (int) Seconds the URL stays valid
+    :return: (HttpResponseRedirect) Redirect response
+    """
+    response = HttpResponseRedirect(url)
+    response['Cache-Control'] = f'private, max-age={max(expires_in - url_cache.config["REFRESH_MARGIN"], 0)}'
+    return response
 
 
+def get_rollup_str(rollup):
+    return f'{rollup["count"]} objects, {get_filesize_str(rollup["size"], 2)}'
 
-def build_dir_tree(bucket_name, dir_name=''):
-    html_str = ''
-    s3 = get_s3_handle(bucket_name)
-    if not s3:
-        return html_str
-    dir_list, _ = s3.get_object_list(bucket_name, dir_name, '/')
-    if dir_list:
-        html_str += f'<ul class="dir_children">'
-        for sub_dir in dir_list:
-            html_str += (f'<li><button onclick="onCaret(this, \'{bucket_name}\', \'{sub_dir}\')"  '
-                         f'class="caret" id="caret_{sub_dir}"></button>'
-                         f'<button onclick="onFolder(\'{bucket_name}\', \'{sub_dir}\')"'
-                         f' class="dir_node" id="{bucket_name}_{sub_dir}">{Path(sub_dir).name}</button></li>\n')
-        html_str += f'</ul>'
-    return html_str
 
-def convert_to_user_timezone(date_str, timezone):
-    tz = pytz.timezone(timezone)
-    dt_userzone = date_str.replace(tzinfo=pytz.utc).astimezone(tz)
-    return dt_userzone.strftime('%Y-%m-%d %H:%M:%S')
+def add_folder_rollups(bucket_name, contents):
+    """
+    Add the recursive size and object count of the folders of a listing page
+    (None for the folders without a rollup).
+    :param bucket_name: (str) S3 bucket name
+    :param contents: (dict) Listing page built by build_dir_contents
+    """
+    prefixes = [f'{contents["prefix"]}{folder}/' for folder in contents['folders']]
+    rollups = get_folder_rollups(bucket_name, prefixes) if prefixes else {}
+    contents['folder_sizes'] = [rollups.get(prefix, {}).get('size') for prefix in prefixes]
+    contents['folder_counts'] = [rollups.get(prefix, {}).get('count') for prefix in prefixes]
 
 
-def build_dir_contents(bucket_name, dir_name='', timezone=''):
-    html_str = ''
-    s3 = get_s3_handle(bucket_name)
+def build_dir_tree(s3, bucket_name, dir_name='', rollups=None):
     if not s3:
-        return html_str
-    folders, files = s3.get_object_list(bucket_name, dir_name, '/')
-    html_str += '<table id="file_table">'
-
-    html_str += '<tr>'
-    html_str += '<th>Name</th>'
-    html_str += '<th>Size</th>'
-    html_str += '<th>LastModified</th>'
-    html_str += '</tr>'
-
-    if dir_name != '':
-        prev_folder = Path(dir_name).parent.as_posix() + '/'
-        prev_folder = '' if prev_folder == './' else prev_folder
-
-        html_str += '<tr>'
-        html_str += (f'<td><span class="folder_list" onclick="onFolder(\'{bucket_name}\', \'{prev_folder}\')">'
-                     f'..</span></td>')
-        html_str += f'<td></td>'
-        html_str += f'<td></td>'
-        html_str += '</tr>'
-
-    for folder in folders:
-        html_str += '<tr>'
-        html_str += (f'<td class="td_folder" id="{bucket_name}/{folder}"><input type="checkbox" /><span class="folder_list" onclick="onFolder(\'{bucket_name}\', \'{folder}\')">'
-                     f'{Path(folder).name}</span></td>')
-        html_str += f'<td></td>'
-        html_str += f'<td></td>'
-        html_str += '</tr>'
+        return ''
+    return render_dir_tree(bucket_name, dir_name, {dir_name: s3.get_subfolders(bucket_name, dir_name)}, rollups)
+
+def render_dir_tree(bucket_name, dir_name, tree, rollups=None, collapsed=False):
+    """
+    Render the folder tree below a folder. The folders listed in `tree` are nested
+    in their parent, collapsed, so that expanding them needs no request.
+    :param bucket_name: (str) S3 bucket name
+    :param dir_name: (str) Folder prefix
+    :param tree: (dict) Sub-folders of every listed folder (see S3.get_folder_tree)
+    :param rollups: (dict) Folder rollups (optional)
+    :param collapsed: (bool) True for the nested folders
+    :return: (str) HTML of the folder tree
+    """
+    dir_list = tree.get(dir_name, [])
+    if not dir_list and not collapsed:
+        return ''
+    html_str = f'<ul class="dir_children li_close">' if collapsed else f'<ul class="dir_children">'
+    for sub_dir in dir_list:
+        rollup = (rollups or {}).get(sub_dir)
+        stats = f'<span class="dir_stats">{rollup["count"]}</span>' if rollup else ''
+        title = f' title="{get_rollup_str(rollup)}"' if rollup else ''
+        children = render_dir_tree(bucket_name, sub_dir, tree, rollups, True) if sub_dir in tree else ''
+        html_str += (f'<li><button onclick="onCaret(this, \'{bucket_name}\', \'{sub_dir}\')"  '
+                     f'class="caret" id="caret_{sub_dir}"></button>'
+                     f'<button onclick="onFolder(\'{bucket_name}\', \'{sub_dir}\')"'
+                     f' class="dir_node" id="{bucket_name}_{sub_dir}"{title}>{Path(sub_dir).name}</button>'
+                     f'{children}{stats}</li>\n')
+    html_str += f'</ul>'
+    return html_str
 
+def expand_dir_tree(s3, bucket_name, prefixes, depth):
+    """
+    List the folder trees below several folders, and prefetch the level below
+    them in the background so that expanding it later is served from the listing cache.
+    :param s3: (S3) S3 handle
+    :param bucket_name: (str) S3 bucket name
+    :param prefixes: (list) Folder prefixes
+    :param depth: (int) Number of levels listed
+    :return: (dict) Sub-folders of every listed folder
+    """
+    if not s3:
+        return {}
+    tree, next_level = s3.get_folder_tree(bucket_name, prefixes, depth)
+    s3.prefetch_subfolders(bucket_name, next_level)
+    return tree
+
+def get_tree_rollups(bucket_name, tree):
+    prefixes = [folder for folders in tree.values() for folder in folders]
+    return get_folder_rollups(bucket_name, prefixes) if prefixes else {}
+
+def get_expand_request(post_data):
+    # Folders expanded at once and number of levels listed below them
+    prefixes = [prefix or '' for prefix in post_data.get('prefixes') or []][:EXPAND_MAX_PREFIXES]
+    return prefixes, int(post_data.get('depth') or 1)
+
+def build_dir_contents(s3, bucket_name, dir_name='', cursor=None):
+    """
+    Build one page of a folder listing as a compact columnar payload.
+    Names are relative to the folder, sizes are integers and modification
+    times are POSIX timestamps; formatting is left to the browser.
+    :return: (dict) Listing page and the cursor of the next page (None on the last page)
+    """
+    contents = {'prefix': dir_name, 'folders': [], 'names': [], 'sizes': [], 'mtimes': [], 'cursor': None}
+    if not s3:
+        return contents
+    folders, files, next_cursor = s3.get_object_page(bucket_name, dir_name, '/', cursor)
 
+    offset = len(dir_name)
+    contents['folders'] = [folder[offset:-1] for folder in folders]
     for file in files:
-        html_str += '<tr>'
-        html_str += f'<td class="td_file" id="{bucket_name}/{file["name"]}"><input type="checkbox"/><span class="file_list">{Path(file["name"]).name}<span></td>'
-        html_str += f'<td>{file["size"]}</td>'
-        html_str += f'<td>{convert_to_user_timezone(file["date"], timezone)}</td>'
-        html_str += '</tr>'
-
-    html_str += '</table>'
-
-    return html_str
+        if file.key == dir_name:
+            continue
+        contents['names'].append(file.key[offset:])
+        contents['sizes'].append(file.size)
+        contents['mtimes'].append(int(file.mtime))
+    contents['cursor'] = next_cursor
+
+    return contents
+
+def parse_search_date(value, end_of_day=False):
+    # Accept both dates (YYYY-MM-DD) and ISO datetimes, in the server timezone when naive
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f'Invalid date: {value}')
+        parsed = datetime.combine(date, time.max if end_of_day else time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def search_objects(bucket_name, post_data):
+    """
+    Run a search request against the inventory of a bucket.
+    :param bucket_name: (str) S3 bucket name
+    :param post_data: (dict) Search query, mode, folder prefix, filters and cursor
+    :return: (dict) Page of results as a compact columnar payload
+    """
+    if not inventory.has_inventory(bucket_name):
+        return f'error {bucket_name} is not indexed, run "manage.py b3sync {bucket_name}" first'
+
+    def get_int(name):
+        value = post_data.get(name)
+        return int(value) if value not in (None, '') else None
+
+    cursor = post_data.get('cursor')
+    if cursor is not None and not isinstance(cursor, dict):
+        return 'error invalid search cursor'
+
+    try:
+        result = inventory.search(
+            bucket_name,
+            post_data.get('query', ''),
+            mode=post_data.get('mode', 'substring'),
+            prefix=post_data.get('dir_path', ''),
+            min_size=get_int('min_size'),
+            max_size=get_int('max_size'),
+            modified_after=parse_search_date(post_data.get('modified_after')),
+            modified_before=parse_search_date(post_data.get('modified_before'), end_of_day=True),
+            cursor=cursor,
+            page_size=get_int('page_size') or 100,
+        )
+    except ValueError as e:
+        return f'error {e}'
+
+    return {
+        'keys': [item.key for item in result['items']],
+        'sizes': [item.size for item in result['items']],
+        'mtimes': [int(item.mtime) for item in result['items']],
+        'cursor': result['cursor'],
+    }
 
 @login_required(login_url='/')
 def index(request):
@@ -93,11 +262,14 @@ def index(request):
 
     html_tag = f'<ul>'
     for bucket_name in buckets:
+        # Bucket totals, for buckets with an inventory
+        rollup = get_folder_rollups(bucket_name, ['']).get('')
+        stats = f'<span class="dir_stats">{get_rollup_str(rollup)}</span>' if rollup else ''
         html_tag += (f'<li>'
                      f'<button onclick="onCaret(this, \'{bucket_name}\', \'\')" '
                      f'class="caret"></button>'
                      f'<button onclick="onFolder(\'{bucket_name}\', \'\')"'
-                     f' class="bucket" id="{bucket_name}_"> {bucket_name}</button>'
+                     f' class="bucket" id="{bucket_name}_"> {bucket_name}</button>{stats}'
                      f'</li>')
 
     html_tag += '</ul>'
@@ -106,30 +278,44 @@ def index(request):
         'file_list': f'<table><tr><th>Name</th><th>Size</th><th>LastModified</th></tr></table>',
         'current_address': '',
     }
-    return render(request, 'b3/index.html', context)
+    with timed('render'):
+        return render(request, 'b3/index.html', context)
 
 @login_required(login_url='/')
 def expandDir(request):
 
     if request.method == 'POST':
         post_data = json.loads(request.body.decode('utf-8'))
-        dir_path = post_data.get('dir_path')
         bucket_name = post_data.get('bucket_name')
-        html_str = build_dir_tree(bucket_name, dir_path)
-        return HttpResponse(json.dumps({'result': html_str}), content_type='application/json')
+        if 'prefixes' not in post_data:
+            dir_path = post_data.get('dir_path')
+            rollups = get_folder_rollups(bucket_name, parent=dir_path)
+            html_str = build_dir_tree(get_s3_handle(bucket_name), bucket_name, dir_path, rollups)
+            return HttpResponse(json.dumps({'result': html_str}), content_type='application/json')
+
+        prefixes, depth = get_expand_request(post_data)
+        tree = expand_dir_tree(get_s3_handle(bucket_name), bucket_name, prefixes, depth)
+        rollups = get_tree_rollups(bucket_name, tree)
+        with timed('render'):
+            result = {prefix: render_dir_tree(bucket_name, prefix, tree, rollups) for prefix in prefixes}
+        return HttpResponse(json.dumps({'result': result}), content_type='application/json')
     else:
         return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
 
 @login_required(login_url='/')
+@gzip_page
 def listDir(request):
 
     if request.method == 'POST':
         post_data = json.loads(request.body.decode('utf-8'))
         dir_path = post_data.get('dir_path')
         bucket_name = post_data.get('bucket_name')
-        timezone = post_data.get('timezone')
-        html_str = build_dir_contents(bucket_name, dir_path, timezone)
-        return HttpResponse(json.dumps({'result': html_str}), content_type='application/json')
+        cursor = post_data.get('cursor')
+        contents = build_dir_contents(get_s3_handle(bucket_name), bucket_name, dir_path, cursor)
+        add_folder_rollups(bucket_name, contents)
+        with timed('render'):
+            body = json.dumps({'result': contents}, separators=(',', ':'))
+        return HttpResponse(body, content_type='application/json')
     else:
         return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
     
@@ -145,17 +331,58 @@ def download(request):
         file_list = json.loads(post_data.get('file_list'))
 
         method = post_data.get('method')
+        file_sizes = get_file_sizes(post_data, file_list)
 
         s3 = get_s3_handle(bucket)
         if not s3:
             return HttpResponse(json.dumps({'result': f'error {bucket} not found'}), content_type='application/json')
         
-        response = s3.get_signed_url(folder_list, file_list, method)
+        return StreamingHttpResponse(iter_signed_urls(s3, folder_list, file_list, method, file_sizes),
+                                     content_type='application/x-ndjson')
+    else:
+        return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
 
-        #response = "testing"
-   
+@require_GET
+@login_required(login_url='/')
+def get_object(request, bucket, key):
+    # Stable link to an object (for previews, scripts, repeat downloads),
+    # redirected to a presigned URL taken from the URL cache
 
-        return HttpResponse(json.dumps({'result': response}), content_type='application/json')
+    s3 = get_s3_handle(bucket)
+    if not s3:
+        raise Http404(f'{bucket} not found')
+
+    return object_redirect(*s3.get_object_url(bucket, key))
+
+def get_zip_selection(s3, bucket, folder_list, file_list):
+    """
+    Keep the selected objects of the requested bucket, the only ones that can be
+    archived with its credentials, and name the archive.
+    :return: (tuple) Folder paths, file paths and archive name
+    """
+    folder_list = [folder for folder in folder_list if s3.parse_obj_path(folder)[0] == bucket]
+    file_list = [_file for _file in file_list if s3.parse_obj_path(_file)[0] == bucket]
+    selected = folder_list + file_list
+    archive_name = Path(selected[0]).name if len(selected) == 1 and folder_list else bucket
+    return folder_list, file_list, archive_name.replace('"', '')
+
+@login_required(login_url='/')
+def download_zip(request):
+    # Posted by a form so that the browser saves the streamed archive itself
+
+    if request.method == 'POST':
+        bucket = request.POST.get('bucket')
+        folder_list = json.loads(request.POST.get('folder_list', '[]'))
+        file_list = json.loads(request.POST.get('file_list', '[]'))
+
+        s3 = get_s3_handle(bucket)
+        if not s3:
+            return HttpResponse(json.dumps({'result': f'error {bucket} not found'}), content_type='application/json')
+
+        folder_list, file_list, archive_name = get_zip_selection(s3, bucket, folder_list, file_list)
+        response = StreamingHttpResponse(iter_zip(s3, folder_list, file_list), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{archive_name}.zip"'
+        return response
     else:
         return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
 
@@ -165,18 +392,137 @@ def start_upload(request):
         post_data = json.loads(request.body.decode('utf-8'))
         bucket = post_data.get('bucket')
         file_list = json.loads(post_data.get('file_list'))
-        chunk_size = post_data.get('chunk_size')
+        part_window = post_data.get('part_window')
+        concurrency = post_data.get('concurrency')
 
         s3 = get_s3_handle(bucket)
         if not s3:
             return HttpResponse(json.dumps({'result': f'error {bucket} not found'}), content_type='application/json')
 
-        response = s3.start_upload(file_list, chunk_size)
+        try:
+            check_upload_sizes(file_list)
+        except ValueError as e:
+            return HttpResponse(json.dumps({'result': f'error {e}'}), content_type='application/json')
 
-        return HttpResponse(json.dumps({'result': response}), content_type='application/json')
+        return StreamingHttpResponse(iter_upload_plans(request.user, s3, bucket, file_list, part_window, concurrency),
+                                     content_type='application/x-ndjson')
     else:
         return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
     
+def read_sync_request(request):
+    """
+    Read a syncupload/ request. Manifests of large folders exceed
+    DATA_UPLOAD_MAX_MEMORY_SIZE, which only applies to request.body, so the
+    request is read as a stream with its own limit.
+    :return: (tuple) Bucket name, target folder prefix, manifest and whether remote deletes are wanted
+    """
+    if int(request.META.get('CONTENT_LENGTH') or 0) > SYNC_MAX_MANIFEST_SIZE:
+        raise ValueError(f'manifest larger than {SYNC_MAX_MANIFEST_SIZE} bytes')
+    post_data = json.load(request)
+    manifest = json.loads(post_data.get('manifest', '[]'))
+    return post_data.get('bucket'), post_data.get('prefix', ''), manifest, bool(post_data.get('delete'))
+
+@login_required(login_url='/')
+def sync_upload(request):
+    # Files of a folder upload that are new or changed, so that re-uploads only send the difference
+    if request.method == 'POST':
+        try:
+            bucket, prefix, manifest, find_deletes = read_sync_request(request)
+        except ValueError as e:
+            return HttpResponse(json.dumps({'result': f'error {e}'}), content_type='application/json')
+
+        s3 = get_s3_handle(bucket)
+        if not s3:
+            return HttpResponse(json.dumps({'result': f'error {bucket} not found'}), content_type='application/json')
+
+        response = uploads.diff_manifest(s3, bucket, prefix, manifest, find_deletes)
+        return HttpResponse(json.dumps({'result': response}, separators=(',', ':')), content_type='application/json')
+    else:
+        return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
+
+@login_required(login_url='/')
+def upload_policy(request):
+    # 'create' issues a POST policy for a folder, 'complete' reports the files uploaded with it
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        operation = post_data.get('operation')
+        bucket = post_data.get('bucket')
+        prefix = post_data.get('prefix', '')
+
+        s3 = get_s3_handle(bucket)
+        if not s3:
+            return HttpResponse(json.dumps({'result': f'error {bucket} not found'}), content_type='application/json')
+
+        response = None
+        if operation == 'create':
+            response = s3.generate_upload_policy(bucket, prefix)
+
+        elif operation == 'complete':
+            keys = [key for key in json.loads(post_data.get('keys', '[]')) if key.startswith(prefix)]
+            record_policy_uploads(s3, bucket, keys)
+            response = 'ok'
+
+        return HttpResponse(json.dumps({'result': response}), content_type='application/json')
+    else:
+        return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
+
+@login_required(login_url='/')
+def resume_upload(request):
+    # Uploaded parts of the interrupted uploads of the given files (None for the others)
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        bucket = post_data.get('bucket')
+        file_list = json.loads(post_data.get('file_list'))
+
+        s3 = get_s3_handle(bucket)
+        if not s3:
+            return HttpResponse(json.dumps({'result': f'error {bucket} not found'}), content_type='application/json')
+
+        sessions = uploads.find_sessions(request.user, bucket, file_list)
+        response = get_resume_details(s3, bucket, sessions)
+        forget_stale_sessions(sessions, response)
+
+        return HttpResponse(json.dumps({'result': response}), content_type='application/json')
+    else:
+        return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
+
+def get_part_window(post_data):
+    """
+    Read the window of part URLs asked by an uploadparts/ request.
+    :param post_data: (dict) Request data with the first_part and count of the window
+    :return: (tuple) First part number and number of parts (at most MAX_PART_WINDOW)
+    """
+    try:
+        first_part = int(post_data.get('first_part'))
+        count = int(post_data.get('count'))
+    except (TypeError, ValueError):
+        raise ValueError('first_part and count must be integers')
+    if first_part < 1 or count < 1:
+        raise ValueError('first_part and count must be positive')
+    return first_part, min(count, MAX_PART_WINDOW)
+
+@login_required(login_url='/')
+def upload_parts(request):
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        bucket = post_data.get('bucket')
+        key = post_data.get('object_path')
+        upload_id = post_data.get('upload_id')
+        try:
+            first_part, count = get_part_window(post_data)
+        except ValueError as e:
+            return HttpResponse(json.dumps({'result': f'error {e}'}), content_type='application/json')
+
+        s3 = get_s3_handle(bucket)
+        if not s3:
+            return HttpResponse(json.dumps({'result': f'error {bucket} not found'}), content_type='application/json')
+
+        response = s3.get_part_urls(bucket, key, upload_id, first_part, count)
+
+        return HttpResponse(json.dumps({'result': response}), content_type='application/json')
+    else:
+        return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
+
 @login_required(login_url='/')
 def finish_upload(request):
 
@@ -193,7 +539,9 @@ def finish_upload(request):
             return HttpResponse(json.dumps({'result': f'error {bucket} not found'}), content_type='application/json')
 
 
-        s3.complete_upload(bucket, key, upload_id, upload_parts)
+        if s3.complete_upload(bucket, key, upload_id, upload_parts):
+            record_upload(s3, bucket, key)
+        uploads.drop_sessions([upload_id])
 
         return HttpResponse(json.dumps({'result': 'ok'}), content_type='application/json')
     else:
@@ -219,11 +567,99 @@ def delete(request):
             response = s3.prepare_delete(folder_list, file_list)
 
         elif operation == 'initiate':
-            delete_list = json.loads(post_data.get('delete_list'))
-            print(delete_list)
-            response = s3.initiate_delete(delete_list)
+            delete_list = json.loads(post_data.get('delete_list', '[]'))
+            folder_list = json.loads(post_data.get('folder_list', '[]'))
+            response = s3.initiate_delete(delete_list, folder_list)
+            record_delete(s3, bucket, folder_list, delete_list, response)
 
 
         return HttpResponse(json.dumps({'result': response}), content_type='application/json')
     else:
-        return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
\ No newline at end of file
+        return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
+
+def get_user_job(request, job_id):
+    # Users see their own jobs, staff users every job
+    job_list = Job.objects.select_related('bucket')
+    if not request.user.is_staff:
+        job_list = job_list.filter(user=request.user)
+    try:
+        return job_list.get(pk=job_id)
+    except Job.DoesNotExist:
+        raise Http404(f'Job {job_id} not found')
+
+@login_required(login_url='/')
+def job_list(request):
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        bucket_name = post_data.get('bucket')
+        bucket = Bucket.objects.filter(name=bucket_name).first()
+        if not bucket:
+            return HttpResponse(json.dumps({'result': f'error {bucket_name} not found'}), content_type='application/json')
+
+        params = {
+            'folder_list': json.loads(post_data.get('folder_list', '[]')),
+            'file_list': json.loads(post_data.get('file_list', '[]')),
+        }
+        if post_data.get('method'):
+            params['method'] = post_data.get('method')
+        try:
+            job = jobs.submit_job(request.user, bucket, post_data.get('kind'), params)
+        except ValueError as e:
+            return HttpResponse(json.dumps({'result': f'error {e}'}), content_type='application/json')
+        return HttpResponse(json.dumps({'result': jobs.get_job_dict(job)}), content_type='application/json')
+    else:
+        recent = Job.objects.filter(user=request.user).select_related('bucket').order_by('-created')[:JOB_LIST_SIZE]
+        response = [jobs.get_job_dict(job) for job in recent]
+        return HttpResponse(json.dumps({'result': response}), content_type='application/json')
+
+@require_GET
+@login_required(login_url='/')
+def job_status(request, job_id):
+    job = get_user_job(request, job_id)
+    return HttpResponse(json.dumps({'result': jobs.get_job_dict(job)}), content_type='application/json')
+
+@login_required(login_url='/')
+def cancel_job(request, job_id):
+
+    if request.method == 'POST':
+        job = get_user_job(request, job_id)
+        jobs.cancel_job(job)
+        job.refresh_from_db()
+        return HttpResponse(json.dumps({'result': jobs.get_job_dict(job)}), content_type='application/json')
+    else:
+        return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
+
+@require_GET
+@login_required(login_url='/')
+def job_output(request, job_id):
+    # NDJSON output of a finished job, e.g. the entries of a 'sign' job in the download/ format
+    job = get_user_job(request, job_id)
+    if job.status != 'done':
+        return HttpResponse(json.dumps({'result': f'error job {job_id} is {job.status}'}),
+                            content_type='application/json')
+    chunks = job.outputs.order_by('index').values_list('data', flat=True).iterator()
+    return StreamingHttpResponse(chunks, content_type='application/x-ndjson')
+
+@login_required(login_url='/')
+@gzip_page
+def search(request):
+
+    if request.method == 'POST':
+        post_data = json.loads(request.body.decode('utf-8'))
+        bucket_name = post_data.get('bucket_name')
+        response = search_objects(bucket_name, post_data)
+        return HttpResponse(json.dumps({'result': response}, separators=(',', ':')), content_type='application/json')
+    else:
+        return HttpResponse(json.dumps({'result': 'error'}), content_type='application/json')
+
+def metrics(request):
+    # Prometheus scrapes with the B3_METRICS_TOKEN bearer token, staff users can look with their session
+    token = getattr(settings, 'B3_METRICS_TOKEN', '')
+    if not (request.user.is_staff or (token and request.headers.get('Authorization') == f'Bearer {token}')):
+        return HttpResponse(status=403)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required(login_url='/')
+def cache_stats(request):
+    stats = {**listing_cache.stats(), 'presigned_urls': url_cache.stats()}
+    return HttpResponse(json.dumps({'result': stats}), content_type='application/json')
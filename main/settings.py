@@ -58,10 +58,12 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    'b3.middleware.ServerTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'b3.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -153,6 +155,109 @@ STORAGES = {
     },
 }
 
+# b3 listing cache
+# BACKEND 'local' keeps listings per worker process, 'django' shares them
+# through the cache ALIAS configured in CACHES (e.g. redis or memcached)
+
+B3_LISTING_CACHE = {
+    'BACKEND': os.getenv('B3_LISTING_CACHE_BACKEND', 'local'),
+    'ALIAS': os.getenv('B3_LISTING_CACHE_ALIAS', 'default'),
+    'TTL': int(os.getenv('B3_LISTING_CACHE_TTL', '60')),
+    'MAX_ENTRIES': int(os.getenv('B3_LISTING_CACHE_MAX_ENTRIES', '2048')),
+}
+
+# b3 presigned URLs
+# Every presigned URL is valid for EXPIRY seconds; GET URLs are cached per
+# process and reused until they have less than REFRESH_MARGIN seconds left
+
+B3_PRESIGNED_URLS = {
+    'EXPIRY': int(os.getenv('B3_PRESIGNED_URL_EXPIRY', '3600')),
+    'REFRESH_MARGIN': int(os.getenv('B3_PRESIGNED_URL_REFRESH_MARGIN', '600')),
+    'MAX_ENTRIES': int(os.getenv('B3_PRESIGNED_URL_MAX_ENTRIES', '4096')),
+}
+
+# b3 S3 clients
+# Clients are shared per process; these tune their connection pools
+
+B3_S3_CLIENT = {
+    'MAX_POOL_CONNECTIONS': int(os.getenv('B3_S3_MAX_POOL_CONNECTIONS', '50')),
+    'CONNECT_TIMEOUT': int(os.getenv('B3_S3_CONNECT_TIMEOUT', '5')),
+    'READ_TIMEOUT': int(os.getenv('B3_S3_READ_TIMEOUT', '60')),
+    'TCP_KEEPALIVE': True,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_MODE': 'standard',
+    'REGISTRY_TTL': int(os.getenv('B3_S3_REGISTRY_TTL', '300')),
+}
+
+# b3 uploads
+# Files below SINGLE_PUT_THRESHOLD bytes take a single PUT; larger files use
+# multipart uploads whose parts grow with the file size (see s3.plan_upload)
+
+B3_UPLOAD = {
+    'SINGLE_PUT_THRESHOLD': int(os.getenv('B3_UPLOAD_SINGLE_PUT_THRESHOLD', str(16 * 1024 * 1024))),
+    'MIN_PART_SIZE': int(os.getenv('B3_UPLOAD_MIN_PART_SIZE', str(8 * 1024 * 1024))),
+    'TARGET_PARTS': int(os.getenv('B3_UPLOAD_TARGET_PARTS', '1000')),
+    'CONCURRENCY': 5,
+    'POLICY_EXPIRY': int(os.getenv('B3_UPLOAD_POLICY_EXPIRY', '3600')),
+}
+
+# b3 ZIP downloads
+# Objects are read in CHUNK_SIZE ranges by MAX_WORKERS threads, with at most
+# PREFETCH_CHUNKS ranges in memory per download
+
+B3_ZIP_DOWNLOAD = {
+    'CHUNK_SIZE': int(os.getenv('B3_ZIP_CHUNK_SIZE', str(4 * 1024 * 1024))),
+    'MAX_WORKERS': int(os.getenv('B3_ZIP_MAX_WORKERS', '4')),
+    'PREFETCH_CHUNKS': int(os.getenv('B3_ZIP_PREFETCH_CHUNKS', '8')),
+}
+
+# b3 server mode
+# 'asgi' serves the S3-bound views asynchronously through main.asgi (see startup.sh),
+# with blocking S3 calls running on a pool of B3_ASYNC_S3_WORKERS threads per process
+
+B3_ASYNC_VIEWS = os.getenv('B3_SERVER', 'wsgi') == 'asgi'
+B3_ASYNC_S3_WORKERS = int(os.getenv('B3_ASYNC_S3_WORKERS', '32'))
+
+# b3 metrics
+# Prometheus metrics are served per process at /metrics to staff users, or to
+# scrapers sending "Authorization: Bearer <B3_METRICS_TOKEN>"
+
+B3_METRICS_TOKEN = os.getenv('B3_METRICS_TOKEN', '')
+
+# b3 profiling
+# Staff users profile a request with the X-B3-Profile header or the b3profile
+# query parameter; SAMPLE_RATE profiles a fraction of all requests.
+# Profiles are browsed in the admin site (Request profiles)
+
+B3_PROFILING = {
+    'SAMPLE_RATE': float(os.getenv('B3_PROFILE_SAMPLE_RATE', '0')),
+    'MAX_PROFILES': int(os.getenv('B3_PROFILE_MAX_PROFILES', '200')),
+}
+
+# b3 background jobs
+# Large deletes and signings run as jobs on WORKERS threads, in every web process
+# (RUNNER 'thread') or in a "manage.py b3jobs" worker (RUNNER 'process', see startup.sh).
+# Jobs whose runner stopped for STALE_AFTER seconds resume from their last checkpoint
+
+B3_JOBS = {
+    'RUNNER': os.getenv('B3_JOBS_RUNNER', 'thread'),
+    'WORKERS': int(os.getenv('B3_JOBS_WORKERS', '2')),
+    'POLL_INTERVAL': 2,
+    'STALE_AFTER': int(os.getenv('B3_JOBS_STALE_AFTER', '60')),
+    'KEEP_DAYS': 7,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'b3': {'handlers': ['console'], 'level': os.getenv('B3_LOG_LEVEL', 'INFO')},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
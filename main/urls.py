@@ -18,9 +18,12 @@ from django.contrib import admin
 from django.contrib.auth import views as auth_views
 from django.urls import path, include
 
+from b3 import views as b3_views
+
 urlpatterns = [
     path('', auth_views.LoginView.as_view(template_name='registration/login.html'), name='login'),
     path('admin/', admin.site.urls),
     path('b3/', include('b3.urls')),
+    path('metrics', b3_views.metrics, name='metrics'),
     path('success/', include('b3.urls', namespace='success')),
 ]
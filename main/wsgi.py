@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings')
 
 application = get_wsgi_application()
+
+# Background jobs run in the web processes (B3_JOBS_RUNNER=thread), and jobs
+# interrupted by a restart resume as soon as the process is up
+from b3.jobs import start_runner  # noqa: E402
+
+start_runner()
@@ -16,8 +16,22 @@ if [ $exit_code -ne 0 ]; then
 fi
 }
 
+# B3_SERVER=asgi runs the async views on uvicorn workers,
+# so that each worker can serve many concurrent requests
+start_server() {
+# B3_JOBS_RUNNER=process runs the background jobs in their own process
+if [ "$B3_JOBS_RUNNER" = "process" ]; then
+    python3 manage.py b3jobs &
+fi
+if [ "$B3_SERVER" = "asgi" ]; then
+    gunicorn --workers 2 --worker-class uvicorn_worker.UvicornWorker main.asgi
+else
+    gunicorn --workers 2 main.wsgi
+fi
+}
+
 
 pip3 install -r requirements.txt && \
 python3 manage.py makemigrations && python3 manage.py migrate && \
 create_admin_user && \
-python3 manage.py collectstatic --noinput && gunicorn --workers 2 main.wsgi
\ No newline at end of file
+python3 manage.py collectstatic --noinput && start_server
\ No newline at end of file